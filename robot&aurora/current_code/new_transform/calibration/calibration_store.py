@@ -0,0 +1,208 @@
+# キャリブレーション結果 ([T_aurora_from_robot], [T_arm_from_sensor]) を保存・再利用するためのキャッシュ
+
+# プログラムの流れ
+# 1. ワールド・ハンドアイ用csvファイルの内容とソルバー設定からSHA-256のキーを作成する
+# 2. 同じキーの結果がメモリ上またはキャッシュディレクトリ(.npz)にあればそれを返す
+# 3. なければキャリブレーションを実行し、結果と残差統計をキャッシュに保存する
+#    csvファイルの内容が変わるとキーが変わるため、古い結果は自動的に使われなくなる
+
+import hashlib
+import json
+import os
+import numpy as np
+from .logger import get_logger
+from .world_calibration import WorldCalibration
+from .handeye_calibration import HandEyeCalibration
+
+log = get_logger(__name__)
+
+# ソルバーの計算内容を変更した場合はこの値を上げて既存のキャッシュを無効化する
+SOLVER_VERSION = 1
+
+# キャッシュディレクトリ名 (csvファイルと同じディレクトリに作成)
+DEFAULT_CACHE_DIR_NAME = ".calibration_cache"
+
+# ファイルパス -> (更新時刻, サイズ, ハッシュ値)
+# 毎サイクル呼ばれてもファイルが変わっていなければcsvを読み直さない
+_file_digest_cache = {}
+
+# キー -> CalibrationResult (プロセス内のメモリキャッシュ)
+_result_memo = {}
+
+
+class CalibrationResult:
+    def __init__(self, T_aurora_from_robot, T_arm_from_sensor, world_residuals=None, hand_eye_residuals=None):
+        """
+        T_aurora_from_robot: 4x4同次変換行列
+        T_arm_from_sensor: 4x4同次変換行列
+        world_residuals: ワールドキャリブレーションの残差統計 (dict)
+        hand_eye_residuals: ハンドアイキャリブレーションの残差統計 (dict)
+        """
+        self.T_aurora_from_robot = T_aurora_from_robot
+        self.T_arm_from_sensor = T_arm_from_sensor
+        self.world_residuals = world_residuals or {}
+        self.hand_eye_residuals = hand_eye_residuals or {}
+
+    def __repr__(self):
+        return (f"CalibrationResult(world_residuals={self.world_residuals}, "
+                f"hand_eye_residuals={self.hand_eye_residuals})")
+
+
+def file_digest(file_path):
+    """
+    ファイル内容のSHA-256を返す
+    更新時刻とサイズが前回と同じ場合はファイルを読まずに前回の値を返す
+    """
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    cached = _file_digest_cache.get(abs_path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(abs_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _file_digest_cache[abs_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def default_solver_settings():
+    """キャッシュキーに含めるソルバー設定"""
+    return {
+        "solver_version": SOLVER_VERSION,
+        "world": "kabsch_svd",
+        "hand_eye": "rotation_svd_mean+translation_lstsq",
+    }
+
+
+class CalibrationStore:
+    def __init__(self, cache_dir):
+        """cache_dir: キャリブレーション結果(.npz)を保存するディレクトリ"""
+        self.cache_dir = cache_dir
+
+    def compute_key(self, world_calib_csv, hand_eye_calib_csv, settings=None):
+        """
+        入力csvの内容とソルバー設定からキャッシュキーを作成する
+        戻り値: 16進数のSHA-256文字列
+        """
+        if settings is None:
+            settings = default_solver_settings()
+        sha = hashlib.sha256()
+        sha.update(file_digest(world_calib_csv).encode())
+        sha.update(file_digest(hand_eye_calib_csv).encode())
+        sha.update(json.dumps(settings, sort_keys=True).encode())
+        return sha.hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, f"calib_{key[:32]}.npz")
+
+    def load(self, key):
+        """
+        キーに対応するキャリブレーション結果を読み込む
+        戻り値: CalibrationResult (存在しない・壊れている場合は None)
+        """
+        if key in _result_memo:
+            return _result_memo[key]
+
+        path = self._path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["key"]) != key:
+                    return None
+                world_residuals = {name[len("world_"):]: float(data[name])
+                                   for name in data.files if name.startswith("world_")}
+                hand_eye_residuals = {name[len("hand_eye_"):]: float(data[name])
+                                      for name in data.files if name.startswith("hand_eye_")}
+                result = CalibrationResult(
+                    data["T_aurora_from_robot"].copy(),
+                    data["T_arm_from_sensor"].copy(),
+                    world_residuals,
+                    hand_eye_residuals,
+                )
+        except Exception as e:
+            log.warning("警告: キャリブレーションキャッシュを読み込めません (%s): %s", path, e)
+            return None
+
+        _result_memo[key] = result
+        return result
+
+    def save(self, key, result):
+        """キャリブレーション結果をキャッシュディレクトリに保存する"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        arrays = {
+            "key": np.array(key),
+            "T_aurora_from_robot": np.asarray(result.T_aurora_from_robot, dtype=np.float64),
+            "T_arm_from_sensor": np.asarray(result.T_arm_from_sensor, dtype=np.float64),
+        }
+        for name, value in result.world_residuals.items():
+            arrays[f"world_{name}"] = np.float64(value)
+        for name, value in result.hand_eye_residuals.items():
+            arrays[f"hand_eye_{name}"] = np.float64(value)
+
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        path = self._path_for(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        _result_memo[key] = result
+
+    def load_or_calibrate(self, world_calib_csv, hand_eye_calib_csv, settings=None):
+        """
+        キャッシュに結果があれば返し、なければキャリブレーションを実行して保存する
+        戻り値: CalibrationResult (キャリブレーションに失敗した場合は None)
+        """
+        try:
+            key = self.compute_key(world_calib_csv, hand_eye_calib_csv, settings)
+        except FileNotFoundError as e:
+            log.error("エラー: CSVファイルが見つかりません: %s", e.filename)
+            return None
+
+        result = self.load(key)
+        if result is not None:
+            return result
+
+        result = run_calibration(world_calib_csv, hand_eye_calib_csv)
+        if result is not None:
+            self.save(key, result)
+        return result
+
+
+def run_calibration(world_calib_csv, hand_eye_calib_csv):
+    """
+    ワールドキャリブレーションとハンドアイキャリブレーションを順に実行する
+    戻り値: CalibrationResult (失敗した場合は None)
+    """
+    world_calib = WorldCalibration(world_calib_csv)
+    T_aurora_from_robot = world_calib.run()
+    if T_aurora_from_robot is None:
+        return None
+
+    hand_eye_calib = HandEyeCalibration(hand_eye_calib_csv, T_aurora_from_robot)
+    T_arm_from_sensor = hand_eye_calib.run()
+    if T_arm_from_sensor is None:
+        return None
+
+    return CalibrationResult(T_aurora_from_robot, T_arm_from_sensor,
+                             world_calib.residuals, hand_eye_calib.residuals)
+
+
+def load_or_run_calibration(world_calib_csv, hand_eye_calib_csv, cache_dir=None, use_cache=True):
+    """
+    キャッシュを利用してキャリブレーション結果を取得する
+    world_calib_csv: ワールドキャリブレーション用CSVファイルのパス
+    hand_eye_calib_csv: ハンドアイキャリブレーション用CSVファイルのパス
+    cache_dir: キャッシュディレクトリ (省略時はworld_calib_csvと同じディレクトリの .calibration_cache)
+    use_cache: False の場合は毎回キャリブレーションを実行する
+    戻り値: CalibrationResult (失敗した場合は None)
+    """
+    if not use_cache:
+        return run_calibration(world_calib_csv, hand_eye_calib_csv)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(world_calib_csv), DEFAULT_CACHE_DIR_NAME)
+    return CalibrationStore(cache_dir).load_or_calibrate(world_calib_csv, hand_eye_calib_csv)
@@ -0,0 +1,110 @@
+# 逐次キャリブレーションの推定値が収束したかを判定するクラス
+#
+# 推定値の変化が小さくなっても、それまでに集めた点がほぼ直線上・平面上に並んでいる場合は
+# 推定値が安定したまま誤っていることがあるため、点の広がり (PointSpread) が十分になるまでは収束としない
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+
+class PointSpread:
+    def __init__(self):
+        """
+        3次元の点群の広がりを1点ずつ逐次的に計算するクラス
+        重心まわりの共分散行列をオンラインで更新するため、点群全体を保持しない
+        広がり = 重心を引いた点群の最小の特異値 / sqrt(点数) (最も薄い方向の二乗平均平方根距離)
+        """
+        self.count = 0
+        self.centroid = np.zeros(3)
+        # 重心まわりの散布行列 S = Σ (p_i - centroid) (p_i - centroid)^T
+        self.S = np.zeros((3, 3))
+
+    def add(self, point):
+        """1点を追加する (Welford法)"""
+        point = np.asarray(point, dtype=np.float64)
+        self.count += 1
+        delta = point - self.centroid
+        self.centroid += delta / self.count
+        self.S += np.outer(point - self.centroid, delta)
+
+    @property
+    def spread(self):
+        """最も薄い方向の広がり (3点未満の場合は 0)"""
+        if self.count < 3:
+            return 0.0
+        eigenvalues = np.linalg.eigvalsh((self.S + self.S.T) / 2)
+        return float(np.sqrt(max(eigenvalues[0], 0.0) / self.count))
+
+
+class RotationSpread(PointSpread):
+    def __init__(self):
+        """
+        姿勢の広がりを逐次的に計算するクラス
+        最初の姿勢からの相対回転を回転ベクトル [度] の点として PointSpread に加える
+        (回転ベクトルそのものは180度付近で符号が反転するため、相対回転を使う)
+        """
+        super().__init__()
+        self.reference = None
+
+    def add(self, rotation_matrix):
+        """1姿勢 (3x3 回転行列) を追加する"""
+        rotation_matrix = np.asarray(rotation_matrix, dtype=np.float64)
+        if self.reference is None:
+            self.reference = rotation_matrix.T
+        super().add(R.from_matrix(self.reference @ rotation_matrix).as_rotvec(degrees=True))
+
+
+class ConvergenceMonitor:
+    def __init__(self, translation_tol=0.1, rotation_tol_deg=0.05, patience=10, min_samples=10, min_spread=None):
+        """
+        translation_tol: 収束とみなす並進の変化量 [mm]
+        rotation_tol_deg: 収束とみなす回転の変化量 [度]
+        patience: 変化量が許容値以下のまま連続したサンプル数がこの値に達したら収束とする
+        min_samples: 収束判定を行う最小サンプル数
+        min_spread: 収束とみなす点の広がりの最小値 (update() に渡す spread と同じ単位、省略時は判定しない)
+        """
+        self.translation_tol = translation_tol
+        self.rotation_tol_deg = rotation_tol_deg
+        self.patience = patience
+        self.min_samples = min_samples
+        self.min_spread = min_spread
+
+        self.samples = 0
+        self.stable_count = 0
+        self.last_T = None
+        self.delta_t = float("nan")
+        self.delta_angle_deg = float("nan")
+        self.spread = 0.0
+
+    def update(self, T, spread=None):
+        """
+        新しい推定値を与えて収束状態を更新する
+        T: 4x4の同次変換行列 (まだ推定できない場合は None)
+        spread: それまでに集めた点の広がり (PointSpread.spread など)
+        戻り値: 収束していれば True
+        """
+        self.samples += 1
+        if spread is not None:
+            self.spread = spread
+        if T is None:
+            self.stable_count = 0
+            return False
+
+        if self.last_T is not None:
+            self.delta_t = float(np.linalg.norm(T[:3, 3] - self.last_T[:3, 3]))
+            R_diff = self.last_T[:3, :3].T @ T[:3, :3]
+            cos_angle = np.clip((np.trace(R_diff) - 1.0) / 2.0, -1.0, 1.0)
+            self.delta_angle_deg = float(np.degrees(np.arccos(cos_angle)))
+
+            if self.delta_t <= self.translation_tol and self.delta_angle_deg <= self.rotation_tol_deg:
+                self.stable_count += 1
+            else:
+                self.stable_count = 0
+
+        self.last_T = T
+        return self.converged
+
+    @property
+    def converged(self):
+        return (self.samples >= self.min_samples and self.stable_count >= self.patience
+                and (self.min_spread is None or self.spread >= self.min_spread))
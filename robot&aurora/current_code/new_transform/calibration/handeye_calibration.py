@@ -10,30 +10,52 @@
 # 6. 返り値として[T_arm_from_sensor]を返す
 
 import numpy as np
-from .transformation_utils import Transform, load_csv_data
+from .logger import get_logger
+from .transformation_utils import Transform, load_csv_transforms, to_transform_array
+
+log = get_logger(__name__)
+
+
+def solve_rotation_mean(R_X_sum):
+    """
+    R_X_i の合計から、最も近い回転行列（R_X_i の「平均」）をSVDで求める
+    R_X_sum: sum_i(R_sensor_i.T @ R_arm_i) (3, 3)
+    戻り値: R_arm_from_sensor (3, 3)
+    """
+    U, S, Vt = np.linalg.svd(R_X_sum)
+
+    R_arm_from_sensor = U @ Vt
+
+    # det(R) = 1 を保証 (右手座標系)
+    if np.linalg.det(R_arm_from_sensor) < 0:
+        Vt_copy = Vt.copy()
+        Vt_copy[-1, :] *= -1 # Vの最後の行の符号を反転
+        R_arm_from_sensor = U @ Vt_copy
+
+    return R_arm_from_sensor
+
 
 class HandEyeCalibration:
     def __init__(self, csv_path, T_aurora_from_robot):
         self.csv_path = csv_path
         self.T_aurora_from_robot = T_aurora_from_robot
         self.T_aurora_from_robot_transform = Transform.from_matrix(T_aurora_from_robot)
+        # run() 実行後に残差統計が格納される
+        self.residuals = None
     
     def load_and_prepare_data(self):
         """
         CSVからデータを読み込み、センサーの姿勢をロボット座標系に変換する。
 
         Returns:
-            (list, list): T_arm_from_robotのリスト, T_sensor_from_robotのリスト
+            (TransformArray, TransformArray): T_arm_from_robot, T_sensor_from_robot
         """
-        T_arm_from_robot_list, T_sensor_from_aurora_list = load_csv_data(self.csv_path)
+        T_arm_from_robot_array, T_sensor_from_aurora_array = load_csv_transforms(self.csv_path)
 
-        T_sensor_from_robot_list = []
-        for T_sensor_from_aurora in T_sensor_from_aurora_list:
-            T_sensor_from_aurora_transform = Transform.from_matrix(T_sensor_from_aurora)
-            T_sensor_from_robot = self.T_aurora_from_robot_transform @ T_sensor_from_aurora_transform
-            T_sensor_from_robot_list.append(T_sensor_from_robot.matrix)
+        # 全点の T_sensor_from_robot = T_aurora_from_robot @ T_sensor_from_aurora を一括で計算
+        T_sensor_from_robot_array = self.T_aurora_from_robot_transform @ T_sensor_from_aurora_array
 
-        return T_arm_from_robot_list, T_sensor_from_robot_list
+        return T_arm_from_robot_array, T_sensor_from_robot_array
 
     def solve_hand_eye_calibration(self, T_arm_from_robot_list, T_sensor_from_robot_list):
         """
@@ -41,8 +63,8 @@ class HandEyeCalibration:
         T_arm_from_robot = T_sensor_from_robot @ X となる最適な T_arm_from_sensor (X) を推定する。
 
         Args:
-            T_arm_list (list): アーム姿勢 (T_arm_from_robot) の 4x4 行列のリスト
-            T_sensor_list (list): センサー姿勢 (T_sensor_from_robot) の 4x4 行列のリスト
+            T_arm_from_robot_list (TransformArray | list): アーム姿勢 (T_arm_from_robot)。4x4 行列のリストや (N, 4, 4) 配列も可
+            T_sensor_from_robot_list (TransformArray | list): センサー姿勢 (T_sensor_from_robot)。4x4 行列のリストや (N, 4, 4) 配列も可
         
         Returns:
             np.ndarray: 推定された T_arm_from_sensor (X) の 4x4 行列
@@ -51,43 +73,27 @@ class HandEyeCalibration:
         if n == 0:
             raise ValueError("キャリブレーションデータが空です。")
         
-        R_arm_from_robot_list = []
-        t_arm_from_robot_list = []
-        R_sensor_from_robot_list = []
-        t_sensor_from_robot_list = []
-        
-        # データを回転行列(R)と並進ベクトル(t)に分離
-        for T_arm_from_robot, T_sensor_from_robot in zip(T_arm_from_robot_list, T_sensor_from_robot_list):
-            T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
-            T_sensor_from_robot_transform = Transform.from_matrix(T_sensor_from_robot)
-            R_arm_from_robot_list.append(T_arm_from_robot_transform.R)
-            t_arm_from_robot_list.append(T_arm_from_robot_transform.t)
-            R_sensor_from_robot_list.append(T_sensor_from_robot_transform.R)
-            t_sensor_from_robot_list.append(T_sensor_from_robot_transform.t)
+        T_arm_from_robot_array = to_transform_array(T_arm_from_robot_list)
+        T_sensor_from_robot_array = to_transform_array(T_sensor_from_robot_list)
+
+        # 回転行列(R) (N, 3, 3) と並進ベクトル(t) (N, 3)
+        R_arm_from_robot_array = T_arm_from_robot_array.R
+        t_arm_from_robot_array = T_arm_from_robot_array.t
+        R_sensor_from_robot_array = T_sensor_from_robot_array.R
+        t_sensor_from_robot_array = T_sensor_from_robot_array.t
 
         # --- 1. 回転 R_arm_from_sensor の推定 ---
         # R_arm = R_sensor @ R_X -> R_X = R_sensor.T @ R_arm
         # 全ての R_X_i の「平均」をSVDで求める
         
-        # R_X (求めたい回転) の候補の合計
-        R_X_sum = np.zeros((3, 3)) 
-        for R_sensor_from_robot, R_arm_from_robot in zip(R_sensor_from_robot_list, R_arm_from_robot_list):
-            R_X_i = R_sensor_from_robot.T @ R_arm_from_robot
-            R_X_sum += R_X_i
+        # R_X (求めたい回転) の候補の合計 sum_i(R_sensor_i.T @ R_arm_i)
+        R_X_sum = np.einsum('nji,njk->ik', R_sensor_from_robot_array, R_arm_from_robot_array)
         
         try:
-            U, S, Vt = np.linalg.svd(R_X_sum)
+            R_arm_from_sensor = solve_rotation_mean(R_X_sum)
         except np.linalg.LinAlgError as e:
-            print(f"SVD計算エラー: {e}")
+            log.error("SVD計算エラー: %s", e)
             return None
-
-        R_arm_from_sensor = U @ Vt
-
-        # det(R) = 1 を保証 (右手座標系)
-        if np.linalg.det(R_arm_from_sensor) < 0:
-            Vt_copy = Vt.copy()
-            Vt_copy[-1, :] *= -1 # Vの最後の行の符号を反転
-            R_arm_from_sensor = U @ Vt_copy
         
         # --- 2. 並進 t_arm_from_sensor の推定 ---
         # t_arm = R_sensor @ t_X + t_sensor
@@ -95,21 +101,17 @@ class HandEyeCalibration:
         # これを全てのiについてスタックし、(3n x 3) @ (3 x 1) = (3n x 1) の形にする
         
         # R_sensor を縦に積んだ行列 (3n, 3)
-        R_sensor_stack = np.vstack(R_sensor_from_robot_list) 
-        
-        t_diff_list = []
-        for t_sensor_from_robot, t_arm_from_robot in zip(t_sensor_from_robot_list, t_arm_from_robot_list):
-            t_diff_list.append(t_arm_from_robot - t_sensor_from_robot)
+        R_sensor_stack = R_sensor_from_robot_array.reshape(-1, 3)
 
         # (t_arm - t_sensor) を縦に積んだベクトル (3n,)
-        t_diff_stack = np.concatenate(t_diff_list) 
+        t_diff_stack = (t_arm_from_robot_array - t_sensor_from_robot_array).reshape(-1)
         
         # 最小二乗法で t_X (t_arm_from_sensor) を解く
         try:
             # t_arm_from_sensor が t_X に相当
             t_arm_from_sensor, _, _, _ = np.linalg.lstsq(R_sensor_stack, t_diff_stack, rcond=None)
         except np.linalg.LinAlgError as e:
-            print(f"最小二乗法の計算に失敗しました: {e}")
+            log.error("最小二乗法の計算に失敗しました: %s", e)
             return None
 
         # --- 3. T_arm_from_sensor の組み立て ---
@@ -117,6 +119,36 @@ class HandEyeCalibration:
         
         return T_arm_from_sensor
 
+    def compute_residuals(self, T_arm_from_robot_list, T_sensor_from_robot_list, T_arm_from_sensor):
+        """
+        推定した T_arm_from_sensor の残差統計を求める。
+
+        Args:
+            T_arm_from_robot_list (TransformArray | list): アーム姿勢 (T_arm_from_robot)
+            T_sensor_from_robot_list (TransformArray | list): センサー姿勢 (T_sensor_from_robot)
+            T_arm_from_sensor (np.ndarray): 推定された T_arm_from_sensor の 4x4 行列
+
+        Returns:
+            dict: 並進残差のRMS・最大値 [mm] と回転残差の平均・最大値 [度]
+        """
+        T_arm = to_transform_array(T_arm_from_robot_list)
+        T_sensor = to_transform_array(T_sensor_from_robot_list)
+        T_arm_predicted = T_sensor @ Transform.from_matrix(T_arm_from_sensor)
+
+        t_errors = np.linalg.norm(T_arm_predicted.t - T_arm.t, axis=1)
+
+        # R_pred^T @ R_arm のトレースから回転誤差角を求める
+        R_diff = np.einsum('nji,njk->nik', T_arm_predicted.R, T_arm.R)
+        cos_angle = np.clip((np.trace(R_diff, axis1=1, axis2=2) - 1.0) / 2.0, -1.0, 1.0)
+        angle_errors = np.degrees(np.arccos(cos_angle))
+
+        return {
+            "t_rms_mm": float(np.sqrt(np.mean(t_errors ** 2))),
+            "t_max_mm": float(np.max(t_errors)),
+            "rot_mean_deg": float(np.mean(angle_errors)),
+            "rot_max_deg": float(np.max(angle_errors)),
+        }
+
     def run(self):
         """
         キャリブレーションを実行するメインメソッド。
@@ -125,26 +157,88 @@ class HandEyeCalibration:
             np.ndarray: 推定された T_arm_from_sensor の 4x4 行列
         """
         try:
-            print("1. CSVからデータを読み込み、座標変換を実行しています...")
+            log.info("1. CSVからデータを読み込み、座標変換を実行しています...")
             # T_arm_from_robot_list = T_arm_from_robot のリスト
             # T_sensor_from_robot_list = T_sensor_from_robot のリスト
             T_arm_from_robot_list, T_sensor_from_robot_list = self.load_and_prepare_data()
-            print(f"   {len(T_arm_from_robot_list)} 点のデータを読み込みました。")
+            log.info("   %d 点のデータを読み込みました。", len(T_arm_from_robot_list))
 
             if len(T_arm_from_robot_list) < 3:
-                print("警告: データ点数が少なすぎます。最低3点（非共線）を推奨します。")
+                log.warning("警告: データ点数が少なすぎます。最低3点（非共線）を推奨します。")
 
-            print("2. T_arm_from_sensor を最小二乗法で推定しています...")
+            log.info("2. T_arm_from_sensor を最小二乗法で推定しています...")
             T_arm_from_sensor = self.solve_hand_eye_calibration(T_arm_from_robot_list, T_sensor_from_robot_list)
 
             if T_arm_from_sensor is not None:
-                print("3. 推定が完了しました。")
+                self.residuals = self.compute_residuals(T_arm_from_robot_list, T_sensor_from_robot_list, T_arm_from_sensor)
+                log.info("3. 推定が完了しました。")
             
             return T_arm_from_sensor
             
         except FileNotFoundError:
-            print(f"エラー: CSVファイルが見つかりません: {self.csv_path}")
+            log.error("エラー: CSVファイルが見つかりません: %s", self.csv_path)
             return None
         except Exception as e:
-            print(f"キャリブレーション中に予期せぬエラーが発生しました: {e}")
-            return None
\ No newline at end of file
+            log.error("キャリブレーション中に予期せぬエラーが発生しました: %s", e)
+            return None
+
+
+class HandEyeCalibrationAccumulator:
+    def __init__(self, T_aurora_from_robot):
+        """
+        ハンドアイキャリブレーションを1サンプルずつ逐次的に計算するクラス
+        以下の合計のみを保持するため、サンプル数によらずメモリ・計算量は一定:
+            R_X_sum = sum_i(R_sensor_i.T @ R_arm_i)            (3, 3)
+            A       = sum_i(R_sensor_i.T @ R_sensor_i)         (3, 3)  最小二乗法の正規方程式の係数行列
+            b       = sum_i(R_sensor_i.T @ (t_arm_i - t_sensor_i))  (3,)
+        T_aurora_from_robot: ワールドキャリブレーションで求めた4x4同次変換行列
+        """
+        self.T_aurora_from_robot_transform = Transform.from_matrix(np.asarray(T_aurora_from_robot, dtype=np.float64))
+        self.count = 0
+        self.R_X_sum = np.zeros((3, 3))
+        self.A = np.zeros((3, 3))
+        self.b = np.zeros(3)
+
+    def add(self, T_arm_from_robot, T_sensor_from_aurora):
+        """
+        1サンプルを追加する
+        T_arm_from_robot: アーム姿勢の4x4同次変換行列
+        T_sensor_from_aurora: センサー姿勢の4x4同次変換行列 (Aurora座標系)
+        """
+        T_arm_from_robot = np.asarray(T_arm_from_robot, dtype=np.float64)
+        T_sensor_from_robot = self.T_aurora_from_robot_transform @ Transform.from_matrix(np.asarray(T_sensor_from_aurora, dtype=np.float64))
+
+        R_sensor_T = T_sensor_from_robot.R.T
+        self.R_X_sum += R_sensor_T @ T_arm_from_robot[:3, :3]
+        self.A += R_sensor_T @ T_sensor_from_robot.R
+        self.b += R_sensor_T @ (T_arm_from_robot[:3, 3] - T_sensor_from_robot.t)
+        self.count += 1
+
+    def add_batch(self, T_arm_from_robot_array, T_sensor_from_aurora_array):
+        """
+        複数サンプルをまとめて追加する
+        T_arm_from_robot_array: アーム姿勢 (TransformArray または (N, 4, 4))
+        T_sensor_from_aurora_array: センサー姿勢 (TransformArray または (N, 4, 4))
+        """
+        T_arm = to_transform_array(T_arm_from_robot_array)
+        T_sensor = self.T_aurora_from_robot_transform @ to_transform_array(T_sensor_from_aurora_array)
+
+        self.R_X_sum += np.einsum('nji,njk->ik', T_sensor.R, T_arm.R)
+        self.A += np.einsum('nji,njk->ik', T_sensor.R, T_sensor.R)
+        self.b += np.einsum('nji,nj->i', T_sensor.R, T_arm.t - T_sensor.t)
+        self.count += len(T_arm)
+
+    def transform(self):
+        """
+        現在までのサンプルから T_arm_from_sensor を求める
+        戻り値: 4x4の同次変換行列 (3サンプル未満または計算に失敗した場合は None)
+        """
+        if self.count < 3:
+            return None
+        try:
+            R_arm_from_sensor = solve_rotation_mean(self.R_X_sum)
+            # 正規方程式 A @ t_X = b を解く（スタックした行列の最小二乗解と同じ）
+            t_arm_from_sensor = np.linalg.solve(self.A, self.b)
+        except np.linalg.LinAlgError:
+            return None
+        return Transform(R_arm_from_sensor, t_arm_from_sensor).matrix
@@ -0,0 +1,142 @@
+# キャリブレーション・座標変換・制御ループで使う、呼び出し側をブロックしないロガー
+#
+# configure_logging() を呼ぶと、呼び出し側はメッセージ (フォーマット前のレコード) を上限付きのキューに積むだけで、
+# 文字列の組み立てとコンソール・ファイルへの書き込みはバックグラウンドのスレッド (QueueListener) が行う
+# キューが一杯の場合は待たずにメッセージを捨てて数える (制御ループを止めないため)
+#
+# モジュールを import しただけではスレッドを開始しない
+# configure_logging() を呼ぶまで (および shutdown_logging() の後) は、呼び出し側のスレッドで直接標準出力に書き込む
+#
+# 使い方:
+#   log = get_logger(__name__)
+#   log.info("%d 点のデータを読み込みました。", n)          # 引数のフォーマットは書き込みスレッドで行う
+#   if log.isEnabledFor(logging.INFO):                       # 組み立てに時間がかかる表示はレベルを確認してから
+#       log.info(f"Euler angles (degrees): ...")
+#
+# configure_logging(quiet=True) (静音モード) では警告以上だけを出力し、
+# 上のように確認している関数は表示用の計算・文字列の組み立てを一切行わない
+#
+# 注意: 引数はレコードのまま書き込みスレッドに渡すため、後で書き換える配列はコピーして渡す
+
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# このリポジトリのロガーの親の名前
+LOGGER_NAME = "robot_aurora"
+
+_listener = None
+_handler = None
+_quiet = False
+_level = logging.INFO
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """キューが一杯の場合は待たずにレコードを捨てる QueueHandler"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 標準の QueueHandler は呼び出し側のスレッドでメッセージを組み立てるため、ここでは何もしない
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=logging.INFO, quiet=False, queue_size=10000, log_file=None, stream=None):
+    """
+    ロガーを設定し、書き込みスレッドを開始する (既に設定済みの場合は設定し直す)
+    level: 出力する最低のレベル (logging.DEBUG, logging.INFO など)
+    quiet: True の場合は静音モード (警告以上のみ出力し、表示用の文字列を組み立てない)
+    queue_size: キューの上限 (これを超えたメッセージは捨てる)
+    log_file: 指定した場合は時刻・レベル付きでファイルにも書き込む
+    stream: コンソールの出力先 (省略時は標準出力)
+    """
+    global _listener, _handler, _level
+    shutdown_logging()
+
+    console = logging.StreamHandler(sys.stdout if stream is None else stream)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    handlers = [console]
+    if log_file is not None:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _handler = _DroppingQueueHandler(log_queue)
+    _listener = QueueListener(log_queue, *handlers)
+    _listener.start()
+
+    _set_handler(_handler)
+    _level = level
+    set_quiet(quiet)
+
+
+def _direct_handler():
+    """configure_logging() の前後に使う、呼び出し側のスレッドで標準出力に書き込むハンドラ"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def _set_handler(handler):
+    root = logging.getLogger(LOGGER_NAME)
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.propagate = False
+
+
+def set_quiet(quiet=True):
+    """静音モードを切り替える"""
+    global _quiet
+    _quiet = quiet
+    logging.getLogger(LOGGER_NAME).setLevel(max(_level, logging.WARNING) if quiet else _level)
+
+
+def is_quiet():
+    return _quiet
+
+
+def get_logger(name=None):
+    """
+    このリポジトリのロガーを返す (書き込みスレッドは開始しない)
+    name: モジュール名など (LOGGER_NAME の子のロガーになる)
+    """
+    return logging.getLogger(LOGGER_NAME if name is None else f"{LOGGER_NAME}.{name}")
+
+
+def flush_logging():
+    """キューに積まれたメッセージが全て書き込まれるまで待つ (input() の前などで使う)"""
+    if _listener is not None:
+        _listener.queue.join()
+
+
+def dropped_messages():
+    """キューが一杯で捨てたメッセージの数"""
+    return _handler.dropped if _handler is not None else 0
+
+
+def shutdown_logging():
+    """残りのメッセージを書き込んでから書き込みスレッドを止める (以降は直接標準出力に書き込む)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        _set_handler(_direct_handler())
+        if _handler is not None and _handler.dropped:
+            print(f"警告: ログのキューが一杯のため {_handler.dropped} 件のメッセージを捨てました")
+
+
+_set_handler(_direct_handler())
+set_quiet(False)
+atexit.register(shutdown_logging)
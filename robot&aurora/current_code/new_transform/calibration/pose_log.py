@@ -0,0 +1,222 @@
+# 姿勢ログを保存・読み込みするためのバイナリ形式 (.poselog)
+
+# ファイル構成
+# 1. 固定長ヘッダー (32バイト)
+#    magic(8) "POSELOG\0", version(uint32), 列数(uint32), 行数(uint64), ヘッダー全体のサイズ(uint32), 予約(4)
+# 2. 列名 (列数 × 32バイト, ASCII, 0埋め)
+# 3. データ本体: float64 (リトルエンディアン) の固定長レコードを行数分並べたもの
+#    np.memmap で (行数, 列数) の配列としてそのまま読み込める
+#
+# 行数はファイルサイズからも求められるため、書き込み途中で終了したファイルも読み込める
+
+import csv
+import os
+import struct
+import numpy as np
+from .logger import get_logger
+
+log = get_logger(__name__)
+
+POSE_LOG_EXTENSION = ".poselog"
+POSE_LOG_MAGIC = b"POSELOG\0"
+POSE_LOG_VERSION = 1
+
+# ロボット・オーロラの14列のスキーマ (save_to_csv_extended と同じ並び)
+POSE_LOG_COLUMNS = [
+    "robot_x", "robot_y", "robot_z",
+    "robot_rx", "robot_ry", "robot_rz",
+    "aurora_x", "aurora_y", "aurora_z",
+    "aurora_quat_x", "aurora_quat_y", "aurora_quat_z", "aurora_quat_w",
+    "aurora_quality",
+]
+
+# 複数フレームを平均した場合のばらつきの列 (位置 [mm], 姿勢 [度])
+POSE_LOG_SPREAD_COLUMNS = ["aurora_pos_spread", "aurora_rot_spread"]
+
+_PREAMBLE = struct.Struct("<8sIIQI4x")
+_COLUMN_NAME_SIZE = 32
+_HEADER_ALIGN = 64
+_DTYPE = np.dtype("<f8")
+
+
+def _header_size(n_cols):
+    size = _PREAMBLE.size + _COLUMN_NAME_SIZE * n_cols
+    return (size + _HEADER_ALIGN - 1) // _HEADER_ALIGN * _HEADER_ALIGN
+
+
+def _pack_header(columns, n_rows):
+    header_size = _header_size(len(columns))
+    header = bytearray(header_size)
+    header[:_PREAMBLE.size] = _PREAMBLE.pack(POSE_LOG_MAGIC, POSE_LOG_VERSION, len(columns), n_rows, header_size)
+    for i, name in enumerate(columns):
+        encoded = name.encode("ascii")
+        if len(encoded) > _COLUMN_NAME_SIZE:
+            raise ValueError(f"列名が長すぎます: {name}")
+        offset = _PREAMBLE.size + _COLUMN_NAME_SIZE * i
+        header[offset:offset + len(encoded)] = encoded
+    return bytes(header)
+
+
+def read_pose_log_header(file_path):
+    """
+    ヘッダーを読み込む
+    戻り値: (列名のリスト, 行数, ヘッダーサイズ)
+    """
+    with open(file_path, "rb") as f:
+        magic, version, n_cols, n_rows, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != POSE_LOG_MAGIC:
+            raise ValueError(f"poselog形式のファイルではありません: {file_path}")
+        if version != POSE_LOG_VERSION:
+            raise ValueError(f"対応していないposelogのバージョンです: {version}")
+        names = f.read(_COLUMN_NAME_SIZE * n_cols)
+
+    columns = [names[i * _COLUMN_NAME_SIZE:(i + 1) * _COLUMN_NAME_SIZE].rstrip(b"\0").decode("ascii")
+               for i in range(n_cols)]
+
+    # 書き込み途中で終了した場合に備え、ヘッダーの行数ではなくファイルサイズから完全な行数を求める
+    data_size = os.path.getsize(file_path) - header_size
+    n_rows = data_size // (_DTYPE.itemsize * n_cols) if n_cols else 0
+    return columns, n_rows, header_size
+
+
+def is_pose_log(file_path):
+    """ファイルがposelog形式かどうかを判定する"""
+    if str(file_path).endswith(POSE_LOG_EXTENSION):
+        return True
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(len(POSE_LOG_MAGIC)) == POSE_LOG_MAGIC
+    except OSError:
+        return False
+
+
+def read_pose_log(file_path, mmap=True):
+    """
+    poselogファイルを読み込む
+    file_path: poselogファイルのパス
+    mmap: True の場合は np.memmap で読み込む（ファイル全体をメモリに読み込まない）
+    戻り値: (データ (N, 列数), 列名のリスト)
+    """
+    columns, n_rows, header_size = read_pose_log_header(file_path)
+    shape = (n_rows, len(columns))
+    if n_rows == 0:
+        return np.empty(shape, dtype=_DTYPE), columns
+    if mmap:
+        data = np.memmap(file_path, dtype=_DTYPE, mode="r", offset=header_size, shape=shape)
+    else:
+        data = np.fromfile(file_path, dtype=_DTYPE, count=n_rows * len(columns), offset=header_size).reshape(shape)
+    return data, columns
+
+
+class PoseLogWriter:
+    def __init__(self, file_path, columns=None, append=False):
+        """
+        poselogファイルに行を追記するクラス
+        file_path: 出力ファイルのパス
+        columns: 列名のリスト (省略時は POSE_LOG_COLUMNS)
+        append: True かつファイルが存在する場合は既存ファイルの末尾に追記する
+        """
+        self.file_path = file_path
+        self.columns = list(columns) if columns is not None else list(POSE_LOG_COLUMNS)
+
+        if append and os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            existing_columns, n_rows, header_size = read_pose_log_header(file_path)
+            if existing_columns != self.columns:
+                raise ValueError(f"既存ファイルと列構成が一致しません: {file_path}")
+            self._file = open(file_path, "r+b")
+            # 途中までしか書かれていない行は切り捨てる
+            self._file.truncate(header_size + n_rows * len(self.columns) * _DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+            self.n_rows = n_rows
+        else:
+            output_dir = os.path.dirname(file_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            self._file = open(file_path, "w+b")
+            self._file.write(_pack_header(self.columns, 0))
+            self.n_rows = 0
+
+    def write_rows(self, rows):
+        """rows: (k, 列数) の配列を追記する"""
+        rows = np.ascontiguousarray(rows, dtype=_DTYPE).reshape(-1, len(self.columns))
+        self._file.write(rows.tobytes())
+        self.n_rows += len(rows)
+
+    def write_row(self, row):
+        """1行を追記する"""
+        self.write_rows([row])
+
+    def _write_row_count(self):
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(_pack_header(self.columns, self.n_rows)[:_PREAMBLE.size])
+        self._file.seek(position)
+
+    def flush(self, fsync=False):
+        """バッファを書き出す。fsync=True の場合はディスクへの書き込みまで待つ"""
+        self._write_row_count()
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def tell(self):
+        """現在のファイルサイズ（書き込み位置）を返す"""
+        return self._file.tell()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_pose_log(file_path, data, columns=None):
+    """(N, 列数) の配列をposelogファイルに保存する"""
+    with PoseLogWriter(file_path, columns) as writer:
+        writer.write_rows(data)
+
+
+def convert_csv_to_pose_log(csv_path, output_path=None):
+    """
+    既存のCSVファイルをposelog形式に変換する
+    csv_path: 変換元CSVファイルのパス（1行目はヘッダー）
+    output_path: 出力ファイルのパス（省略時は拡張子を .poselog に置き換えたパス）
+    戻り値: 出力ファイルのパス
+    """
+    if output_path is None:
+        output_path = os.path.splitext(csv_path)[0] + POSE_LOG_EXTENSION
+
+    with open(csv_path, newline="") as f:
+        columns = [name.strip() for name in next(csv.reader(f))]
+    data = np.loadtxt(csv_path, skiprows=1, delimiter=",", ndmin=2)
+
+    write_pose_log(output_path, data, columns)
+    return output_path
+
+
+def save_to_pose_log(robot_data, aurora_data, filename):
+    """
+    ロボット・オーロラのデータ（save_to_csv_extended と同じ辞書）をposelog形式で保存する
+    CSVとは異なり値を丸めずにfloat64のまま保存する
+    aurora_data にばらつき ('pos_spread', 'rot_spread') がある場合はその列も保存する
+    """
+    columns = [
+        robot_data['x'], robot_data['y'], robot_data['z'],
+        robot_data['rx'], robot_data['ry'], robot_data['rz'],
+        aurora_data['x'], aurora_data['y'], aurora_data['z'],
+        aurora_data['quat_x'], aurora_data['quat_y'], aurora_data['quat_z'], aurora_data['quat_w'],
+        aurora_data['quality'],
+    ]
+    names = list(POSE_LOG_COLUMNS)
+    if 'pos_spread' in aurora_data and 'rot_spread' in aurora_data:
+        columns += [aurora_data['pos_spread'], aurora_data['rot_spread']]
+        names += POSE_LOG_SPREAD_COLUMNS
+    data = np.column_stack(columns)
+    write_pose_log(filename, data, names)
+    log.info("拡張データを %s に保存しました。合計 %d 行。", filename, len(data))
@@ -0,0 +1,80 @@
+# キャリブレーション結果を保持し、Aurora座標系の目標姿勢をロボット座標系のアーム姿勢に変換するクラス
+
+# 計算式
+# T_sensor_from_robot = T_aurora_from_robot @ T_sensor_from_aurora
+# T_arm_from_robot = T_sensor_from_robot @ T_arm_from_sensor
+# キャリブレーションは生成時に1度だけ行い、transform() は行列積のみを計算する
+
+import numpy as np
+from .calibration_store import load_or_run_calibration
+from .transformation_utils import quat_to_matrix
+
+
+class PoseTransformer:
+    def __init__(self, T_aurora_from_robot, T_arm_from_sensor):
+        """
+        T_aurora_from_robot: 4x4同次変換行列 (ワールドキャリブレーションの結果)
+        T_arm_from_sensor: 4x4同次変換行列 (ハンドアイキャリブレーションの結果)
+        """
+        self.T_aurora_from_robot = np.asarray(T_aurora_from_robot, dtype=np.float64)
+        self.T_arm_from_sensor = np.asarray(T_arm_from_sensor, dtype=np.float64)
+
+        self._R_aurora_from_robot = self.T_aurora_from_robot[:3, :3].copy()
+        self._t_aurora_from_robot = self.T_aurora_from_robot[:3, 3].copy()
+        self._R_arm_from_sensor = self.T_arm_from_sensor[:3, :3].copy()
+        self._t_arm_from_sensor = self.T_arm_from_sensor[:3, 3].copy()
+
+    @classmethod
+    def from_calibration(cls, world_calib_csv, hand_eye_calib_csv, cache_dir=None, use_cache=True):
+        """
+        キャリブレーション用CSVから生成する（結果はキャッシュを利用）
+        world_calib_csv: ワールドキャリブレーション用CSVファイルのパス
+        hand_eye_calib_csv: ハンドアイキャリブレーション用CSVファイルのパス
+        """
+        calibration = load_or_run_calibration(world_calib_csv, hand_eye_calib_csv,
+                                              cache_dir=cache_dir, use_cache=use_cache)
+        if calibration is None:
+            raise RuntimeError("キャリブレーションに失敗しました。")
+        return cls(calibration.T_aurora_from_robot, calibration.T_arm_from_sensor)
+
+    def _compose(self, R_sensor_from_aurora, t_sensor_from_aurora):
+        """(N, 3, 3), (N, 3) の T_sensor_from_aurora から (N, 4, 4) の T_arm_from_robot を求める"""
+        R_sensor_from_robot = self._R_aurora_from_robot @ R_sensor_from_aurora
+        t_sensor_from_robot = t_sensor_from_aurora @ self._R_aurora_from_robot.T + self._t_aurora_from_robot
+
+        T_arm_from_robot = np.zeros((len(t_sensor_from_aurora), 4, 4))
+        T_arm_from_robot[:, :3, :3] = R_sensor_from_robot @ self._R_arm_from_sensor
+        T_arm_from_robot[:, :3, 3] = R_sensor_from_robot @ self._t_arm_from_sensor + t_sensor_from_robot
+        T_arm_from_robot[:, 3, 3] = 1.0
+        return T_arm_from_robot
+
+    def transform(self, goal_point, goal_quat):
+        """
+        Aurora座標系の目標姿勢1つをロボット座標系のアーム姿勢に変換する
+        goal_point: センサーの目標位置 [x, y, z]
+        goal_quat: センサーの目標クォータニオン [x, y, z, w]
+        戻り値: T_arm_from_robot: 4x4同次変換行列
+        """
+        return self.transform_batch([goal_point], [goal_quat])[0]
+
+    def transform_batch(self, goal_points, goal_quats):
+        """
+        N個の目標姿勢をまとめて変換する
+        goal_points: センサーの目標位置 (N, 3)
+        goal_quats: センサーの目標クォータニオン (N, 4) [x, y, z, w]
+        戻り値: T_arm_from_robot: (N, 4, 4)
+        """
+        t_sensor_from_aurora = np.asarray(goal_points, dtype=np.float64).reshape(-1, 3)
+        R_sensor_from_aurora = quat_to_matrix(np.asarray(goal_quats, dtype=np.float64).reshape(-1, 4))
+        return self._compose(R_sensor_from_aurora, t_sensor_from_aurora)
+
+    def transform_matrix(self, T_sensor_from_aurora):
+        """
+        4x4同次変換行列で与えた目標姿勢を変換する
+        T_sensor_from_aurora: (4, 4) または (N, 4, 4)
+        戻り値: T_arm_from_robot: 入力と同じ形状
+        """
+        T = np.asarray(T_sensor_from_aurora, dtype=np.float64)
+        T_stack = T.reshape(-1, 4, 4)
+        T_arm_from_robot = self._compose(T_stack[:, :3, :3], T_stack[:, :3, 3])
+        return T_arm_from_robot.reshape(T.shape)
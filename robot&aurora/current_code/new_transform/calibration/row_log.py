@@ -0,0 +1,264 @@
+# 収集・評価のデータを1点ごとにファイルへ追記するための書き込みクラス
+#
+# 従来は全点のデータをリストに溜めて最後に save_to_csv_extended で保存していたため、
+# 途中で異常終了・Ctrl+C すると全てのデータが失われ、メモリも点数に比例して増えていた
+# RowLogWriter は取得した行をすぐにファイルに書き込み (OSのバッファまで)、
+# fsync_every 行ごと、または fsync_interval 秒ごとにまとめて fsync してディスクに書き込む
+#
+# - 拡張子が .poselog の場合はバイナリ形式 (PoseLogWriter、値は丸めない)
+#   それ以外は CSV (CsvLogWriter、save_to_csv_extended と同じく小数点以下 decimal_places 桁に丸める)
+# - SIGINT (Ctrl+C) / SIGTERM を受けたときは書き込み済みの行を fsync してから元の処理 (KeyboardInterrupt など) を行う
+# - append=True の場合は既存ファイルの末尾に追記する (途中までしか書かれていない行は切り捨てる)
+
+import csv
+import os
+import signal
+import threading
+import time
+import numpy as np
+from .logger import get_logger
+from .pose_log import POSE_LOG_EXTENSION, POSE_LOG_COLUMNS, POSE_LOG_SPREAD_COLUMNS, PoseLogWriter
+
+log = get_logger(__name__)
+
+# キャリブレーション用の収集データの16列 (get_*_calibration_csv.py の save_to_csv_extended と同じ並び)
+CALIBRATION_LOG_COLUMNS = POSE_LOG_COLUMNS + POSE_LOG_SPREAD_COLUMNS
+
+# 精度評価の48列 (evaluate_transform_accuracy_*.py の save_to_csv_extended と同じ並び)
+# 収集データ、移動後のデータ、差分 (Aurora・ロボット)
+EVALUATION_LOG_COLUMNS = [
+    "robot_x", "robot_y", "robot_z",
+    "robot_rx", "robot_ry", "robot_rz",
+    "aurora_x", "aurora_y", "aurora_z",
+    "aurora_quat_x", "aurora_quat_y", "aurora_quat_z", "aurora_quat_w",
+    "aurora_quality", "aurora_pos_spread", "aurora_rot_spread",
+    "robot_after_x", "robot_after_y", "robot_after_z",
+    "robot_after_rx", "robot_after_ry", "robot_after_rz",
+    "aurora_after_x", "aurora_after_y", "aurora_after_z",
+    "aurora_after_quat_x", "aurora_after_quat_y", "aurora_after_quat_z", "aurora_after_quat_w",
+    "aurora_after_quality", "aurora_after_pos_spread", "aurora_after_rot_spread",
+    "delta_t_aurora_x", "delta_t_aurora_y", "delta_t_aurora_z", "delta_t_aurora_norm",
+    "delta_R_aurora_rx", "delta_R_aurora_ry", "delta_R_aurora_rz", "delta_R_aurora_angle",
+    "delta_t_robot_x", "delta_t_robot_y", "delta_t_robot_z", "delta_t_robot_norm",
+    "delta_R_robot_rx", "delta_R_robot_ry", "delta_R_robot_rz", "delta_R_robot_angle"
+]
+
+
+def calibration_row(robot, probe):
+    """
+    1点分のキャリブレーション用の行 (CALIBRATION_LOG_COLUMNS の並び)
+    robot: generateRobotArmAxisAngle の戻り値, probe: サンプラーが返すプローブ (ばらつき付き)
+    """
+    return [robot.pos.x, robot.pos.y, robot.pos.z,
+            robot.rot.rx, robot.rot.ry, robot.rot.rz,
+            probe.pos.x, probe.pos.y, probe.pos.z,
+            probe.quat.x, probe.quat.y, probe.quat.z, probe.quat.w,
+            probe.quality, probe.pos_spread, probe.rot_spread]
+
+
+def evaluation_rows(robot_data, aurora_data, robot_after_data, aurora_after_data,
+                    delta_t_aurora_data, delta_R_aurora_data, delta_t_robot_data, delta_R_robot_data):
+    """
+    精度評価の収集データと差分 (evaluate_accuracy の戻り値) の辞書から
+    EVALUATION_LOG_COLUMNS の並びの (点数, 48) の配列を作る (値は丸めない)
+    """
+    robot_keys = ('x', 'y', 'z', 'rx', 'ry', 'rz')
+    aurora_keys = ('x', 'y', 'z', 'quat_x', 'quat_y', 'quat_z', 'quat_w', 'quality', 'pos_spread', 'rot_spread')
+    columns = []
+    for data, keys in ((robot_data, robot_keys), (aurora_data, aurora_keys),
+                       (robot_after_data, robot_keys), (aurora_after_data, aurora_keys),
+                       (delta_t_aurora_data, ('x', 'y', 'z', 'norm')), (delta_R_aurora_data, ('rx', 'ry', 'rz', 'angle')),
+                       (delta_t_robot_data, ('x', 'y', 'z', 'norm')), (delta_R_robot_data, ('rx', 'ry', 'rz', 'angle'))):
+        columns += [data[key] for key in keys]
+    return np.column_stack(columns)
+
+
+def clear_collected_data(*datasets):
+    """収集データの辞書 (値はリスト) を空にする (ファイルに追記した後に使う)"""
+    for data in datasets:
+        for values in data.values():
+            values.clear()
+
+
+class CsvLogWriter:
+    def __init__(self, file_path, columns, decimal_places=3, append=False, integer_columns=()):
+        """
+        CSVファイルに行を追記するクラス (PoseLogWriter と同じ使い方)
+        file_path: 出力ファイルのパス
+        columns: 列名のリスト (1行目のヘッダー)
+        decimal_places: 値を丸める小数点以下の桁数 (None の場合は丸めない)
+        append: True かつファイルが存在する場合は既存ファイルの末尾に追記する
+        integer_columns: 整数で書く列名のリスト (番号・点数など。"1.0" ではなく "1" と書く)
+        """
+        self.file_path = file_path
+        self.columns = list(columns)
+        self.decimal_places = decimal_places
+        self._integer_indices = [self.columns.index(name) for name in integer_columns]
+
+        if append and os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            with open(file_path, newline="") as f:
+                existing_columns = [name.strip() for name in next(csv.reader(f))]
+            if existing_columns != self.columns:
+                raise ValueError(f"既存ファイルと列構成が一致しません: {file_path}")
+            self._file = open(file_path, "r+", newline="")
+            self.n_rows = self._truncate_partial_row()
+            self._file.seek(0, os.SEEK_END)
+        else:
+            output_dir = os.path.dirname(file_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            self._file = open(file_path, "w", newline="")
+            csv.writer(self._file).writerow(self.columns)
+            self.n_rows = 0
+        self._writer = csv.writer(self._file)
+
+    def _truncate_partial_row(self):
+        """改行で終わっていない最後の行を切り捨て、データの行数を返す"""
+        self._file.flush()
+        with open(self.file_path, "rb") as f:
+            content = f.read()
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            self._file.truncate(end)
+        # ヘッダー行を除く
+        return max(content.count(b"\n", 0, end) - 1, 0)
+
+    def write_rows(self, rows):
+        """rows: (k, 列数) の配列を追記する"""
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.columns))
+        if self.decimal_places is not None:
+            rows = np.round(rows, self.decimal_places)
+        # save_to_csv_extended と同じ表記で書く (np.float64 は float のサブクラスなので tolist() でも文字列は同じ)
+        rows = rows.tolist()
+        for row in rows:
+            for index in self._integer_indices:
+                row[index] = int(row[index])
+        self._writer.writerows(rows)
+        self.n_rows += len(rows)
+
+    def write_row(self, row):
+        """1行を追記する"""
+        self.write_rows([row])
+
+    def flush(self, fsync=False):
+        """バッファを書き出す。fsync=True の場合はディスクへの書き込みまで待つ"""
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def tell(self):
+        """現在のファイルサイズ（書き込み位置）を返す"""
+        return self._file.tell()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RowLogWriter:
+    def __init__(self, file_path, columns, decimal_places=3, append=False, fsync_every=10, fsync_interval=5.0,
+                 handle_signals=True, integer_columns=()):
+        """
+        1行ずつ追記し、まとめて fsync する書き込みクラス
+        file_path: 出力ファイルのパス (.poselog はバイナリ形式、それ以外は CSV)
+        columns: 列名のリスト
+        decimal_places: CSV の値を丸める小数点以下の桁数
+        append: True の場合は既存ファイルの末尾に追記する
+        fsync_every: この行数を書くごとに fsync する
+        fsync_interval: 前回の fsync からこの時間 [秒] が経っていたら fsync する
+        handle_signals: SIGINT / SIGTERM (Windows では SIGBREAK も) を受けたときに fsync する (メインスレッドでのみ有効)
+        integer_columns: CSV で整数で書く列名のリスト
+        """
+        self.file_path = file_path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        if file_path.endswith(POSE_LOG_EXTENSION):
+            self._writer = PoseLogWriter(file_path, columns, append=append)
+        else:
+            self._writer = CsvLogWriter(file_path, columns, decimal_places=decimal_places, append=append,
+                                        integer_columns=integer_columns)
+        self.columns = self._writer.columns
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._previous_handlers = {}
+        if handle_signals:
+            self._install_signal_handlers()
+
+    @property
+    def n_rows(self):
+        return self._writer.n_rows
+
+    @property
+    def unsynced_rows(self):
+        """まだ fsync していない行数"""
+        return self._unsynced
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+            signum = getattr(signal, name, None)
+            if signum is None:
+                continue
+            self._previous_handlers[signum] = signal.signal(signum, self._on_signal)
+
+    def _restore_signal_handlers(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def _on_signal(self, signum, frame):
+        self.flush(fsync=True)
+        previous = self._previous_handlers.get(signum)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            # 既定の動作 (終了) の代わりに SystemExit を送出し、呼び出し側の後処理 (finally) を実行させる
+            raise SystemExit(128 + signum)
+
+    def write_row(self, row):
+        """1行を追記する (OSのバッファまで書き出し、必要なら fsync する)"""
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        """(k, 列数) の配列を追記する"""
+        self._writer.write_rows(rows)
+        self._unsynced += len(rows)
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.flush(fsync=True)
+        else:
+            self._writer.flush()
+
+    def flush(self, fsync=False):
+        if self._writer._file.closed:
+            return
+        self._writer.flush(fsync=fsync)
+        if fsync:
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def tell(self):
+        return self._writer.tell()
+
+    def close(self):
+        """残りの行を fsync して閉じる"""
+        self._restore_signal_handlers()
+        if self._writer._file.closed:
+            return
+        self.flush(fsync=True)
+        self._writer.close()
+        log.info("データを %s に保存しました。合計 %d 行。", self.file_path, self.n_rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,190 @@
+# 収集・評価のスイープを途中から再開するためのチェックポイント
+#
+# 出力ファイル (RowLogWriter) と並べて次の2つのファイルを作る
+#   <出力ファイル>.plan.json : 訪れる目標姿勢のリスト (計画) と出力の列
+#   <出力ファイル>.journal   : 完了した点の番号と、その点の行を書き終えた時点の出力ファイルのサイズ (1行に1点)
+#
+# 途中で終了 (アームのエラー、Ctrl+C など) した後に同じ設定で実行し直すと、
+# 進捗ファイルの最後の位置まで出力ファイルを切り詰め (進捗に記録される前の行は捨てる)、
+# 完了した点を飛ばして最初の未完了の点から続きを収集し、同じ出力ファイルに追記する
+# 全ての点が完了したら計画と進捗のファイルを削除する
+# 進捗ファイルがない・有効な記録がない場合 (作成直後に終了した場合など) は、収集済みの行を捨てないよう
+# 出力ファイルを <出力ファイル>.bak に移してから警告を表示して最初からやり直す
+#
+# 使い方:
+#   with SweepCheckpoint(output_file, columns, poses) as checkpoint:
+#       for index, pose in checkpoint.pending():
+#           ...
+#           checkpoint.writer.write_row(row)
+#           checkpoint.mark_done(index)
+#       checkpoint.finish()
+
+import json
+import os
+import numpy as np
+from .logger import get_logger
+from .pose_log import POSE_LOG_EXTENSION, read_pose_log
+from .row_log import RowLogWriter
+
+log = get_logger(__name__)
+
+PLAN_SUFFIX = ".plan.json"
+JOURNAL_SUFFIX = ".journal"
+BACKUP_SUFFIX = ".bak"
+PLAN_VERSION = 1
+
+
+class SweepCheckpoint:
+    def __init__(self, output_file, columns, poses, resume=True, **writer_kwargs):
+        """
+        output_file: 出力ファイルのパス (.poselog または CSV)
+        columns: 出力の列名のリスト
+        poses: 訪れる目標姿勢のリスト (各要素は数値のリスト)
+        resume: True かつ前回の計画が残っている場合は続きから再開する (False の場合は最初からやり直す)
+        writer_kwargs: RowLogWriter に渡す引数 (fsync_every など)
+        """
+        self.output_file = output_file
+        self.plan_file = output_file + PLAN_SUFFIX
+        self.journal_file = output_file + JOURNAL_SUFFIX
+        self.columns = list(columns)
+        self.poses = [[float(v) for v in pose] for pose in poses]
+        self.completed = set()
+
+        offset = None
+        if resume and os.path.exists(self.plan_file) and os.path.exists(output_file):
+            self._check_plan()
+            offset = self._read_journal()
+            if offset is None:
+                backup_file = self._backup_output()
+                log.warning("進捗ファイルがない、または有効な記録がないため、最初から収集し直します: %s "
+                            "(前回の出力は %s に移しました)", self.journal_file, backup_file)
+
+        if offset is not None:
+            # 進捗に記録されていない行 (書き込み途中で終了した点) を捨てる
+            with open(output_file, "r+b") as f:
+                f.truncate(offset)
+            self.writer = RowLogWriter(output_file, self.columns, append=True, **writer_kwargs)
+            self._journal = open(self.journal_file, "a")
+            log.info("前回の続きから再開します: 完了 %d/%d 点 (%s)", len(self.completed), len(self.poses),
+                     self.plan_file)
+        else:
+            self.writer = RowLogWriter(output_file, self.columns, **writer_kwargs)
+            self._write_plan()
+            self._journal = open(self.journal_file, "w")
+            # ヘッダーだけを書いた時点の位置 (完了した点がない状態)
+            self._append_journal(-1, self.writer.tell())
+
+    def _backup_output(self):
+        """出力ファイルを上書きしないよう、使われていない <出力ファイル>.bak (.bak1, .bak2, ...) に移してそのパスを返す"""
+        backup_file = self.output_file + BACKUP_SUFFIX
+        number = 0
+        while os.path.exists(backup_file):
+            number += 1
+            backup_file = f"{self.output_file}{BACKUP_SUFFIX}{number}"
+        os.replace(self.output_file, backup_file)
+        return backup_file
+
+    def _write_plan(self):
+        plan = {"version": PLAN_VERSION, "output_file": self.output_file, "columns": self.columns,
+                "poses": self.poses}
+        with open(self.plan_file, "w") as f:
+            json.dump(plan, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _check_plan(self):
+        with open(self.plan_file) as f:
+            plan = json.load(f)
+        if plan.get("version") != PLAN_VERSION or plan.get("columns") != self.columns:
+            raise ValueError(f"前回の計画と出力の形式が一致しません: {self.plan_file}")
+        poses = plan.get("poses", [])
+        if len(poses) != len(self.poses) or not np.allclose(poses, self.poses, atol=1e-6):
+            raise ValueError(f"前回の計画と目標姿勢が一致しません (設定を変更した場合は resume=False にするか "
+                             f"{self.plan_file} を削除してください)")
+
+    def _read_journal(self):
+        """
+        進捗ファイルから完了した点を読み込み、最後に完了した点の出力ファイルの位置を返す
+        (進捗ファイルがない、または有効な記録が1つもない場合は None)
+        """
+        if not os.path.exists(self.journal_file):
+            return None
+        output_size = os.path.getsize(self.output_file)
+        offset = None
+        valid_size = 0
+        with open(self.journal_file, "rb") as f:
+            content = f.read()
+        position = 0
+        for line in content.splitlines(keepends=True):
+            position += len(line)
+            if not line.endswith(b"\n"):
+                break
+            try:
+                index, line_offset = (int(v) for v in line.split())
+            except ValueError:
+                break
+            # 出力ファイルがこの位置まで書かれていない場合 (ディスクに書き込まれる前に終了した場合) はここまで
+            if line_offset > output_size:
+                break
+            if 0 <= index < len(self.poses):
+                self.completed.add(index)
+            offset = line_offset
+            valid_size = position
+        if offset is None:
+            return None
+        # 使えなかった記録を切り捨てる
+        with open(self.journal_file, "r+b") as f:
+            f.truncate(valid_size)
+        return offset
+
+    def _append_journal(self, index, offset):
+        self._journal.write(f"{index} {offset}\n")
+        self._journal.flush()
+
+    def is_done(self, index):
+        """index 番目の点が完了しているか"""
+        return index in self.completed
+
+    def pending(self):
+        """未完了の (番号, 目標姿勢) のリスト"""
+        return [(index, pose) for index, pose in enumerate(self.poses) if index not in self.completed]
+
+    def completed_rows(self):
+        """
+        前回までに出力ファイルに書いた行 ((行数, 列数) の配列)
+        逐次推定をやり直すときなどに使う
+        """
+        self.writer.flush()
+        if self.output_file.endswith(POSE_LOG_EXTENSION):
+            data, _ = read_pose_log(self.output_file, mmap=False)
+            return data
+        return np.loadtxt(self.output_file, skiprows=1, delimiter=",", ndmin=2).reshape(-1, len(self.columns))
+
+    def mark_done(self, index):
+        """index 番目の点の行を書き終えたことを記録する"""
+        self.completed.add(index)
+        self._append_journal(index, self.writer.tell())
+        # 出力ファイルを fsync した直後だけ進捗も fsync する (進捗が出力より先にディスクに書かれないように)
+        if self.writer.unsynced_rows == 0:
+            os.fsync(self._journal.fileno())
+
+    def finish(self):
+        """スイープが完了した (収束して途中で終了した場合も含む) ので計画と進捗のファイルを削除する"""
+        self.close()
+        for path in (self.plan_file, self.journal_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        """出力ファイルと進捗ファイルを閉じる (計画と進捗は残し、次回に再開できるようにする)"""
+        self.writer.close()
+        if not self._journal.closed:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -2,6 +2,10 @@
 
 import numpy as np
 from scipy.spatial.transform import Rotation as R
+from .logger import get_logger
+from .pose_log import is_pose_log, read_pose_log
+
+log = get_logger(__name__)
 
 # 同次変換行列を扱うクラス
 class Transform:
@@ -22,6 +26,12 @@ class Transform:
         R_mat = R.from_euler(seq, euler, degrees=degrees).as_matrix()
         return cls(R_mat, t)
 
+    @classmethod
+    def from_rotvec(cls, rotvec, t=None, degrees=False):
+        """回転ベクトル + 並進から生成"""
+        R_mat = R.from_rotvec(rotvec, degrees=degrees).as_matrix()
+        return cls(R_mat, t)
+
     @classmethod
     def from_matrix(cls, T):
         """4×4同次変換行列から生成"""
@@ -45,6 +55,8 @@ class Transform:
 
     def __matmul__(self, other):
         """@演算子で座標変換を合成可能"""
+        if isinstance(other, TransformArray):
+            return TransformArray.from_transform(self) @ other
         if not isinstance(other, Transform):
             raise TypeError("Transform同士でのみ@演算子を使用できます。")
         R_new = self.R @ other.R
@@ -55,42 +67,262 @@ class Transform:
         return f"Transform(t={self.t}, R=\n{self.R})"
 
 
+# 複数の同次変換をまとめて扱うクラス
+class TransformArray:
+    def __init__(self, R_mats, ts):
+        """R_mats: (N,3,3) 回転行列, ts: (N,3) 並進ベクトル"""
+        self.R = np.asarray(R_mats, dtype=np.float64).reshape(-1, 3, 3)
+        self.t = np.asarray(ts, dtype=np.float64).reshape(-1, 3)
+        if len(self.R) != len(self.t):
+            raise ValueError("回転行列と並進ベクトルの個数が一致しません。")
+
+    @staticmethod
+    def _translations(t, n):
+        """並進ベクトルが省略された場合は0ベクトルを返す"""
+        if t is None:
+            return np.zeros((n, 3))
+        return np.broadcast_to(np.asarray(t, dtype=np.float64).reshape(-1, 3), (n, 3))
+
+    @classmethod
+    def from_transform(cls, transform):
+        """Transform 1つから N=1 の TransformArray を生成"""
+        return cls(np.asarray(transform.R)[None], np.asarray(transform.t)[None])
+
+    @classmethod
+    def from_quat(cls, quats, ts=None):
+        """クォータニオン (N,4) [x, y, z, w] + 並進 (N,3) から生成"""
+        R_mats = R.from_quat(np.asarray(quats).reshape(-1, 4)).as_matrix()
+        return cls(R_mats, cls._translations(ts, len(R_mats)))
+
+    @classmethod
+    def from_rotvec(cls, rotvecs, ts=None, degrees=False):
+        """回転ベクトル (N,3) + 並進 (N,3) から生成"""
+        R_mats = R.from_rotvec(np.asarray(rotvecs).reshape(-1, 3), degrees=degrees).as_matrix()
+        return cls(R_mats, cls._translations(ts, len(R_mats)))
+
+    @classmethod
+    def from_euler(cls, eulers, ts=None, seq="xyz", degrees=True):
+        """オイラー角 (N,3) + 並進 (N,3) から生成"""
+        R_mats = R.from_euler(seq, np.asarray(eulers).reshape(-1, 3), degrees=degrees).as_matrix()
+        return cls(R_mats, cls._translations(ts, len(R_mats)))
+
+    @classmethod
+    def from_matrix(cls, T):
+        """(N,4,4) の同次変換行列から生成"""
+        T = np.asarray(T, dtype=np.float64).reshape(-1, 4, 4)
+        return cls(T[:, :3, :3], T[:, :3, 3])
+
+    def __len__(self):
+        return len(self.t)
+
+    def __getitem__(self, index):
+        """整数ならTransform、スライスや配列ならTransformArrayを返す"""
+        if isinstance(index, (int, np.integer)):
+            return Transform(self.R[index], self.t[index])
+        return TransformArray(self.R[index], self.t[index])
+
+    def as_matrix(self):
+        """(N,4,4) の同次変換行列を返す"""
+        return stack_homogeneous(self.R, self.t)
+
+    @property
+    def matrix(self):
+        """(N,4,4) の同次変換行列を返す"""
+        return self.as_matrix()
+
+    def as_quat(self):
+        """(N,4) のクォータニオン [x, y, z, w] を返す"""
+        return R.from_matrix(self.R).as_quat()
+
+    def inv(self):
+        """全ての逆変換をまとめて返す"""
+        R_inv = np.swapaxes(self.R, 1, 2)
+        t_inv = -np.einsum('nij,nj->ni', R_inv, self.t)
+        return TransformArray(R_inv, t_inv)
+
+    def __matmul__(self, other):
+        """
+        @演算子で座標変換をまとめて合成する
+        other が Transform または要素数1の TransformArray の場合は全要素にブロードキャストする
+        """
+        if isinstance(other, Transform):
+            other = TransformArray.from_transform(other)
+        if not isinstance(other, TransformArray):
+            raise TypeError("TransformArrayはTransformまたはTransformArrayとのみ@演算子を使用できます。")
+        if len(self) != len(other) and len(self) != 1 and len(other) != 1:
+            raise ValueError(f"要素数が一致しません: {len(self)} と {len(other)}")
+        R_new = np.matmul(self.R, other.R)
+        t_new = np.matmul(self.R, other.t[..., None])[..., 0] + self.t
+        return TransformArray(R_new, t_new)
+
+    def __rmatmul__(self, other):
+        """Transform @ TransformArray の合成"""
+        if isinstance(other, Transform):
+            return TransformArray.from_transform(other) @ self
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TransformArray(N={len(self)})"
+
+
+# 変換のリストや配列をTransformArrayに変換する関数
+def to_transform_array(transforms):
+    """
+    transforms: TransformArray, Transformのリスト, 4x4行列のリストまたは (N,4,4) 配列
+    戻り値: TransformArray
+    """
+    if isinstance(transforms, TransformArray):
+        return transforms
+    if len(transforms) > 0 and isinstance(transforms[0], Transform):
+        return TransformArray([T.R for T in transforms], [T.t for T in transforms])
+    return TransformArray.from_matrix(transforms)
+
+
+# クォータニオンを回転行列に変換する関数（scipyのRotationを生成せずに計算）
+def quat_to_matrix(quat):
+    """
+    クォータニオンを回転行列に変換する
+    quat: クォータニオン [x, y, z, w] (4,) または (N, 4)
+    戻り値: 回転行列 (3, 3) または (N, 3, 3)
+    """
+    q = np.asarray(quat, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    R_mat = np.empty(q.shape[:-1] + (3, 3))
+    R_mat[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    R_mat[..., 0, 1] = 2 * (x * y - z * w)
+    R_mat[..., 0, 2] = 2 * (x * z + y * w)
+    R_mat[..., 1, 0] = 2 * (x * y + z * w)
+    R_mat[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    R_mat[..., 1, 2] = 2 * (y * z - x * w)
+    R_mat[..., 2, 0] = 2 * (x * z - y * w)
+    R_mat[..., 2, 1] = 2 * (y * z + x * w)
+    R_mat[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    return R_mat
+
+
+def average_quaternions(quats, weights=None):
+    """
+    複数のクォータニオンの平均を求める (固有ベクトル法)
+    M = Σ w_i q_i q_i^T の最大固有値に対応する固有ベクトルが平均姿勢になる
+    q と -q の符号の違いに影響されない
+    quats: クォータニオン (N, 4) [x, y, z, w]
+    weights: 各クォータニオンの重み (N,) (省略時は等しい重み)
+    戻り値: 平均クォータニオン (4,) [x, y, z, w] (1つ目のクォータニオンと同じ半球にそろえる)
+    """
+    q = np.asarray(quats, dtype=np.float64).reshape(-1, 4)
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    w = np.ones(len(q)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    M = (q * w[:, None]).T @ q
+    eigenvalues, eigenvectors = np.linalg.eigh(M)
+    mean_quat = eigenvectors[:, np.argmax(eigenvalues)]
+    if mean_quat @ q[0] < 0:
+        mean_quat = -mean_quat
+    return mean_quat
+
+
+def slerp_quaternions(q0, q1, alpha):
+    """
+    クォータニオンの球面線形補間 (SLERP) をまとめて計算する
+    q0, q1: クォータニオン (N, 4) [x, y, z, w]
+    alpha: 補間係数 (N,) (0 で q0, 1 で q1)
+    戻り値: 補間したクォータニオン (N, 4)
+    """
+    q0 = np.asarray(q0, dtype=np.float64).reshape(-1, 4)
+    q1 = np.asarray(q1, dtype=np.float64).reshape(-1, 4)
+    alpha = np.asarray(alpha, dtype=np.float64).reshape(-1, 1)
+
+    # 短い方の経路で補間するため符号をそろえる
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    # 角度が非常に小さい場合は線形補間で近似する
+    small = sin_theta < 1e-6
+    safe_sin = np.where(small, 1.0, sin_theta)
+    w0 = np.where(small, 1.0 - alpha, np.sin((1.0 - alpha) * theta) / safe_sin)
+    w1 = np.where(small, alpha, np.sin(alpha * theta) / safe_sin)
+
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+# 回転行列 (N, 3, 3) と並進ベクトル (N, 3) から同次変換行列 (N, 4, 4) を作成する関数
+def stack_homogeneous(R_mats, ts):
+    """
+    R_mats: 回転行列 (N, 3, 3)
+    ts: 並進ベクトル (N, 3)
+    戻り値: 同次変換行列 (N, 4, 4)
+    """
+    T = np.zeros((len(ts), 4, 4))
+    T[:, :3, :3] = R_mats
+    T[:, :3, 3] = ts
+    T[:, 3, 3] = 1.0
+    return T
+
+
+# csvファイルから姿勢データを配列として読み込む関数
+def load_csv_pose_arrays(file_path):
+    """
+    CSVファイルから姿勢データを列ごとにまとめて読み込む
+    file_path: CSVファイルまたはposelogファイルのパス
+    戻り値: (R_arm_from_robot (N, 3, 3), t_arm_from_robot (N, 3),
+             R_sensor_from_aurora (N, 3, 3), t_sensor_from_aurora (N, 3))
+    """
+    if is_pose_log(file_path):
+        # バイナリ形式はテキストを解析せずにメモリマップで読み込む
+        csv_data, _ = read_pose_log(file_path)
+    else:
+        csv_data = np.loadtxt(file_path, skiprows=1, delimiter=',', ndmin=2)
+
+    # 行ごとではなく列ブロック全体に対して1回だけRotationを生成する
+    t_arm_from_robot = np.ascontiguousarray(csv_data[:, 0:3])
+    R_arm_from_robot = R.from_rotvec(csv_data[:, 3:6], degrees=True).as_matrix()
+    t_sensor_from_aurora = np.ascontiguousarray(csv_data[:, 6:9])
+    R_sensor_from_aurora = R.from_quat(csv_data[:, 9:13]).as_matrix()
+
+    return R_arm_from_robot, t_arm_from_robot, R_sensor_from_aurora, t_sensor_from_aurora
+
+
 # csvファイルから点群データを作成する関数
 def load_csv_data(file_path):
     """
     CSVファイルから点群データを読み込む
     file_path: CSVファイルのパス
-    戻り値: Transformオブジェクトのリスト (T_arm_from_robot, T_sensor_from_aurora)
+    戻り値: 同次変換行列の配列 (T_arm_from_robot (N, 4, 4), T_sensor_from_aurora (N, 4, 4))
     """
 
     try:
-        csv_data = np.loadtxt(file_path, skiprows=1, delimiter=',')
+        R_arm_from_robot, t_arm_from_robot, R_sensor_from_aurora, t_sensor_from_aurora = load_csv_pose_arrays(file_path)
+    except Exception as e:
+        log.error("Error loading CSV data: %s", e)
+        return None
+
+    T_arm_from_robot_array = stack_homogeneous(R_arm_from_robot, t_arm_from_robot)
+    T_sensor_from_aurora_array = stack_homogeneous(R_sensor_from_aurora, t_sensor_from_aurora)
+
+    return T_arm_from_robot_array, T_sensor_from_aurora_array
+
+
+# csvファイルから姿勢データをTransformArrayとして読み込む関数
+def load_csv_transforms(file_path):
+    """
+    CSVファイルから姿勢データを読み込む
+    file_path: CSVファイルのパス
+    戻り値: TransformArray (T_arm_from_robot, T_sensor_from_aurora)
+    """
+    try:
+        R_arm_from_robot, t_arm_from_robot, R_sensor_from_aurora, t_sensor_from_aurora = load_csv_pose_arrays(file_path)
     except Exception as e:
-        print(f"Error loading CSV data: {e}")
+        log.error("Error loading CSV data: %s", e)
         return None
-    
-    T_arm_from_robot_list = []
-    T_sensor_from_aurora_list = []
-
-    for data in csv_data:
-        robot_x, robot_y, robot_z = data[0], data[1], data[2]
-        robot_rx, robot_ry, robot_rz = data[3], data[4], data[5]
-        aurora_x, aurora_y, aurora_z = data[6], data[7], data[8]
-        aurora_quat_x, aurora_quat_y, aurora_quat_z, aurora_quat_w = data[9], data[10], data[11], data[12]
-
-        # arm_from_robotの同次変換行列を作成
-        t_arm_from_robot = np.array([robot_x, robot_y, robot_z])
-        R_matrix_robot = R.from_rotvec([robot_rx, robot_ry, robot_rz], degrees=True).as_matrix()
-        T_arm_from_robot = Transform(R_matrix_robot, t_arm_from_robot).matrix
-        T_arm_from_robot_list.append(T_arm_from_robot)
-
-        # sensor_from_auroraの同次変換行列を作成
-        t_sensor_from_aurora = np.array([aurora_x, aurora_y, aurora_z])
-        R_matrix_aurora = R.from_quat([aurora_quat_x, aurora_quat_y, aurora_quat_z, aurora_quat_w]).as_matrix()
-        T_sensor_from_aurora = Transform(R_matrix_aurora, t_sensor_from_aurora).matrix
-        T_sensor_from_aurora_list.append(T_sensor_from_aurora)
-
-    return T_arm_from_robot_list, T_sensor_from_aurora_list
+
+    return (TransformArray(R_arm_from_robot, t_arm_from_robot),
+            TransformArray(R_sensor_from_aurora, t_sensor_from_aurora))
 
 # T_arm_from_robotを計算する関数
 def compute_T_arm_from_robot(t_sensor_from_aurora, quaternion_sensor_from_aurora,
@@ -149,8 +381,9 @@ def compute_transform_difference(T1, T2):
     delta_angle_rad = np.linalg.norm(delta_rotvec)
     delta_angle_deg = np.degrees(delta_angle_rad)
 
-    print(f"並進差分ベクトル: {delta_t}, 大きさ: {delta_t_norm}")
-    print(f"回転差分ベクトル: {delta_rotvec}, 回転角の大きさ: {delta_angle_deg:.3f} 度")
+    # 配列の文字列化は書き込みスレッドで行う (静音モードでは行わない)
+    log.info("並進差分ベクトル: %s, 大きさ: %s", delta_t, delta_t_norm)
+    log.info("回転差分ベクトル: %s, 回転角の大きさ: %.3f 度", delta_rotvec, delta_angle_deg)
 
 
     return delta_t, delta_rotvec, delta_t_norm, delta_angle_deg
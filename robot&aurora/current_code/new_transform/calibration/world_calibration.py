@@ -8,28 +8,59 @@
 # 5. 返り値として[T_aurora_from_robot]を返す
 
 import numpy as np
-from .transformation_utils import Transform, load_csv_data
+from .logger import get_logger
+from .transformation_utils import Transform, load_csv_transforms
+
+log = get_logger(__name__)
+
+
+def solve_transform_from_covariance(H, centroid_robot, centroid_aurora):
+    """
+    共分散行列と重心から T_aurora_from_robot（4x4の同次変換行列）を求める
+    H: 共分散行列 (3, 3)  H = Σ (robot_i - centroid_robot) (aurora_i - centroid_aurora)^T
+    centroid_robot: arm_from_robotの重心 (3,)
+    centroid_aurora: sensor_from_auroraの重心 (3,)
+    戻り値: 4x4の同次変換行列 T (P_robot = T * P_aurora)
+    """
+    # 特異値分解を実行
+    # np.linalg.svd は U, S, Vh (V transpose) を返す
+    U, S, Vh = np.linalg.svd(H, full_matrices=False)
+
+    # 回転行列 R を計算 (R = U * Vh)
+    R = np.dot(U, Vh)
+
+    # 右手系の座標系を保つためのチェック (リフレクションの防止)
+    if np.linalg.det(R) < 0:
+        # Vh の最後の行の符号を反転
+        Vh[-1, :] = -Vh[-1, :]
+        # R を再計算
+        R = np.dot(U, Vh)
+
+    # 並行移動ベクトル t を計算 (t = centroid_robot - R * centroid_aurora)
+    t = centroid_robot - np.dot(R, centroid_aurora)
+
+    # 4x4 の同次変換行列を作成
+    return Transform(R, t).matrix
+
 
 class WorldCalibration:
     def __init__(self, csv_path: str):
         self.csv_path = csv_path
+        # run() 実行後に残差統計が格納される
+        self.residuals = None
 
     def load_data_to_points(self):
         """
         CSVファイルから点群データを読み込む
         戻り値: sensor_from_auroraの点群 (N, 3), arm_from_robotの点群 (N, 3)
         """
-        T_arm_from_robot_list, T_sensor_from_aurora_list = load_csv_data(self.csv_path)
-        aurora_points = []
-        robot_points = []
+        T_arm_from_robot_array, T_sensor_from_aurora_array = load_csv_transforms(self.csv_path)
 
-        for T_arm_from_robot, T_sensor_from_aurora in zip(T_arm_from_robot_list, T_sensor_from_aurora_list):
-            T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
-            T_sensor_from_aurora_transform = Transform.from_matrix(T_sensor_from_aurora)
-            aurora_points.append(T_sensor_from_aurora_transform.t)
-            robot_points.append(T_arm_from_robot_transform.t)
+        # TransformArrayの並進成分 (N, 3) をそのまま点群として使用
+        aurora_points = T_sensor_from_aurora_array.t.copy()
+        robot_points = T_arm_from_robot_array.t.copy()
 
-        return np.array(aurora_points), np.array(robot_points)
+        return aurora_points, robot_points
 
 
     def compute_transform(self, aurora_points, robot_points):
@@ -51,27 +82,23 @@ class WorldCalibration:
         # H = (Q')^T * (P')  (ここで Q' = robot_points_centered, P' = aurora_points_centered)
         H = np.dot(robot_points_centered.T, aurora_points_centered)
 
-        # 特異値分解を実行
-        # np.linalg.svd は U, S, Vh (V transpose) を返す
-        U, S, Vh = np.linalg.svd(H, full_matrices=False)
-
-        # 回転行列 R を計算 (R = U * Vh)
-        R = np.dot(U, Vh)
-
-        # 右手系の座標系を保つためのチェック (リフレクションの防止)
-        if np.linalg.det(R) < 0:
-            # Vh の最後の行の符号を反転
-            Vh[-1, :] = -Vh[-1, :]
-            # R を再計算
-            R = np.dot(U, Vh)
-
-        # 並行移動ベクトル t を計算 (t = centroid_robot - R * centroid_aurora)
-        t = centroid_robot - np.dot(R, centroid_aurora)
+        # SVDで回転と並進を求める
+        return solve_transform_from_covariance(H, centroid_robot, centroid_aurora)
 
-        # 4x4 の同次変換行列を作成
-        T = Transform(R, t).matrix
-
-        return T
+    def compute_residuals(self, aurora_points, robot_points, T):
+        """
+        推定した T_aurora_from_robot の残差統計を求める
+        aurora_points: sensor_from_auroraの点群 (N, 3)
+        robot_points: arm_from_robotの点群 (N, 3)
+        T: 4x4の同次変換行列 T_aurora_from_robot
+        戻り値: {"rms_mm": 残差のRMS, "max_mm": 残差の最大値}
+        """
+        predicted = aurora_points @ T[:3, :3].T + T[:3, 3]
+        errors = np.linalg.norm(predicted - robot_points, axis=1)
+        return {
+            "rms_mm": float(np.sqrt(np.mean(errors ** 2))),
+            "max_mm": float(np.max(errors)),
+        }
 
     def run(self):
         """
@@ -79,21 +106,86 @@ class WorldCalibration:
         戻り値: 4x4の同次変換行列 T_aurora_from_robot
         """
         try:
-            print("1. CSVからデータを読み込み、座標変換を実行しています...")
+            log.info("1. CSVからデータを読み込み、座標変換を実行しています...")
             # aurora_points: sensor_from_auroraの点群 (N, 3)
             # robot_points: arm_from_robotの点群 (N, 3)
             aurora_points, robot_points = self.load_data_to_points()
-            print(f"   {len(aurora_points)} 点のデータを読み込みました。")
+            log.info("   %d 点のデータを読み込みました。", len(aurora_points))
 
-            print("2. T_aurora_from_robot を推定しています...")
+            log.info("2. T_aurora_from_robot を推定しています...")
             T_aurora_from_robot = self.compute_transform(aurora_points, robot_points)
             if T_aurora_from_robot is not None:
-                print("3. 推定が完了しました。")
+                self.residuals = self.compute_residuals(aurora_points, robot_points, T_aurora_from_robot)
+                log.info("3. 推定が完了しました。")
             return T_aurora_from_robot
 
         except FileNotFoundError:
-            print(f"エラー: CSVファイルが見つかりません: {self.csv_path}")
+            log.error("エラー: CSVファイルが見つかりません: %s", self.csv_path)
             return None
         except Exception as e:
-            print(f"キャリブレーション中に予期せぬエラーが発生しました: {e}")
-            return None
\ No newline at end of file
+            log.error("キャリブレーション中に予期せぬエラーが発生しました: %s", e)
+            return None
+
+
+class WorldCalibrationAccumulator:
+    def __init__(self):
+        """
+        ワールドキャリブレーションを1点ずつ逐次的に計算するクラス
+        重心と共分散行列をオンラインで更新するため、点群全体を保持せずに
+        各サンプル追加後の T_aurora_from_robot を O(1) で求められる
+        """
+        self.count = 0
+        self.centroid_aurora = np.zeros(3)
+        self.centroid_robot = np.zeros(3)
+        # 重心まわりの共分散行列 H = Σ (robot_i - centroid_robot) (aurora_i - centroid_aurora)^T
+        self.H = np.zeros((3, 3))
+
+    def add(self, aurora_point, robot_point):
+        """
+        1点を追加する
+        aurora_point: sensor_from_auroraの位置 (3,)
+        robot_point: arm_from_robotの位置 (3,)
+        """
+        aurora_point = np.asarray(aurora_point, dtype=np.float64)
+        robot_point = np.asarray(robot_point, dtype=np.float64)
+
+        # Welford法で重心と共分散を更新（大きな座標値でも桁落ちしにくい）
+        self.count += 1
+        delta_aurora = aurora_point - self.centroid_aurora
+        self.centroid_aurora += delta_aurora / self.count
+        self.centroid_robot += (robot_point - self.centroid_robot) / self.count
+        self.H += np.outer(robot_point - self.centroid_robot, delta_aurora)
+
+    def add_batch(self, aurora_points, robot_points):
+        """
+        複数点をまとめて追加する
+        aurora_points: sensor_from_auroraの点群 (N, 3)
+        robot_points: arm_from_robotの点群 (N, 3)
+        """
+        aurora_points = np.asarray(aurora_points, dtype=np.float64).reshape(-1, 3)
+        robot_points = np.asarray(robot_points, dtype=np.float64).reshape(-1, 3)
+        n = len(aurora_points)
+        if n == 0:
+            return
+
+        # バッチの統計量を求め、既存の統計量と結合する
+        batch_centroid_aurora = aurora_points.mean(axis=0)
+        batch_centroid_robot = robot_points.mean(axis=0)
+        batch_H = (robot_points - batch_centroid_robot).T @ (aurora_points - batch_centroid_aurora)
+
+        total = self.count + n
+        delta_aurora = batch_centroid_aurora - self.centroid_aurora
+        delta_robot = batch_centroid_robot - self.centroid_robot
+        self.H += batch_H + np.outer(delta_robot, delta_aurora) * (self.count * n / total)
+        self.centroid_aurora += delta_aurora * (n / total)
+        self.centroid_robot += delta_robot * (n / total)
+        self.count = total
+
+    def transform(self):
+        """
+        現在までのサンプルから T_aurora_from_robot を求める
+        戻り値: 4x4の同次変換行列 (3点未満の場合は None)
+        """
+        if self.count < 3:
+            return None
+        return solve_transform_from_covariance(self.H.copy(), self.centroid_robot, self.centroid_aurora)
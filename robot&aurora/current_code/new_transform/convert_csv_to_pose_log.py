@@ -0,0 +1,26 @@
+# 既存のCSV姿勢ログをバイナリ形式 (.poselog) に変換するスクリプト
+import glob
+from calibration.pose_log import convert_csv_to_pose_log, read_pose_log
+
+
+def main(csv_files):
+    """
+    メイン関数：指定されたCSVファイルを全てposelog形式に変換する
+
+    引数:
+        csv_files (list): 変換するCSVファイルのパスのリスト
+    """
+    for csv_file in csv_files:
+        try:
+            output_file = convert_csv_to_pose_log(csv_file)
+            data, columns = read_pose_log(output_file)
+            print(f"{csv_file} -> {output_file} ({data.shape[0]} 行, {len(columns)} 列)")
+        except Exception as e:
+            print(f"変換中にエラーが発生しました ({csv_file}): {e}")
+
+
+if __name__ == "__main__":
+    # ここで変換対象を設定（ここだけを変更すれば良い）
+    main(
+        csv_files=sorted(glob.glob("robot&aurora/current_code/new_transform/data/*.csv")),
+    )
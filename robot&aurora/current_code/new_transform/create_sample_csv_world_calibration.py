@@ -1,7 +1,6 @@
 import numpy as np
 from scipy.spatial.transform import Rotation as R
-import csv
-import os
+from utils.synthetic_data import SyntheticPoseGenerator, grid_axis, iter_grid
 
 def generate_synthetic_data(
     rotation_euler_deg_aur2rob, 
@@ -14,10 +13,14 @@ def generate_synthetic_data(
     step_size=None, 
     output_file="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log.csv",
     add_noise=0,
-    add_quaternion_noise=0
+    add_quaternion_noise=0,
+    rotation_noise_deg=0,
+    seed=None,
+    chunk_size=100000
 ):
     """
     ロボット座標系とAurora座標系の変換関係に基づいて合成データを生成する
+    (格子点を chunk_size 点ずつまとめて計算し、ファイルに追記する)
 
     :param rotation_euler_deg_aur2rob: 回転角度（オイラー角、度数法）roll, pitch, yaw（固定軸回転zyx）
     :param translation_vector_aur2rob: 並進ベクトル [tx, ty, tz]
@@ -27,121 +30,61 @@ def generate_synthetic_data(
     :param y_range: Y座標の範囲 (開始値, 終了値)
     :param z_range: Z座標の範囲 (開始値, 終了値)
     :param step_size: サンプリング間隔（mm）
-    :param output_file: 出力CSVファイル名
+    :param output_file: 出力ファイル名 (.csv または .poselog。大量の点を生成する場合は .poselog が速い)
     :param add_noise: Aurora座標に追加するガウスノイズの標準偏差（mm）
     :param add_quaternion_noise: クォータニオンに追加するガウスノイズの標準偏差
-    :return: 生成したデータポイント
+    :param rotation_noise_deg: Aurora姿勢に追加する回転ノイズ（SO(3)上）の標準偏差（度）
+    :param seed: ノイズの乱数のシード（None の場合は毎回異なる）
+    :param chunk_size: 1回にまとめて計算・書き込みする点数
+    :return: 生成したデータポイントの数
     """
+    if step_size is None:
+        raise ValueError("Either step_size must be specified")
+
+    # センサー→アームの並進はワールドキャリブレーションでは使わない (0)
+    generator = SyntheticPoseGenerator(
+        rotation_euler_deg_aur2rob, translation_vector_aur2rob, rotation_euler_deg_sen2arm,
+        add_noise=add_noise, add_quaternion_noise=add_quaternion_noise,
+        rotation_noise_deg=rotation_noise_deg, seed=seed
+    )
 
-    euler_aur2rob_ypr = [rotation_euler_deg_aur2rob[2],
-                         rotation_euler_deg_aur2rob[1],
-                         rotation_euler_deg_aur2rob[0]]  # Aurora→Robotのオイラー角をYPR順に変換 
-    # 回転と並進を変換行列に変換（固定軸回転zyx）
-    rotation_aur2rob = R.from_euler('zyx', euler_aur2rob_ypr, degrees=True)
-    R_matrix_aur2rob = rotation_aur2rob.as_matrix()
     # 回転行列を小数点第5位で四捨五入して表示
-    R_matrix_aur2rob_rounded = np.round(R_matrix_aur2rob, 5)
+    R_matrix_aur2rob_rounded = np.round(generator.R_aur2rob, 5)
     print(f"R_matrix_aur2rob:\n{R_matrix_aur2rob_rounded}")
     print(f"rotation_euler_deg_aur2rob: {rotation_euler_deg_aur2rob}")
-    
-    # サンプリング点を生成
-    if step_size is not None:
-        # 間隔が指定された場合
-        x_points = np.arange(x_range[0], x_range[1] + step_size/2, step_size)  # 浮動小数点誤差を考慮
-        y_points = np.arange(y_range[0], y_range[1] + step_size/2, step_size)
-        z_points = np.arange(z_range[0], z_range[1] + step_size/2, step_size)
-    else:
-        raise ValueError("Either step_size must be specified")
-    
-    # 出力するAurora姿勢情報の計算
-    euler_sen2arm_ypr = [rotation_euler_deg_sen2arm[2],
-                         rotation_euler_deg_sen2arm[1],
-                         rotation_euler_deg_sen2arm[0]]  # センサー→アームのオイラー角をYPR順に変換
-    # センサー座標系からアーム座標系への回転
-    rotation_sen2arm = R.from_euler('zyx', euler_sen2arm_ypr, degrees=True)
-    R_matrix_sen2arm = rotation_sen2arm.as_matrix()
-    # センサー→アーム回転行列を小数点第5位で四捨五入して表示
-    R_matrix_sen2arm_rounded = np.round(R_matrix_sen2arm, 5)
+    R_matrix_sen2arm_rounded = np.round(generator.R_sen2arm, 5)
     print(f"R_matrix_sen2arm:\n{R_matrix_sen2arm_rounded}")
     print(f"rotation_euler_deg_sen2arm: {rotation_euler_deg_sen2arm}")
-    
-    # ロボットアームの回転
-    rotation_arm_from_robot = R.from_rotvec(robot_arm_R_vector_deg, degrees=True)
-    R_matrix_arm_from_robot = rotation_arm_from_robot.as_matrix()
-    # ロボット座標系におけるセンサー姿勢をアーム姿勢に変換
-    R_matrix_sensor_from_robot = R_matrix_sen2arm.T @ R_matrix_arm_from_robot
-    R_matrix_sensor_from_aurora = R_matrix_aur2rob.T @ R_matrix_sensor_from_robot
-    rotation_sensor_from_aurora = R.from_matrix(R_matrix_sensor_from_aurora)
-    # センサー姿勢をオイラー角とクォータニオンに変換
-    quaternion_sensor_from_aurora = rotation_sensor_from_aurora.as_quat()
+
+    # センサー姿勢 (全点で共通) をオイラー角で表示
+    R_matrix_arm_from_robot = R.from_rotvec(robot_arm_R_vector_deg, degrees=True).as_matrix()
+    rotation_sensor_from_aurora = R.from_matrix(generator.R_aur2rob.T @ generator.R_sen2arm.T @ R_matrix_arm_from_robot)
     euler_sensor_from_aurora_ypr = rotation_sensor_from_aurora.as_euler('zyx', degrees=True)
     euler_sensor_from_aurora = [euler_sensor_from_aurora_ypr[2],
                                  euler_sensor_from_aurora_ypr[1],
                                  euler_sensor_from_aurora_ypr[0]]  # RPY順に変換
     print(f"euler_sensor_from_aurora: {euler_sensor_from_aurora}")
 
-    # 出力ディレクトリの確保
-    output_dir = os.path.dirname(output_file)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # データを格納するリスト
-    data_points = []
-    
-    # 全ての点の組み合わせに対してAurora座標を計算
-    for x in x_points:
-        for y in y_points:
-            for z in z_points:
-                # ロボット座標
-                robot_point = np.array([x, y, z])
-                
-                # ロボット座標からAurora座標への変換
-                # Aurora = R_aur2rob.inv * (Robot - T_aur2rob) = R_aur2rob.T @ (Robot - T_aur2rob)
-                aurora_point = R_matrix_aur2rob.T @ (robot_point - translation_vector_aur2rob)
+    # サンプリング点 (x, y, z の全ての組み合わせ、アームの回転は固定)
+    axes = [
+        grid_axis(x_range, step_size), grid_axis(y_range, step_size), grid_axis(z_range, step_size),
+        [robot_arm_R_vector_deg[0]], [robot_arm_R_vector_deg[1]], [robot_arm_R_vector_deg[2]]
+    ]
 
-                # 位置座標にノイズの追加（指定がある場合）
-                if add_noise > 0:
-                    position_noise = np.random.normal(0, add_noise, 3)
-                    aurora_point += position_noise
-                
-                # クォータニオンのコピーを作成
-                noisy_quaternion = quaternion_sensor_from_aurora.copy()
-                
-                # クォータニオンにノイズの追加（指定がある場合）
-                if add_quaternion_noise > 0:
-                    # クォータニオンにガウシアンノイズを追加
-                    quaternion_noise = np.random.normal(0, add_quaternion_noise, 4)
-                    noisy_quaternion += quaternion_noise
-                    
-                    # クォータニオンを正規化（単位クォータニオンにする）
-                    quaternion_norm = np.linalg.norm(noisy_quaternion)
-                    if quaternion_norm > 0:  # ゼロ除算を避ける
-                        noisy_quaternion = noisy_quaternion / quaternion_norm
-                    else:
-                        # 万が一ノルムが0になった場合は、元のクォータニオンを使用
-                        noisy_quaternion = quaternion_sensor_from_aurora.copy()
-                
-                # データポイントを追加（小数点第5位で四捨五入）
-                data_points.append([
-                    round(x, 5), round(y, 5), round(z, 5),
-                    round(robot_arm_R_vector_deg[0], 5), round(robot_arm_R_vector_deg[1], 5), round(robot_arm_R_vector_deg[2], 5),
-                    round(aurora_point[0], 5), round(aurora_point[1], 5), round(aurora_point[2], 5),
-                    round(noisy_quaternion[0], 5), round(noisy_quaternion[1], 5), round(noisy_quaternion[2], 5), round(noisy_quaternion[3], 5),
-                    0.1
-                ])
-    
-    # CSVファイルに書き込み
-    with open(output_file, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['robot_x', 'robot_y', 'robot_z', 'robot_rx', 'robot_ry', 'robot_rz', 'aurora_x', 'aurora_y', 'aurora_z', 'aurora_quat_x', 'aurora_quat_y', 'aurora_quat_z', 'aurora_quat_w', 'aurora_quality'])
-        writer.writerows(data_points)
+    # アームの回転ベクトルは整数で与えた場合は整数のまま書く (従来の出力と同じく "80.0" ではなく "80")
+    integer_columns = [name for name, value in zip(("robot_rx", "robot_ry", "robot_rz"), robot_arm_R_vector_deg)
+                       if isinstance(value, (int, np.integer))]
+
+    # chunk_size 点ずつ計算してファイルに追記する
+    n_points = generator.write(output_file, iter_grid(axes, chunk_size), integer_columns=integer_columns)
     
-    print(f"生成したデータポイント数: {len(data_points)}")
+    print(f"生成したデータポイント数: {n_points}")
     print(f"データを {output_file} に保存しました")
     print(f"位置ノイズ標準偏差: {add_noise} mm")
     print(f"クォータニオンノイズ標準偏差: {add_quaternion_noise}")
+    print(f"回転ノイズ標準偏差: {rotation_noise_deg} 度")
     
-    return data_points
+    return n_points
 
 def main(
     x_range,
@@ -154,7 +97,9 @@ def main(
     step_size=None,
     output_file="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log.csv",
     add_noise=0,
-    add_quaternion_noise=0
+    add_quaternion_noise=0,
+    rotation_noise_deg=0,
+    seed=None
 ):
     """
     メイン処理を実行する関数
@@ -168,7 +113,9 @@ def main(
     :param output_file: 出力CSVファイル名
     :param add_noise: Aurora座標に追加するガウスノイズの標準偏差（mm）
     :param add_quaternion_noise: クォータニオンに追加するガウスノイズの標準偏差
-    :return: 生成したデータポイント
+    :param rotation_noise_deg: Aurora姿勢に追加する回転ノイズの標準偏差（度）
+    :param seed: ノイズの乱数のシード
+    :return: 生成したデータポイントの数
     """
     # デフォルトパラメータの設定
     if rotation_euler_deg_aur2rob is None:
@@ -193,12 +140,15 @@ def main(
         step_size=step_size,
         output_file=output_file,
         add_noise=add_noise,
-        add_quaternion_noise=add_quaternion_noise
+        add_quaternion_noise=add_quaternion_noise,
+        rotation_noise_deg=rotation_noise_deg,
+        seed=seed
     )
 
 
 def generate_output_filename(rotation_euler_deg_aur2rob, translation_vector_aur2rob, 
-                            robot_arm_R_vector_deg, rotation_euler_deg_sen2arm, add_noise, add_quaternion_noise=0):
+                            robot_arm_R_vector_deg, rotation_euler_deg_sen2arm, add_noise, add_quaternion_noise=0,
+                            rotation_noise_deg=0):
     """
     パラメータから動的にファイル名を生成する関数
     
@@ -209,6 +159,7 @@ def generate_output_filename(rotation_euler_deg_aur2rob, translation_vector_aur2
         rotation_euler_deg_sen2arm: Sensor→Armオイラー角 [roll, pitch, yaw]
         add_noise: 位置ノイズの標準偏差
         add_quaternion_noise: クォータニオンノイズの標準偏差
+        rotation_noise_deg: 回転ノイズの標準偏差（0 以外の場合のみファイル名に付ける）
     
     Returns:
         str: 生成されたファイル名
@@ -220,7 +171,10 @@ def generate_output_filename(rotation_euler_deg_aur2rob, translation_vector_aur2
     sen_str = "-".join(map(str, rotation_euler_deg_sen2arm))
     
     # ファイル名を生成（クォータニオンノイズのパラメータも追加）
-    filename = f"robot&aurora/current_code/new_transform/data/pose_R{rot_str}_T{trans_str}_ARM{arm_str}_SEN{sen_str}_n{add_noise}_qn{add_quaternion_noise}.csv"
+    filename = f"robot&aurora/current_code/new_transform/data/pose_R{rot_str}_T{trans_str}_ARM{arm_str}_SEN{sen_str}_n{add_noise}_qn{add_quaternion_noise}"
+    if rotation_noise_deg:
+        filename += f"_rn{rotation_noise_deg}"
+    filename += ".csv"
     
     return filename
 
@@ -232,6 +186,8 @@ if __name__ == "__main__":
     rotation_euler_deg_sen2arm = [  0,   20,  -150]  # センサー座標系からアーム座標系へのオイラー角（度）[roll, pitch, yaw]
     add_noise = 0  # 位置ノイズの標準偏差（mm）
     add_quaternion_noise = 0  # クォータニオンノイズの標準偏差
+    rotation_noise_deg = 0  # 姿勢の回転ノイズ（SO(3)上）の標準偏差（度）
+    seed = None  # ノイズの乱数のシード（同じ値で同じデータを再現する）
     
     # 動的にファイル名を生成
     output_file = generate_output_filename(
@@ -240,7 +196,8 @@ if __name__ == "__main__":
         robot_arm_R_vector_deg,
         rotation_euler_deg_sen2arm,
         add_noise,
-        add_quaternion_noise
+        add_quaternion_noise,
+        rotation_noise_deg
     )
     
     print(f"Generated filename: {output_file}")
@@ -257,5 +214,7 @@ if __name__ == "__main__":
         step_size=20,
         output_file=output_file,  # 動的に生成されたファイル名を使用
         add_noise=add_noise,
-        add_quaternion_noise=add_quaternion_noise
+        add_quaternion_noise=add_quaternion_noise,
+        rotation_noise_deg=rotation_noise_deg,
+        seed=seed
     )
\ No newline at end of file
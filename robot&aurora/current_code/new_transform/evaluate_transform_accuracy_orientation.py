@@ -1,18 +1,25 @@
 # 座標・姿勢変換の正確性を評価するためのデータ収集スクリプト
-import time
 import numpy as np
 import csv
-from utils.pose_formatter import generateRobotArmAxisAngle, generateProbe
+from utils.pose_formatter import generateRobotArmAxisAngle
+from utils.acquisition import make_robot_aurora_sampler
 from utils.initialization import initialize_robot, initialize_aurora
+from utils.settling import FixedSettling, make_settling_policy
 from scipy.spatial.transform import Rotation as R
 from calibration.transformation_utils import Transform, compute_transform_difference
-from main import main as run_pose_transoformation
+from calibration.pose_transformer import PoseTransformer
+from calibration.sweep_checkpoint import SweepCheckpoint
+from calibration.row_log import EVALUATION_LOG_COLUMNS, evaluation_rows, clear_collected_data
+from calibration.logger import get_logger, configure_logging
 
+log = get_logger(__name__)
 
-def collect_diff_data_by_orientation(arm, aurora, position, roll_range, pitch_range, yaw_ranges, N):
-    """
-    指定された固定位置で、姿勢（roll, pitch, yaw）を変化させながらデータを収集する
-    """
+# キャリブレーション用CSVファイルのパス
+WORLD_CALIB_CSV = "robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv"
+HAND_EYE_CALIB_CSV = "robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv"
+
+def orientation_poses(position, roll_range, pitch_range, yaw_ranges, N):
+    """目標姿勢 [x, y, z, roll, pitch, yaw] のリスト (roll, pitch, yaw の順にループした順)"""
     # 固定位置を設定
     fixed_x, fixed_y, fixed_z = position
     
@@ -24,9 +31,33 @@ def collect_diff_data_by_orientation(arm, aurora, position, roll_range, pitch_ra
     yaw_values_1 = np.linspace(yaw_ranges[0][0], yaw_ranges[0][1], N + 1)
     yaw_values_2 = np.linspace(yaw_ranges[1][0], yaw_ranges[1][1], N + 1)
     all_yaw_values = np.concatenate((yaw_values_1, yaw_values_2))
+
+    return [[fixed_x, fixed_y, fixed_z, roll, pitch, yaw]
+            for roll in roll_values for pitch in pitch_values for yaw in all_yaw_values]
+
+
+def collect_diff_data_by_orientation(arm, aurora, position, roll_range, pitch_range, yaw_ranges, N, settling=None,
+                                     frames_per_point=1, writer=None, checkpoint=None):
+    """
+    指定された固定位置で、姿勢（roll, pitch, yaw）を変化させながらデータを収集する
+    settling: 移動後・取得後の待機方法（省略時は FixedSettling: 移動後2秒、取得後1秒）
+    frames_per_point: 1点あたりに取得して平均するAuroraのフレーム数
+    writer: RowLogWriter を与えた場合は各点の評価結果 (EVALUATION_LOG_COLUMNS の列) を取得後すぐにファイルへ追記し、
+            戻り値の辞書には保存しない (中断してもそれまでの結果が残り、メモリ使用量は点数によらず一定)
+    checkpoint: SweepCheckpoint を与えた場合はその計画の姿勢を訪れ、完了済みの点を飛ばして続きから評価する
+                (writer の代わりに checkpoint.writer に追記する)
+    """
+    if settling is None:
+        settling = FixedSettling()
+
+    # 訪れる姿勢のリストを作成
+    poses = orientation_poses(position, roll_range, pitch_range, yaw_ranges, N)
+    if checkpoint is not None:
+        poses = checkpoint.poses
+        writer = checkpoint.writer
     
     # 合計測定ポイント数を計算
-    total_points = len(roll_values) * len(pitch_values) * len(all_yaw_values)
+    total_points = len(poses)
     
     # データ格納用ディクショナリ
     robot_data = {
@@ -37,7 +68,8 @@ def collect_diff_data_by_orientation(arm, aurora, position, roll_range, pitch_ra
     aurora_data = {
         'x': [], 'y': [], 'z': [], 
         'quat_x': [], 'quat_y': [], 'quat_z': [], 'quat_w': [],
-        'quality': []
+        'quality': [],
+        'pos_spread': [], 'rot_spread': []
     }
 
     robot_after_data = {
@@ -48,104 +80,122 @@ def collect_diff_data_by_orientation(arm, aurora, position, roll_range, pitch_ra
     aurora_after_data = {
         'x': [], 'y': [], 'z': [],
         'quat_x': [], 'quat_y': [], 'quat_z': [], 'quat_w': [],
-        'quality': []
+        'quality': [],
+        'pos_spread': [], 'rot_spread': []
     }
     
-    print(f"データ収集開始: 合計 {total_points} ポイント")
-    
-    point_counter = 0
-    # 各姿勢での計測
-    for current_roll in roll_values:
-        for current_pitch in pitch_values:
-            for current_yaw in all_yaw_values:
-                
-                # 進捗表示
-                if point_counter % 10 == 0:
-                    progress = (point_counter / total_points) * 100
-                    print(f"進捗: {progress:.1f}% ({point_counter}/{total_points})")
-                
-                # ロボットアームを移動（位置を固定し、姿勢を変化させる）
-                arm.set_position(
-                    x=fixed_x, y=fixed_y, z=fixed_z,
-                    roll=current_roll, pitch=current_pitch, yaw=current_yaw,
-                    speed=50, wait=True
-                )
-                time.sleep(2)
-                
-                # --- ここから下は元のスクリプトのループ内ロジック ---
-                
-                # データ取得
-                robot = generateRobotArmAxisAngle(arm.get_position_aa())
-                probes = generateProbe(aurora.get_frame())
-                
-                # ロボットデータを保存
-                robot_data['x'].append(robot.pos.x)
-                robot_data['y'].append(robot.pos.y)
-                robot_data['z'].append(robot.pos.z)
-                robot_data['rx'].append(robot.rot.rx)
-                robot_data['ry'].append(robot.rot.ry)
-                robot_data['rz'].append(robot.rot.rz)
-
-                # オーロラデータを保存
-                aurora_data['x'].append(probes[0].pos.x)
-                aurora_data['y'].append(probes[0].pos.y)
-                aurora_data['z'].append(probes[0].pos.z)
-                aurora_data['quat_x'].append(probes[0].quat.x)
-                aurora_data['quat_y'].append(probes[0].quat.y)
-                aurora_data['quat_z'].append(probes[0].quat.z)
-                aurora_data['quat_w'].append(probes[0].quat.w)
-                aurora_data['quality'].append(probes[0].quality)
-
-                time.sleep(1)
-
-                # 現在のauroraの位置・姿勢を目標にセットし、それを実現するロボットアームの姿勢を計算
-                t_sensor_from_aurora_goal = np.array([probes[0].pos.x, probes[0].pos.y, probes[0].pos.z])
-                quat_sensor_from_aurora_goal = np.array([probes[0].quat.x, probes[0].quat.y, probes[0].quat.z, probes[0].quat.w])
-
-                T_arm_from_robot = run_pose_transoformation(
-                    goal_aurora_point=t_sensor_from_aurora_goal,
-                    goal_aurora_quaternion=quat_sensor_from_aurora_goal,
-                    world_calib_csv="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv",
-                    hand_eye_calib_csv="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv"
-                )
-
-                # T_arm_from_robotをTransformオブジェクトに変換
-                T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
-                t_arm_from_robot = T_arm_from_robot_transform.t
-                R_arm_from_robot = T_arm_from_robot_transform.R
-                arm_rotvec_from_robot = R.from_matrix(R_arm_from_robot).as_rotvec(degrees=True)
-
-                # ロボットアームを移動
-                angle_pose = [t_arm_from_robot[0], t_arm_from_robot[1], t_arm_from_robot[2], arm_rotvec_from_robot[0], arm_rotvec_from_robot[1], arm_rotvec_from_robot[2]]
-                arm.set_position_aa(angle_pose, speed=50, wait=True)
-
-                robot_after = generateRobotArmAxisAngle(arm.get_position_aa())
-                probes_after = generateProbe(aurora.get_frame())
-
-                # 移動後のロボットデータを保存
-                robot_after_data['x'].append(robot_after.pos.x)
-                robot_after_data['y'].append(robot_after.pos.y)
-                robot_after_data['z'].append(robot_after.pos.z)
-                robot_after_data['rx'].append(robot_after.rot.rx)
-                robot_after_data['ry'].append(robot_after.rot.ry)
-                robot_after_data['rz'].append(robot_after.rot.rz)
-
-                # 移動後のオーロラデータを保存
-                aurora_after_data['x'].append(probes_after[0].pos.x)
-                aurora_after_data['y'].append(probes_after[0].pos.y)
-                aurora_after_data['z'].append(probes_after[0].pos.z)
-                aurora_after_data['quat_x'].append(probes_after[0].quat.x)
-                aurora_after_data['quat_y'].append(probes_after[0].quat.y)
-                aurora_after_data['quat_z'].append(probes_after[0].quat.z)
-                aurora_after_data['quat_w'].append(probes_after[0].quat.w)
-                aurora_after_data['quality'].append(probes_after[0].quality)
-
-                time.sleep(2)
-                # --- ここまでが元のスクリプトのループ内ロジック ---
-
-                point_counter += 1
+    # キャリブレーション結果を読み込み、座標変換器を作成（ループ内では再計算しない）
+    transformer = PoseTransformer.from_calibration(WORLD_CALIB_CSV, HAND_EYE_CALIB_CSV)
+
+    log.info("データ収集開始: 合計 %d ポイント", total_points)
     
-    print("データ収集完了")
+    # ロボットとAuroraを同時に読み取る (例外・Ctrl+C で中断した場合もワーカースレッドを止める)
+    sampler = make_robot_aurora_sampler(arm, aurora, frames_per_point)
+    try:
+        # 各姿勢での計測
+        for point_counter, (fixed_x, fixed_y, fixed_z, current_roll, current_pitch, current_yaw) in enumerate(poses):
+            if checkpoint is not None and checkpoint.is_done(point_counter):
+                continue
+
+            # 進捗表示
+            if point_counter % 10 == 0:
+                progress = (point_counter / total_points) * 100
+                log.info("進捗: %.1f%% (%d/%d)", progress, point_counter, total_points)
+        
+            # ロボットアームを移動（位置を固定し、姿勢を変化させる）
+            arm.set_position(
+                x=fixed_x, y=fixed_y, z=fixed_z,
+                roll=current_roll, pitch=current_pitch, yaw=current_yaw,
+                speed=50, wait=True
+            )
+            settling.wait_after_move(aurora)
+        
+            # --- ここから下は元のスクリプトのループ内ロジック ---
+        
+            # データ取得 (ロボットとAuroraを同時に読み取る)
+            sample = sampler.sample()
+            robot = generateRobotArmAxisAngle(sample["robot"])
+            probes = sample["aurora"]
+        
+            # ロボットデータを保存
+            robot_data['x'].append(robot.pos.x)
+            robot_data['y'].append(robot.pos.y)
+            robot_data['z'].append(robot.pos.z)
+            robot_data['rx'].append(robot.rot.rx)
+            robot_data['ry'].append(robot.rot.ry)
+            robot_data['rz'].append(robot.rot.rz)
+
+            # オーロラデータを保存
+            aurora_data['x'].append(probes[0].pos.x)
+            aurora_data['y'].append(probes[0].pos.y)
+            aurora_data['z'].append(probes[0].pos.z)
+            aurora_data['quat_x'].append(probes[0].quat.x)
+            aurora_data['quat_y'].append(probes[0].quat.y)
+            aurora_data['quat_z'].append(probes[0].quat.z)
+            aurora_data['quat_w'].append(probes[0].quat.w)
+            aurora_data['quality'].append(probes[0].quality)
+            aurora_data['pos_spread'].append(probes[0].pos_spread)
+            aurora_data['rot_spread'].append(probes[0].rot_spread)
+
+            settling.wait_after_sample()
+
+            # 現在のauroraの位置・姿勢を目標にセットし、それを実現するロボットアームの姿勢を計算
+            t_sensor_from_aurora_goal = np.array([probes[0].pos.x, probes[0].pos.y, probes[0].pos.z])
+            quat_sensor_from_aurora_goal = np.array([probes[0].quat.x, probes[0].quat.y, probes[0].quat.z, probes[0].quat.w])
+
+            T_arm_from_robot = transformer.transform(t_sensor_from_aurora_goal, quat_sensor_from_aurora_goal)
+
+            # T_arm_from_robotをTransformオブジェクトに変換
+            T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
+            t_arm_from_robot = T_arm_from_robot_transform.t
+            R_arm_from_robot = T_arm_from_robot_transform.R
+            arm_rotvec_from_robot = R.from_matrix(R_arm_from_robot).as_rotvec(degrees=True)
+
+            # ロボットアームを移動
+            angle_pose = [t_arm_from_robot[0], t_arm_from_robot[1], t_arm_from_robot[2], arm_rotvec_from_robot[0], arm_rotvec_from_robot[1], arm_rotvec_from_robot[2]]
+            arm.set_position_aa(angle_pose, speed=50, wait=True)
+
+            sample_after = sampler.sample()
+            robot_after = generateRobotArmAxisAngle(sample_after["robot"])
+            probes_after = sample_after["aurora"]
+
+            # 移動後のロボットデータを保存
+            robot_after_data['x'].append(robot_after.pos.x)
+            robot_after_data['y'].append(robot_after.pos.y)
+            robot_after_data['z'].append(robot_after.pos.z)
+            robot_after_data['rx'].append(robot_after.rot.rx)
+            robot_after_data['ry'].append(robot_after.rot.ry)
+            robot_after_data['rz'].append(robot_after.rot.rz)
+
+            # 移動後のオーロラデータを保存
+            aurora_after_data['x'].append(probes_after[0].pos.x)
+            aurora_after_data['y'].append(probes_after[0].pos.y)
+            aurora_after_data['z'].append(probes_after[0].pos.z)
+            aurora_after_data['quat_x'].append(probes_after[0].quat.x)
+            aurora_after_data['quat_y'].append(probes_after[0].quat.y)
+            aurora_after_data['quat_z'].append(probes_after[0].quat.z)
+            aurora_after_data['quat_w'].append(probes_after[0].quat.w)
+            aurora_after_data['quality'].append(probes_after[0].quality)
+            aurora_after_data['pos_spread'].append(probes_after[0].pos_spread)
+            aurora_after_data['rot_spread'].append(probes_after[0].rot_spread)
+
+            settling.wait_after_sample(2)
+            # --- ここまでが元のスクリプトのループ内ロジック ---
+
+            # ファイルに追記し、メモリには残さない
+            if writer is not None:
+                deltas = evaluate_accuracy(robot_data, aurora_data, robot_after_data, aurora_after_data)
+                writer.write_rows(evaluation_rows(robot_data, aurora_data, robot_after_data, aurora_after_data, *deltas))
+                clear_collected_data(robot_data, aurora_data, robot_after_data, aurora_after_data)
+                if checkpoint is not None:
+                    checkpoint.mark_done(point_counter)
+    finally:
+        sampler.close()
+
+    if checkpoint is not None:
+        checkpoint.finish()
+    log.info("データ収集完了")
+    settling.print_summary()
     return robot_data, aurora_data, robot_after_data, aurora_after_data
 
 # ===================================================================
@@ -266,6 +316,10 @@ def save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after
             # オーロラの品質データ
             np.round(aurora_data['quality'][i], decimal_places),
 
+            # オーロラの複数フレームのばらつき (位置 [mm], 姿勢 [度])
+            np.round(aurora_data['pos_spread'][i], decimal_places),
+            np.round(aurora_data['rot_spread'][i], decimal_places),
+
             # 移動後のロボットの位置データ
             np.round(robot_after_data['x'][i], decimal_places),
             np.round(robot_after_data['y'][i], decimal_places),
@@ -290,6 +344,10 @@ def save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after
             # 移動後のオーロラの品質データ
             np.round(aurora_after_data['quality'][i], decimal_places),
 
+            # オーロラの複数フレームのばらつき (位置 [mm], 姿勢 [度])
+            np.round(aurora_after_data['pos_spread'][i], decimal_places),
+            np.round(aurora_after_data['rot_spread'][i], decimal_places),
+
             # auroraの差分データ
             np.round(delta_t_aurora_data['x'][i], decimal_places),
             np.round(delta_t_aurora_data['y'][i], decimal_places),
@@ -319,28 +377,11 @@ def save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after
     # CSVファイルに出力
     with open(filename, "w", newline="") as f:
         writer = csv.writer(f)
-        # ヘッダー行
-        header = [
-            "robot_x", "robot_y", "robot_z",
-            "robot_rx", "robot_ry", "robot_rz",
-            "aurora_x", "aurora_y", "aurora_z",
-            "aurora_quat_x", "aurora_quat_y", "aurora_quat_z", "aurora_quat_w",
-            "aurora_quality",
-            "robot_after_x", "robot_after_y", "robot_after_z",
-            "robot_after_rx", "robot_after_ry", "robot_after_rz",
-            "aurora_after_x", "aurora_after_y", "aurora_after_z",
-            "aurora_after_quat_x", "aurora_after_quat_y", "aurora_after_quat_z", "aurora_after_quat_w",
-            "aurora_after_quality",
-            "delta_t_aurora_x", "delta_t_aurora_y", "delta_t_aurora_z", "delta_t_aurora_norm",
-            "delta_R_aurora_rx", "delta_R_aurora_ry", "delta_R_aurora_rz", "delta_R_aurora_angle",
-            "delta_t_robot_x", "delta_t_robot_y", "delta_t_robot_z", "delta_t_robot_norm",
-            "delta_R_robot_rx", "delta_R_robot_ry", "delta_R_robot_rz", "delta_R_robot_angle"
-        ]
-        writer.writerow(header)
+        writer.writerow(EVALUATION_LOG_COLUMNS)
         # データ行を書き込み
         writer.writerows(data)
     
-    print(f"拡張データを {filename} に保存しました。合計 {total_points} 行。")
+    log.info("拡張データを %s に保存しました。合計 %d 行。", filename, total_points)
 
 def cleanup(arm, aurora):
     """デバイスをクリーンアップして接続を終了"""
@@ -350,7 +391,8 @@ def cleanup(arm, aurora):
         arm.disconnect()
     print("デバイスの接続を終了しました")
 
-def main(position, roll_range, pitch_range, yaw_ranges, N, output_file):
+def main(position, roll_range, pitch_range, yaw_ranges, N, output_file, settling_mode="real", frames_per_point=1,
+         background_reader=False, quiet=False, resume=True):
     """
     メイン関数：データ収集からCSV保存までの全体の流れを制御
     
@@ -361,13 +403,19 @@ def main(position, roll_range, pitch_range, yaw_ranges, N, output_file):
         yaw_ranges (tuple): Yawの範囲のタプル ((範囲1開始, 範囲1終了), (範囲2開始, 範囲2終了))
         N (int): 各角度範囲のサンプル分割数（N+1ポイント取得）
         output_file (str): 出力ファイルのパス
+        settling_mode (str): 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+        frames_per_point (int): 1点あたりに取得して平均するAuroraのフレーム数
+        background_reader (bool): バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+        quiet (bool): 静音モード: 進捗・計算結果の表示を行わず、警告以上のみ表示する
+        resume (bool): 前回中断した評価が残っていれば完了済みの点を飛ばして続きから評価する
     """
+    configure_logging(quiet=quiet)
     arm = None
     aurora = None
     try:
         # 初期化
         arm = initialize_robot()
-        aurora = initialize_aurora()
+        aurora = initialize_aurora(background=background_reader)
         
         # 設定情報を表示
         print("設定情報:")
@@ -378,21 +426,14 @@ def main(position, roll_range, pitch_range, yaw_ranges, N, output_file):
         print(f"  各範囲のサンプル分割数: {N} ({N+1} ポイント)")
 
         # データ収集（★★ 関数名を変更 ★★）
-        robot_data, aurora_data, robot_after_data, aurora_after_data = collect_diff_data_by_orientation(
-            arm, aurora, position, roll_range, pitch_range, yaw_ranges, N
-        )
-
-        # 正確性評価
-        delta_t_aurora_data, delta_R_aurora_data, delta_t_robot_data, delta_R_robot_data = evaluate_accuracy(
-            robot_data, aurora_data, robot_after_data, aurora_after_data
-        )
-
-        # CSV保存
-        save_to_csv_extended(
-            robot_data, aurora_data, robot_after_data, aurora_after_data, 
-            delta_t_aurora_data, delta_R_aurora_data, delta_t_robot_data, delta_R_robot_data, 
-            output_file
-        )
+        # 各点の正確性評価を取得後すぐに行ってCSVに追記し、進捗を記録する (中断しても続きから再開できる)
+        poses = orientation_poses(position, roll_range, pitch_range, yaw_ranges, N)
+        with SweepCheckpoint(output_file, EVALUATION_LOG_COLUMNS, poses, resume=resume) as checkpoint:
+            collect_diff_data_by_orientation(
+                arm, aurora, position, roll_range, pitch_range, yaw_ranges, N,
+                settling=make_settling_policy(settling_mode), frames_per_point=frames_per_point,
+                checkpoint=checkpoint
+            )
         
         print("処理が正常に完了しました")
         
@@ -426,6 +467,21 @@ if __name__ == "__main__":
     
     # 4. 出力するCSVファイル名 (ファイル名を変更推奨)
     OUTPUT_FILE = "robot&aurora/current_code/new_transform/accuracy_test_data/transform_accuracy_orientation_202510290053.csv"
+
+    # 5. 移動後の待機方法 ("real": 固定時間, "virtual": 待たない (シミュレーション用), "adaptive": 連続するフレームが一致するまで, "stability": フレームのばらつきが閾値以下になるまで)
+    SETTLING_MODE = "real"
+
+    # 6. 1点あたりに取得して平均するAuroraのフレーム数
+    FRAMES_PER_POINT = 5
+
+    # 7. バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+    BACKGROUND_READER = True
+
+    # 8. 静音モード (進捗・差分の表示を行わず、警告以上のみ表示する)
+    QUIET = False
+
+    # 9. 前回中断した評価が残っていれば、完了済みの点を飛ばして続きから評価する
+    RESUME = True
     
     # ===== プログラム実行 =====
     main(
@@ -435,4 +491,9 @@ if __name__ == "__main__":
         yaw_ranges=YAW_RANGES,
         N=N_SAMPLES,
         output_file=OUTPUT_FILE,
+        settling_mode=SETTLING_MODE,
+        frames_per_point=FRAMES_PER_POINT,
+        background_reader=BACKGROUND_READER,
+        quiet=QUIET,
+        resume=RESUME,
     )
\ No newline at end of file
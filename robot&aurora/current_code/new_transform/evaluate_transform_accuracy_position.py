@@ -1,25 +1,60 @@
 # 座標・姿勢変換の正確性を評価するためのデータ収集スクリプト
-import time
 import numpy as np
 import csv
-from utils.pose_formatter import generateRobotArmAxisAngle, generateProbe
+from utils.pose_formatter import generateRobotArmAxisAngle
+from utils.acquisition import make_robot_aurora_sampler
 from utils.initialization import initialize_robot, initialize_aurora
+from utils.settling import FixedSettling, make_settling_policy
 from scipy.spatial.transform import Rotation as R
 from calibration.transformation_utils import Transform, compute_transform_difference
-from main import main as run_pose_transoformation
+from calibration.pose_transformer import PoseTransformer
+from calibration.sweep_checkpoint import SweepCheckpoint
+from calibration.row_log import EVALUATION_LOG_COLUMNS, evaluation_rows, clear_collected_data
+from calibration.logger import get_logger, configure_logging
 
+log = get_logger(__name__)
 
-def collect_diff_data(arm, aurora, x_range, y_range, z_range, N):
-    """指定された範囲でデータを収集"""
+# キャリブレーション用CSVファイルのパス
+WORLD_CALIB_CSV = "robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv"
+HAND_EYE_CALIB_CSV = "robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv"
+
+def grid_poses(x_range, y_range, z_range, N):
+    """格子点 [x, y, z] のリスト ((N+1)**3 点、x, y, z の順にループした順)"""
     x_start, x_end = x_range
     y_start, y_end = y_range
     z_start, z_end = z_range
+    poses = []
+    for point in range((N + 1) ** 3):
+        # インデックスから3次元座標を計算
+        i = point // ((N+1)**2)
+        j = (point // (N+1)) % (N+1)
+        k = point % (N+1)
+        poses.append([x_start + (x_end - x_start) / N * i,
+                      y_start + (y_end - y_start) / N * j,
+                      z_start + (z_end - z_start) / N * k])
+    return poses
+
+
+def collect_diff_data(arm, aurora, x_range, y_range, z_range, N, settling=None, frames_per_point=1, writer=None,
+                      checkpoint=None):
+    """
+    指定された範囲でデータを収集
+    settling: 移動後・取得後の待機方法（省略時は FixedSettling: 移動後2秒、取得後1秒）
+    frames_per_point: 1点あたりに取得して平均するAuroraのフレーム数
+    writer: RowLogWriter を与えた場合は各点の評価結果 (EVALUATION_LOG_COLUMNS の列) を取得後すぐにファイルへ追記し、
+            戻り値の辞書には保存しない (中断してもそれまでの結果が残り、メモリ使用量は点数によらず一定)
+    checkpoint: SweepCheckpoint を与えた場合はその計画の格子点を訪れ、完了済みの点を飛ばして続きから評価する
+                (writer の代わりに checkpoint.writer に追記する)
+    """
+    if settling is None:
+        settling = FixedSettling()
+
+    poses = grid_poses(x_range, y_range, z_range, N)
+    if checkpoint is not None:
+        poses = checkpoint.poses
+        writer = checkpoint.writer
     
-    x_step = (x_end - x_start) / N
-    y_step = (y_end - y_start) / N
-    z_step = (z_end - z_start) / N
-    
-    total_points = (N+1)**3
+    total_points = len(poses)
     
     # データ格納用ディクショナリ
     robot_data = {
@@ -30,7 +65,8 @@ def collect_diff_data(arm, aurora, x_range, y_range, z_range, N):
     aurora_data = {
         'x': [], 'y': [], 'z': [], 
         'quat_x': [], 'quat_y': [], 'quat_z': [], 'quat_w': [],
-        'quality': []
+        'quality': [],
+        'pos_spread': [], 'rot_spread': []
     }
 
     robot_after_data = {
@@ -41,101 +77,115 @@ def collect_diff_data(arm, aurora, x_range, y_range, z_range, N):
     aurora_after_data = {
         'x': [], 'y': [], 'z': [],
         'quat_x': [], 'quat_y': [], 'quat_z': [], 'quat_w': [],
-        'quality': []
+        'quality': [],
+        'pos_spread': [], 'rot_spread': []
     }
     
-    print(f"データ収集開始: 合計 {total_points} ポイント")
+    # キャリブレーション結果を読み込み、座標変換器を作成（ループ内では再計算しない）
+    transformer = PoseTransformer.from_calibration(WORLD_CALIB_CSV, HAND_EYE_CALIB_CSV)
+
+    log.info("データ収集開始: 合計 %d ポイント", total_points)
     
-    # 各位置での計測
-    for point in range(total_points):
-        # インデックスから3次元座標を計算
-        i = point // ((N+1)**2)
-        j = (point // (N+1)) % (N+1)
-        k = point % (N+1)
-        
-        # 現在のポイント位置を計算
-        current_x = x_start + x_step * i
-        current_y = y_start + y_step * j
-        current_z = z_start + z_step * k
-        
-        # 進捗表示
-        if point % 10 == 0:
-            progress = (point / total_points) * 100
-            print(f"進捗: {progress:.1f}% ({point}/{total_points})")
+    # ロボットとAuroraを同時に読み取る (例外・Ctrl+C で中断した場合もワーカースレッドを止める)
+    sampler = make_robot_aurora_sampler(arm, aurora, frames_per_point)
+    try:
+        # 各位置での計測
+        for point, (current_x, current_y, current_z) in enumerate(poses):
+            if checkpoint is not None and checkpoint.is_done(point):
+                continue
+
+            # 進捗表示
+            if point % 10 == 0:
+                progress = (point / total_points) * 100
+                log.info("進捗: %.1f%% (%d/%d)", progress, point, total_points)
         
-        # ロボットアームを移動
-        arm.set_position(x=current_x, y=current_y, z=current_z, roll=0, pitch=0, yaw=180, speed=50, wait=True)
-        time.sleep(2)
+            # ロボットアームを移動
+            arm.set_position(x=current_x, y=current_y, z=current_z, roll=0, pitch=0, yaw=180, speed=50, wait=True)
+            settling.wait_after_move(aurora)
         
-        # データ取得
-        robot = generateRobotArmAxisAngle(arm.get_position_aa())
-        probes = generateProbe(aurora.get_frame())
+            # データ取得 (ロボットとAuroraを同時に読み取る)
+            sample = sampler.sample()
+            robot = generateRobotArmAxisAngle(sample["robot"])
+            probes = sample["aurora"]
         
-        # ロボットデータを保存
-        robot_data['x'].append(robot.pos.x)
-        robot_data['y'].append(robot.pos.y)
-        robot_data['z'].append(robot.pos.z)
-        robot_data['rx'].append(robot.rot.rx)
-        robot_data['ry'].append(robot.rot.ry)
-        robot_data['rz'].append(robot.rot.rz)
-
-        # オーロラデータを保存
-        aurora_data['x'].append(probes[0].pos.x)
-        aurora_data['y'].append(probes[0].pos.y)
-        aurora_data['z'].append(probes[0].pos.z)
-        aurora_data['quat_x'].append(probes[0].quat.x)
-        aurora_data['quat_y'].append(probes[0].quat.y)
-        aurora_data['quat_z'].append(probes[0].quat.z)
-        aurora_data['quat_w'].append(probes[0].quat.w)
-        aurora_data['quality'].append(probes[0].quality)
-
-        time.sleep(1)
-
-        # 現在のauroraの位置・姿勢を目標にセットし、それを実現するロボットアームの姿勢を計算
-        t_sensor_from_aurora_goal = np.array([probes[0].pos.x, probes[0].pos.y, probes[0].pos.z])
-        quat_sensor_from_aurora_goal = np.array([probes[0].quat.x, probes[0].quat.y, probes[0].quat.z, probes[0].quat.w])
-
-        T_arm_from_robot = run_pose_transoformation(
-            goal_aurora_point=t_sensor_from_aurora_goal,
-            goal_aurora_quaternion=quat_sensor_from_aurora_goal,
-            world_calib_csv="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv",
-            hand_eye_calib_csv="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20251105.csv"
-        )
-
-        # T_arm_from_robotをTransformオブジェクトに変換
-        T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
-        t_arm_from_robot = T_arm_from_robot_transform.t
-        R_arm_from_robot = T_arm_from_robot_transform.R
-        arm_rotvec_from_robot = R.from_matrix(R_arm_from_robot).as_rotvec(degrees=True)
-
-        # ロボットアームを移動
-        angle_pose = [t_arm_from_robot[0], t_arm_from_robot[1], t_arm_from_robot[2], arm_rotvec_from_robot[0], arm_rotvec_from_robot[1], arm_rotvec_from_robot[2]]
-        arm.set_position_aa(angle_pose, speed=50, wait=True)
-
-        robot_after = generateRobotArmAxisAngle(arm.get_position_aa())
-        probes_after = generateProbe(aurora.get_frame())
-
-        # 移動後のロボットデータを保存
-        robot_after_data['x'].append(robot_after.pos.x)
-        robot_after_data['y'].append(robot_after.pos.y)
-        robot_after_data['z'].append(robot_after.pos.z)
-        robot_after_data['rx'].append(robot_after.rot.rx)
-        robot_after_data['ry'].append(robot_after.rot.ry)
-        robot_after_data['rz'].append(robot_after.rot.rz)
-
-        # 移動後のオーロラデータを保存
-        aurora_after_data['x'].append(probes_after[0].pos.x)
-        aurora_after_data['y'].append(probes_after[0].pos.y)
-        aurora_after_data['z'].append(probes_after[0].pos.z)
-        aurora_after_data['quat_x'].append(probes_after[0].quat.x)
-        aurora_after_data['quat_y'].append(probes_after[0].quat.y)
-        aurora_after_data['quat_z'].append(probes_after[0].quat.z)
-        aurora_after_data['quat_w'].append(probes_after[0].quat.w)
-        aurora_after_data['quality'].append(probes_after[0].quality)
-
-        time.sleep(2)
-    
-    print("データ収集完了")
+            # ロボットデータを保存
+            robot_data['x'].append(robot.pos.x)
+            robot_data['y'].append(robot.pos.y)
+            robot_data['z'].append(robot.pos.z)
+            robot_data['rx'].append(robot.rot.rx)
+            robot_data['ry'].append(robot.rot.ry)
+            robot_data['rz'].append(robot.rot.rz)
+
+            # オーロラデータを保存
+            aurora_data['x'].append(probes[0].pos.x)
+            aurora_data['y'].append(probes[0].pos.y)
+            aurora_data['z'].append(probes[0].pos.z)
+            aurora_data['quat_x'].append(probes[0].quat.x)
+            aurora_data['quat_y'].append(probes[0].quat.y)
+            aurora_data['quat_z'].append(probes[0].quat.z)
+            aurora_data['quat_w'].append(probes[0].quat.w)
+            aurora_data['quality'].append(probes[0].quality)
+            aurora_data['pos_spread'].append(probes[0].pos_spread)
+            aurora_data['rot_spread'].append(probes[0].rot_spread)
+
+            settling.wait_after_sample()
+
+            # 現在のauroraの位置・姿勢を目標にセットし、それを実現するロボットアームの姿勢を計算
+            t_sensor_from_aurora_goal = np.array([probes[0].pos.x, probes[0].pos.y, probes[0].pos.z])
+            quat_sensor_from_aurora_goal = np.array([probes[0].quat.x, probes[0].quat.y, probes[0].quat.z, probes[0].quat.w])
+
+            T_arm_from_robot = transformer.transform(t_sensor_from_aurora_goal, quat_sensor_from_aurora_goal)
+
+            # T_arm_from_robotをTransformオブジェクトに変換
+            T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
+            t_arm_from_robot = T_arm_from_robot_transform.t
+            R_arm_from_robot = T_arm_from_robot_transform.R
+            arm_rotvec_from_robot = R.from_matrix(R_arm_from_robot).as_rotvec(degrees=True)
+
+            # ロボットアームを移動
+            angle_pose = [t_arm_from_robot[0], t_arm_from_robot[1], t_arm_from_robot[2], arm_rotvec_from_robot[0], arm_rotvec_from_robot[1], arm_rotvec_from_robot[2]]
+            arm.set_position_aa(angle_pose, speed=50, wait=True)
+
+            sample_after = sampler.sample()
+            robot_after = generateRobotArmAxisAngle(sample_after["robot"])
+            probes_after = sample_after["aurora"]
+
+            # 移動後のロボットデータを保存
+            robot_after_data['x'].append(robot_after.pos.x)
+            robot_after_data['y'].append(robot_after.pos.y)
+            robot_after_data['z'].append(robot_after.pos.z)
+            robot_after_data['rx'].append(robot_after.rot.rx)
+            robot_after_data['ry'].append(robot_after.rot.ry)
+            robot_after_data['rz'].append(robot_after.rot.rz)
+
+            # 移動後のオーロラデータを保存
+            aurora_after_data['x'].append(probes_after[0].pos.x)
+            aurora_after_data['y'].append(probes_after[0].pos.y)
+            aurora_after_data['z'].append(probes_after[0].pos.z)
+            aurora_after_data['quat_x'].append(probes_after[0].quat.x)
+            aurora_after_data['quat_y'].append(probes_after[0].quat.y)
+            aurora_after_data['quat_z'].append(probes_after[0].quat.z)
+            aurora_after_data['quat_w'].append(probes_after[0].quat.w)
+            aurora_after_data['quality'].append(probes_after[0].quality)
+            aurora_after_data['pos_spread'].append(probes_after[0].pos_spread)
+            aurora_after_data['rot_spread'].append(probes_after[0].rot_spread)
+
+            settling.wait_after_sample(2)
+
+            # ファイルに追記し、メモリには残さない
+            if writer is not None:
+                deltas = evaluate_accuracy(robot_data, aurora_data, robot_after_data, aurora_after_data)
+                writer.write_rows(evaluation_rows(robot_data, aurora_data, robot_after_data, aurora_after_data, *deltas))
+                clear_collected_data(robot_data, aurora_data, robot_after_data, aurora_after_data)
+                if checkpoint is not None:
+                    checkpoint.mark_done(point)
+    finally:
+        sampler.close()
+
+    if checkpoint is not None:
+        checkpoint.finish()
+    log.info("データ収集完了")
+    settling.print_summary()
     return robot_data, aurora_data, robot_after_data, aurora_after_data
 
 # 正確性評価用の関数
@@ -251,6 +301,10 @@ def save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after
             # オーロラの品質データ
             np.round(aurora_data['quality'][i], decimal_places),
 
+            # オーロラの複数フレームのばらつき (位置 [mm], 姿勢 [度])
+            np.round(aurora_data['pos_spread'][i], decimal_places),
+            np.round(aurora_data['rot_spread'][i], decimal_places),
+
             # 移動後のロボットの位置データ
             np.round(robot_after_data['x'][i], decimal_places),
             np.round(robot_after_data['y'][i], decimal_places),
@@ -275,6 +329,10 @@ def save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after
             # 移動後のオーロラの品質データ
             np.round(aurora_after_data['quality'][i], decimal_places),
 
+            # オーロラの複数フレームのばらつき (位置 [mm], 姿勢 [度])
+            np.round(aurora_after_data['pos_spread'][i], decimal_places),
+            np.round(aurora_after_data['rot_spread'][i], decimal_places),
+
             # auroraの差分データ
             np.round(delta_t_aurora_data['x'][i], decimal_places),
             np.round(delta_t_aurora_data['y'][i], decimal_places),
@@ -304,28 +362,11 @@ def save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after
     # CSVファイルに出力
     with open(filename, "w", newline="") as f:
         writer = csv.writer(f)
-        # ヘッダー行
-        header = [
-            "robot_x", "robot_y", "robot_z",
-            "robot_rx", "robot_ry", "robot_rz",
-            "aurora_x", "aurora_y", "aurora_z",
-            "aurora_quat_x", "aurora_quat_y", "aurora_quat_z", "aurora_quat_w",
-            "aurora_quality",
-            "robot_after_x", "robot_after_y", "robot_after_z",
-            "robot_after_rx", "robot_after_ry", "robot_after_rz",
-            "aurora_after_x", "aurora_after_y", "aurora_after_z",
-            "aurora_after_quat_x", "aurora_after_quat_y", "aurora_after_quat_z", "aurora_after_quat_w",
-            "aurora_after_quality",
-            "delta_t_aurora_x", "delta_t_aurora_y", "delta_t_aurora_z", "delta_t_aurora_norm",
-            "delta_R_aurora_rx", "delta_R_aurora_ry", "delta_R_aurora_rz", "delta_R_aurora_angle",
-            "delta_t_robot_x", "delta_t_robot_y", "delta_t_robot_z", "delta_t_robot_norm",
-            "delta_R_robot_rx", "delta_R_robot_ry", "delta_R_robot_rz", "delta_R_robot_angle"
-        ]
-        writer.writerow(header)
+        writer.writerow(EVALUATION_LOG_COLUMNS)
         # データ行を書き込み
         writer.writerows(data)
     
-    print(f"拡張データを {filename} に保存しました。合計 {total_points} 行。")
+    log.info("拡張データを %s に保存しました。合計 %d 行。", filename, total_points)
 
 def cleanup(arm, aurora):
     """デバイスをクリーンアップして接続を終了"""
@@ -333,7 +374,8 @@ def cleanup(arm, aurora):
     arm.disconnect()
     print("デバイスの接続を終了しました")
 
-def main(x_range, y_range, z_range, N, output_file):
+def main(x_range, y_range, z_range, N, output_file, settling_mode="real", frames_per_point=1,
+         background_reader=False, quiet=False, resume=True):
     """
     メイン関数：データ収集からCSV保存までの全体の流れを制御
     
@@ -343,12 +385,18 @@ def main(x_range, y_range, z_range, N, output_file):
         z_range (tuple): Z座標の範囲 (開始値, 終了値)
         N (int): 各次元のサンプル数（N+1ポイント取得）
         output_file (str): 出力ファイルのパス
+        settling_mode (str): 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+        frames_per_point (int): 1点あたりに取得して平均するAuroraのフレーム数
+        background_reader (bool): バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+        quiet (bool): 静音モード: 進捗・計算結果の表示を行わず、警告以上のみ表示する
+        resume (bool): 前回中断した評価が残っていれば完了済みの点を飛ばして続きから評価する
     """
+    configure_logging(quiet=quiet)
     try:
         # 初期化
         arm = initialize_robot()
         
-        aurora = initialize_aurora()
+        aurora = initialize_aurora(background=background_reader)
         
         # データ収集
         print(f"設定情報:")
@@ -358,12 +406,12 @@ def main(x_range, y_range, z_range, N, output_file):
         print(f"  サンプル数: {N} (各辺 {N+1} ポイント)")
         print(f"  合計測定ポイント: {(N+1)**3}")
 
-        robot_data, aurora_data, robot_after_data, aurora_after_data = collect_diff_data(arm, aurora, x_range, y_range, z_range, N)
-
-        delta_t_aurora_data, delta_R_aurora_data, delta_t_robot_data, delta_R_robot_data = evaluate_accuracy(robot_data, aurora_data, robot_after_data, aurora_after_data)
-
-        # CSV保存
-        save_to_csv_extended(robot_data, aurora_data, robot_after_data, aurora_after_data, delta_t_aurora_data, delta_R_aurora_data, delta_t_robot_data, delta_R_robot_data, output_file)
+        # 各点の正確性評価を取得後すぐに行ってCSVに追記し、進捗を記録する (中断しても続きから再開できる)
+        poses = grid_poses(x_range, y_range, z_range, N)
+        with SweepCheckpoint(output_file, EVALUATION_LOG_COLUMNS, poses, resume=resume) as checkpoint:
+            collect_diff_data(arm, aurora, x_range, y_range, z_range, N,
+                              settling=make_settling_policy(settling_mode),
+                              frames_per_point=frames_per_point, checkpoint=checkpoint)
         
         # 正常終了
         print("処理が正常に完了しました")
@@ -384,5 +432,10 @@ if __name__ == "__main__":
         y_range=(-50, 50),                     # Y座標の範囲 (開始値, 終了値)
         z_range=(-200, -300),                     # Z座標の範囲 (開始値, 終了値)
         N=5,                                   # サンプル数（各辺N+1ポイント）
+        settling_mode="real",                  # 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+        frames_per_point=5,                    # 1点あたりに取得して平均するAuroraのフレーム数
+        background_reader=True,                # バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+        quiet=False,                           # True: 進捗・差分の表示を行わず、警告以上のみ表示する
+        resume=True,                           # True: 前回中断した評価が残っていれば続きから評価する
         output_file="robot&aurora/current_code/new_transform/accuracy_test_data/transform_accuracy_20251029.csv",
     )
\ No newline at end of file
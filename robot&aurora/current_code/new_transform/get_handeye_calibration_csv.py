@@ -1,29 +1,73 @@
-import time
 import numpy as np
 import csv
-from utils.pose_formatter import generateRobotArmAxisAngle, generateProbe
+from utils.pose_formatter import generateRobotArmAxisAngle
+from utils.acquisition import make_robot_aurora_sampler
+from utils.continuous_collection import collect_continuous, rows_to_collected_data
+from utils.probe_filter import make_probe_filter
 from utils.initialization import initialize_robot, initialize_aurora
+from utils.settling import FixedSettling, make_settling_policy
+from utils.motion_planner import plan_tour, print_plan_report
+from calibration.pose_log import POSE_LOG_EXTENSION, save_to_pose_log
+from calibration.row_log import CALIBRATION_LOG_COLUMNS, calibration_row
+from calibration.sweep_checkpoint import SweepCheckpoint
+from calibration.transformation_utils import Transform
+from calibration.world_calibration import WorldCalibration
+from calibration.handeye_calibration import HandEyeCalibrationAccumulator
+from calibration.convergence import ConvergenceMonitor, RotationSpread
+from calibration.logger import get_logger, configure_logging
+
+log = get_logger(__name__)
+
+COLLECTION_MODES = ("stop_and_go", "continuous")
+
+
+def orientation_poses(fixed_pos, roll_range, pitch_range, yaw_ranges, N, optimize_order=False, speed=50.0,
+                      angular_speed=90.0):
+    """
+    目標姿勢 [x, y, z, roll, pitch, yaw] のリスト (roll, pitch, yaw の順にループした順)
+    optimize_order: True の場合は推定移動時間が短くなるように並べ替える (貪欲法 + 2-opt)
+    speed, angular_speed: 推定移動時間の計算に使う移動速度 [mm/s] と回転速度 [度/s]
+    """
+    roll_values = np.linspace(roll_range[0], roll_range[1], N + 1)
+    pitch_values = np.linspace(pitch_range[0], pitch_range[1], N + 1)
+    # yawは範囲が複数あるため、それぞれでサンプリングポイントを生成し、結合する
+    yaw_values = np.concatenate([np.linspace(yaw_range[0], yaw_range[1], N + 1) for yaw_range in yaw_ranges])
+    poses = [[fixed_pos['x'], fixed_pos['y'], fixed_pos['z'], roll, pitch, yaw]
+             for roll in roll_values for pitch in pitch_values for yaw in yaw_values]
+    if optimize_order:
+        poses = [poses[index] for index in plan_tour(poses, speed=speed, angular_speed=angular_speed)]
+    return poses
+
 
 # --- 変更点: 新しいデータ収集関数 ---
-def collect_data_by_orientation(arm, aurora, fixed_pos, roll_range, pitch_range, yaw_ranges, N):
+def collect_data_by_orientation(arm, aurora, fixed_pos, roll_range, pitch_range, yaw_ranges, N,
+                                T_aurora_from_robot=None, stop_on_convergence=False, convergence=None,
+                                settling=None, frames_per_point=1, optimize_order=False, writer=None,
+                                checkpoint=None):
     """
     指定された固定座標で、姿勢（roll, pitch, yaw）を変化させながらデータを収集する
+    T_aurora_from_robot を与えた場合は各点の取得後に T_arm_from_sensor を逐次推定して表示し、
+    stop_on_convergence=True なら推定値が収束した時点で収集を終了する
+    convergence: 収束判定に使う ConvergenceMonitor（省略時はデフォルト設定、アーム姿勢の広がりが2度以上になるまで収束としない）
+    settling: 移動後・取得後の待機方法（省略時は FixedSettling: 移動後2秒、取得後1秒）
+    frames_per_point: 1点あたりに取得して平均するAuroraのフレーム数
+    optimize_order: 推定移動時間が短くなるように姿勢を訪れる順番を並べ替える
+    writer: RowLogWriter を与えた場合は各点のデータを取得後すぐにファイルへ追記し、戻り値の辞書には保存しない
+            (中断してもそれまでのデータが残り、メモリ使用量は点数によらず一定)
+    checkpoint: SweepCheckpoint を与えた場合はその計画の姿勢を訪れ、完了済みの点を飛ばして続きから収集する
+                (writer の代わりに checkpoint.writer に追記する)
     """
-    # 各角度の範囲とステップ数を設定
-    roll_start, roll_end = roll_range
-    pitch_start, pitch_end = pitch_range
+    if settling is None:
+        settling = FixedSettling()
 
-    # numpy.linspaceを使い、各軸で (N+1) 個のサンプリングポイントを生成
-    roll_values = np.linspace(roll_start, roll_end, N + 1)
-    pitch_values = np.linspace(pitch_start, pitch_end, N + 1)
-    
-    # yawは範囲が2つあるため、それぞれでサンプリングポイントを生成し、結合する
-    yaw_values_1 = np.linspace(yaw_ranges[0][0], yaw_ranges[0][1], N + 1)
-    yaw_values_2 = np.linspace(yaw_ranges[1][0], yaw_ranges[1][1], N + 1)
-    all_yaw_values = np.concatenate((yaw_values_1, yaw_values_2))
+    # 各軸で (N+1) 個のサンプリングポイントを生成し、訪れる順に並べる
+    poses = orientation_poses(fixed_pos, roll_range, pitch_range, yaw_ranges, N, optimize_order=optimize_order)
+    if checkpoint is not None:
+        poses = checkpoint.poses
+        writer = checkpoint.writer
 
     # 全体のデータポイント数を計算
-    total_points = len(roll_values) * len(pitch_values) * len(all_yaw_values)
+    total_points = len(poses)
     
     # データ格納用ディクショナリ
     robot_data = {
@@ -33,34 +77,62 @@ def collect_data_by_orientation(arm, aurora, fixed_pos, roll_range, pitch_range,
     aurora_data = {
         'x': [], 'y': [], 'z': [], 
         'quat_x': [], 'quat_y': [], 'quat_z': [], 'quat_w': [],
-        'quality': []
+        'quality': [],
+        'pos_spread': [], 'rot_spread': []
     }
     
-    print(f"データ収集開始: 合計 {total_points} ポイント")
+    # 逐次ハンドアイキャリブレーション（ワールドキャリブレーション結果がある場合のみ）
+    accumulator = None
+    if T_aurora_from_robot is not None:
+        accumulator = HandEyeCalibrationAccumulator(T_aurora_from_robot)
+        # アーム姿勢の広がり (1つの軸まわりの回転だけで収束と判定しないため)
+        spread = RotationSpread()
+        if convergence is None:
+            convergence = ConvergenceMonitor(min_spread=2.0)
+
+        # 再開した場合は前回までのデータで逐次推定をやり直す
+        if checkpoint is not None and checkpoint.completed:
+            for row in checkpoint.completed_rows():
+                T_arm_from_robot = Transform.from_rotvec(row[3:6], row[0:3], degrees=True).matrix
+                accumulator.add(T_arm_from_robot, Transform.from_quat(row[9:13], row[6:9]).matrix)
+                spread.add(T_arm_from_robot[:3, :3])
+            convergence.update(accumulator.transform(), spread.spread)
+
+    log.info("データ収集開始: 合計 %d ポイント", total_points)
     
-    point_count = 0
-    # 各姿勢での計測
-    for roll in roll_values:
-        for pitch in pitch_values:
-            for yaw in all_yaw_values:
-                # 進捗表示
-                if point_count % 10 == 0:
-                    progress = (point_count / total_points) * 100
-                    print(f"進捗: {progress:.1f}% ({point_count}/{total_points})")
-                
-                # --- ★★★ ここが重要な変更点 ★★★ ---
-                # 固定されたXYZ座標と、ループで変化するroll, pitch, yawを使ってアームを移動
-                arm.set_position(
-                    x=fixed_pos['x'], y=fixed_pos['y'], z=fixed_pos['z'], 
-                    roll=roll, pitch=pitch, yaw=yaw, 
-                    speed=50, wait=True
-                )
-                time.sleep(2)
-                
-                # データ取得
-                robot = generateRobotArmAxisAngle(arm.get_position_aa())
-                probes = generateProbe(aurora.get_frame())
-                
+    # ロボットとAuroraを同時に読み取る (例外・Ctrl+C で中断した場合もワーカースレッドを止める)
+    sampler = make_robot_aurora_sampler(arm, aurora, frames_per_point)
+    try:
+        # 各姿勢での計測
+        for point_count, (x, y, z, roll, pitch, yaw) in enumerate(poses):
+            if checkpoint is not None and checkpoint.is_done(point_count):
+                continue
+
+            # 進捗表示
+            if point_count % 10 == 0:
+                progress = (point_count / total_points) * 100
+                log.info("進捗: %.1f%% (%d/%d)", progress, point_count, total_points)
+        
+            # --- ★★★ ここが重要な変更点 ★★★ ---
+            # 固定されたXYZ座標と、変化するroll, pitch, yawを使ってアームを移動
+            arm.set_position(
+                x=x, y=y, z=z, 
+                roll=roll, pitch=pitch, yaw=yaw, 
+                speed=50, wait=True
+            )
+            settling.wait_after_move(aurora)
+        
+            # データ取得 (ロボットとAuroraを同時に読み取る)
+            sample = sampler.sample()
+            robot = generateRobotArmAxisAngle(sample["robot"])
+            probes = sample["aurora"]
+        
+            if writer is not None:
+                # ファイルに追記し、メモリには残さない
+                writer.write_row(calibration_row(robot, probes[0]))
+                if checkpoint is not None:
+                    checkpoint.mark_done(point_count)
+            else:
                 # ロボットデータを保存
                 robot_data['x'].append(robot.pos.x)
                 robot_data['y'].append(robot.pos.y)
@@ -78,14 +150,65 @@ def collect_data_by_orientation(arm, aurora, fixed_pos, roll_range, pitch_range,
                 aurora_data['quat_z'].append(probes[0].quat.z)
                 aurora_data['quat_w'].append(probes[0].quat.w)
                 aurora_data['quality'].append(probes[0].quality)
+                aurora_data['pos_spread'].append(probes[0].pos_spread)
+                aurora_data['rot_spread'].append(probes[0].rot_spread)
 
-                time.sleep(1)
-                point_count += 1
-    
-    print("データ収集完了")
+            # 暫定のハンドアイキャリブレーション結果を更新
+            if accumulator is not None:
+                T_arm_from_robot = Transform.from_rotvec(
+                    [robot.rot.rx, robot.rot.ry, robot.rot.rz], [robot.pos.x, robot.pos.y, robot.pos.z], degrees=True
+                ).matrix
+                T_sensor_from_aurora = Transform.from_quat(
+                    [probes[0].quat.x, probes[0].quat.y, probes[0].quat.z, probes[0].quat.w],
+                    [probes[0].pos.x, probes[0].pos.y, probes[0].pos.z]
+                ).matrix
+                accumulator.add(T_arm_from_robot, T_sensor_from_aurora)
+                spread.add(T_arm_from_robot[:3, :3])
+                T_arm_from_sensor = accumulator.transform()
+                convergence.update(T_arm_from_sensor, spread.spread)
+                if T_arm_from_sensor is not None and point_count % 10 == 0:
+                    t = T_arm_from_sensor[:3, 3]
+                    log.info("  暫定推定 t: x: %.2f, y: %.2f, z: %.2f (変化量: %.3f mm, %.3f 度)",
+                          t[0], t[1], t[2], convergence.delta_t, convergence.delta_angle_deg)
+
+                if stop_on_convergence and convergence.converged:
+                    log.info("推定値が収束したため収集を終了します (%d/%d ポイント)", point_count + 1, total_points)
+                    if checkpoint is not None:
+                        checkpoint.finish()
+                    log.info("データ収集完了")
+                    settling.print_summary()
+                    return robot_data, aurora_data
+
+            settling.wait_after_sample()
+    finally:
+        sampler.close()
+
+    if checkpoint is not None:
+        checkpoint.finish()
+    log.info("データ収集完了")
+    settling.print_summary()
     return robot_data, aurora_data
 
 
+def collect_data_by_orientation_continuous(arm, aurora, fixed_pos, roll_range, pitch_range, yaw_ranges, N,
+                                           speed=10.0, angular_speed=20.0, optimize_order=False, **kwargs):
+    """
+    姿勢のスイープを止まらずに順に通過しながらデータを収集する (連続収集モード)
+    位置は固定のため、収集の速さと回転の同期ずれを決めるのは angular_speed (speed はほぼ影響しない)
+    speed: 移動速度 [mm/s]
+    angular_speed: 回転速度 [度/s]
+        速いほど1分あたりの組は増えるが、各組の回転の同期ずれ (angular_speed × timing_uncertainty) が大きくなる
+        (max_sync_error_deg を省略した場合、許容値はこの速度から決まる。collect_continuous を参照)
+    optimize_order: 推定移動時間が短くなるように姿勢を訪れる順番を並べ替える
+    kwargs: collect_continuous に渡す引数 (blend_radius, tracker_latency, max_sync_error_deg など)
+    戻り値: collect_data_by_orientation と同じ形式の (robot_data, aurora_data)
+    """
+    poses = orientation_poses(fixed_pos, roll_range, pitch_range, yaw_ranges, N,
+                              optimize_order=optimize_order, speed=speed, angular_speed=angular_speed)
+    rows, _ = collect_continuous(arm, aurora, poses, speed=speed, angular_speed=angular_speed, **kwargs)
+    return rows_to_collected_data(rows)
+
+
 def save_to_csv_extended(robot_data, aurora_data, filename, decimal_places=3):
     """拡張データをCSVファイルに保存（この関数は変更なし）"""
     data = []
@@ -106,7 +229,11 @@ def save_to_csv_extended(robot_data, aurora_data, filename, decimal_places=3):
             np.round(aurora_data['quat_y'][i], decimal_places),
             np.round(aurora_data['quat_z'][i], decimal_places),
             np.round(aurora_data['quat_w'][i], decimal_places),
-            np.round(aurora_data['quality'][i], decimal_places)
+            np.round(aurora_data['quality'][i], decimal_places),
+
+            # オーロラの複数フレームのばらつき (位置 [mm], 姿勢 [度])
+            np.round(aurora_data['pos_spread'][i], decimal_places),
+            np.round(aurora_data['rot_spread'][i], decimal_places)
         ]
         data.append(row)
     
@@ -117,12 +244,12 @@ def save_to_csv_extended(robot_data, aurora_data, filename, decimal_places=3):
             "robot_rx", "robot_ry", "robot_rz",
             "aurora_x", "aurora_y", "aurora_z",
             "aurora_quat_x", "aurora_quat_y", "aurora_quat_z", "aurora_quat_w",
-            "aurora_quality"
+            "aurora_quality", "aurora_pos_spread", "aurora_rot_spread"
         ]
         writer.writerow(header)
         writer.writerows(data)
     
-    print(f"拡張データを {filename} に保存しました。合計 {total_points} 行。")
+    log.info("拡張データを %s に保存しました。合計 %d 行。", filename, total_points)
 
 
 def cleanup(arm, aurora):
@@ -133,13 +260,47 @@ def cleanup(arm, aurora):
 
 
 # --- 変更点: main関数のパラメータ設定 ---
-def main(fixed_pos, roll_range, pitch_range, yaw_ranges, N, output_file):
+def main(fixed_pos, roll_range, pitch_range, yaw_ranges, N, output_file,
+         world_calib_csv=None, stop_on_convergence=False, settling_mode="real",
+         frames_per_point=1, background_reader=False, collection_mode="stop_and_go", continuous_speed=10.0,
+         continuous_angular_speed=20.0, optimize_order=False, dry_run=False, filter_probes=False, max_quality=None,
+         quiet=False, resume=True):
     """
     メイン関数：姿勢を変化させるデータ収集からCSV保存までの流れを制御
+    world_calib_csv: ワールドキャリブレーション用CSV（指定すると収集中に T_arm_from_sensor の収束を監視する）
+    stop_on_convergence: 推定値が収束したら収集を途中で終了する
+    settling_mode: 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+    frames_per_point: 1点あたりに取得して平均するAuroraのフレーム数
+    background_reader: バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+    collection_mode: "stop_and_go" (各点で停止して取得), "continuous" (止まらずに移動しながら取得)
+    continuous_speed: 連続収集モードの移動速度 [mm/s]
+    continuous_angular_speed: 連続収集モードの回転速度 [度/s] (姿勢のスイープではこちらが収集の速さと同期ずれを決める)
+    optimize_order: 推定移動時間が短くなるように姿勢を訪れる順番を並べ替える
+    dry_run: ロボットに接続せず、訪れる順番の推定移動時間だけを表示して終了する
+    filter_probes: 連続収集モードで、測定範囲外・品質値の悪いフレームと外れ値を除く (平滑化はしない)
+    max_quality: filter_probes のとき、品質値がこれより大きいフレームを除く (None: NaN のみ除く)
+    quiet: 静音モード: 進捗・計算結果の表示を行わず、警告以上のみ表示する
+    resume: 停止して取得する場合に、前回中断した収集が残っていれば完了済みの点を飛ばして続きから収集する
     """
+    configure_logging(quiet=quiet)
+    # 訪れる順番の推定移動時間 (停止して取得する場合の速度 50 mm/s, 90 度/s で見積もる)
+    speed = continuous_speed if collection_mode == "continuous" else 50.0
+    angular_speed = continuous_angular_speed if collection_mode == "continuous" else 90.0
+    print_plan_report(orientation_poses(fixed_pos, roll_range, pitch_range, yaw_ranges, N),
+                      orientation_poses(fixed_pos, roll_range, pitch_range, yaw_ranges, N,
+                                        optimize_order=optimize_order, speed=speed, angular_speed=angular_speed),
+                      speed=speed, angular_speed=angular_speed)
+    if dry_run:
+        return
+
     try:
+        # 収集中の逐次推定に使う T_aurora_from_robot
+        T_aurora_from_robot = None
+        if world_calib_csv is not None:
+            T_aurora_from_robot = WorldCalibration(world_calib_csv).run()
+
         arm = initialize_robot()
-        aurora = initialize_aurora()
+        aurora = initialize_aurora(background=background_reader)
         
         # --- 変更点: 設定情報の表示を更新 ---
         print(f"設定情報:")
@@ -153,13 +314,35 @@ def main(fixed_pos, roll_range, pitch_range, yaw_ranges, N, output_file):
         num_yaw_points = (N + 1) * len(yaw_ranges)
         total_points = (N + 1) * (N + 1) * num_yaw_points
         print(f"  合計測定ポイント: {total_points}")
+        print(f"  収集方法: {collection_mode}")
 
-        # --- 変更点: 新しいデータ収集関数を呼び出し ---
-        robot_data, aurora_data = collect_data_by_orientation(
-            arm, aurora, fixed_pos, roll_range, pitch_range, yaw_ranges, N
-        )
+        if collection_mode == "continuous":
+            print(f"  移動速度: {continuous_speed} mm/s, 回転速度: {continuous_angular_speed} 度/s")
+            robot_data, aurora_data = collect_data_by_orientation_continuous(
+                arm, aurora, fixed_pos, roll_range, pitch_range, yaw_ranges, N, speed=continuous_speed,
+                angular_speed=continuous_angular_speed, optimize_order=optimize_order,
+                probe_filter=make_probe_filter(max_quality, smoothing=False) if filter_probes else None
+            )
+            if output_file.endswith(POSE_LOG_EXTENSION):
+                save_to_pose_log(robot_data, aurora_data, output_file)
+            else:
+                save_to_csv_extended(robot_data, aurora_data, output_file)
+        elif collection_mode == "stop_and_go":
+            print(f"  待機方法: {settling_mode}")
+            print(f"  1点あたりのフレーム数: {frames_per_point}")
 
-        save_to_csv_extended(robot_data, aurora_data, output_file)
+            # --- 変更点: 新しいデータ収集関数を呼び出し ---
+            # 各点のデータを取得後すぐに出力ファイルへ追記し、進捗を記録する (中断しても続きから再開できる)
+            poses = orientation_poses(fixed_pos, roll_range, pitch_range, yaw_ranges, N, optimize_order=optimize_order)
+            with SweepCheckpoint(output_file, CALIBRATION_LOG_COLUMNS, poses, resume=resume) as checkpoint:
+                collect_data_by_orientation(
+                    arm, aurora, fixed_pos, roll_range, pitch_range, yaw_ranges, N,
+                    T_aurora_from_robot=T_aurora_from_robot, stop_on_convergence=stop_on_convergence,
+                    settling=make_settling_policy(settling_mode), frames_per_point=frames_per_point,
+                    optimize_order=optimize_order, checkpoint=checkpoint
+                )
+        else:
+            raise ValueError(f"不明な収集方法です: {collection_mode} (選択肢: {', '.join(COLLECTION_MODES)})")
         
         print("処理が正常に完了しました")
         
@@ -185,6 +368,19 @@ if __name__ == "__main__":
         yaw_ranges=[(-180, -150), (150, 180)], 
         
         N=2,                                      # 各範囲のサンプル数（各範囲でN+1ポイント取得）
+
+        settling_mode="real",                     # 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+        frames_per_point=5,                       # 1点あたりに取得して平均するAuroraのフレーム数
+        background_reader=True,                   # バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+        collection_mode="stop_and_go",            # 収集方法 ("stop_and_go", "continuous")
+        continuous_speed=10.0,                    # 連続収集モードの移動速度 [mm/s]
+        continuous_angular_speed=20.0,            # 連続収集モードの回転速度 [度/s] (速いほど組は増えるが同期ずれが大きい)
+        optimize_order=True,                      # 推定移動時間が短くなるように姿勢を訪れる順番を並べ替える
+        dry_run=False,                            # True: ロボットに接続せず推定移動時間だけを表示する
+        filter_probes=False,                      # True: 連続収集モードで外れ値のフレームを除く
+        max_quality=None,                         # filter_probes のとき、品質値がこれより大きいフレームを除く
+        quiet=False,                              # True: 進捗・暫定推定の表示を行わず、警告以上のみ表示する
+        resume=True,                              # True: 前回中断した収集が残っていれば続きから収集する
         
         output_file="robot&aurora/current_code/new_transform/data/aurora_robot_orientation_log_20260205.csv"
     )
\ No newline at end of file
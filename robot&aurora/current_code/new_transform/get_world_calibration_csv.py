@@ -1,21 +1,64 @@
-import time
 import numpy as np
 import csv
-from utils.pose_formatter import generateRobotArmAxisAngle, generateProbe
+from utils.pose_formatter import generateRobotArmAxisAngle
+from utils.acquisition import make_robot_aurora_sampler
+from utils.continuous_collection import collect_continuous, rows_to_collected_data
 from utils.initialization import initialize_robot, initialize_aurora
+from utils.settling import FixedSettling, make_settling_policy
+from utils.motion_planner import serpentine_order, print_plan_report
+from utils.probe_filter import make_probe_filter
+from calibration.pose_log import POSE_LOG_EXTENSION, save_to_pose_log
+from calibration.row_log import CALIBRATION_LOG_COLUMNS, calibration_row
+from calibration.sweep_checkpoint import SweepCheckpoint
+from calibration.world_calibration import WorldCalibrationAccumulator
+from calibration.convergence import ConvergenceMonitor, PointSpread
+from calibration.logger import get_logger, configure_logging
 
+log = get_logger(__name__)
 
-def collect_data(arm, aurora, x_range, y_range, z_range, N):
-    """指定された範囲でデータを収集"""
+COLLECTION_MODES = ("stop_and_go", "continuous")
+
+
+def grid_poses(x_range, y_range, z_range, N, serpentine=False):
+    """
+    格子点 [x, y, z] のリスト ((N+1)**3 点)
+    serpentine: True の場合は蛇行順 (戻りの長い移動がない順) に並べる
+    """
     x_start, x_end = x_range
     y_start, y_end = y_range
     z_start, z_end = z_range
-    
-    x_step = (x_end - x_start) / N
-    y_step = (y_end - y_start) / N
-    z_step = (z_end - z_start) / N
-    
-    total_points = (N+1)**3
+    poses = []
+    for i in range(N + 1):
+        for j in range(N + 1):
+            for k in range(N + 1):
+                poses.append([x_start + (x_end - x_start) / N * i,
+                              y_start + (y_end - y_start) / N * j,
+                              z_start + (z_end - z_start) / N * k])
+    if serpentine:
+        poses = [poses[index] for index in serpentine_order((N + 1, N + 1, N + 1))]
+    return poses
+
+
+def collect_data(arm, aurora, x_range, y_range, z_range, N, stop_on_convergence=False, convergence=None,
+                 settling=None, frames_per_point=1, optimize_order=False, writer=None, checkpoint=None):
+    """
+    指定された範囲でデータを収集
+    各点の取得後に T_aurora_from_robot を逐次推定して表示し、
+    stop_on_convergence=True の場合は推定値が収束した時点で収集を終了する
+    convergence: 収束判定に使う ConvergenceMonitor（省略時はデフォルト設定、ロボット位置の広がりが10mm以上になるまで収束としない）
+    settling: 移動後・取得後の待機方法（省略時は FixedSettling: 移動後2秒、取得後1秒）
+    frames_per_point: 1点あたりに取得して平均するAuroraのフレーム数
+    optimize_order: 格子点を蛇行順に訪れる (移動時間が短くなる)
+    writer: RowLogWriter を与えた場合は各点のデータを取得後すぐにファイルへ追記し、戻り値の辞書には保存しない
+            (中断してもそれまでのデータが残り、メモリ使用量は点数によらず一定)
+    checkpoint: SweepCheckpoint を与えた場合はその計画の格子点を訪れ、完了済みの点を飛ばして続きから収集する
+                (writer の代わりに checkpoint.writer に追記する)
+    """
+    poses = grid_poses(x_range, y_range, z_range, N, serpentine=optimize_order)
+    if checkpoint is not None:
+        poses = checkpoint.poses
+        writer = checkpoint.writer
+    total_points = len(poses)
     
     # データ格納用ディクショナリ
     robot_data = {
@@ -26,59 +69,116 @@ def collect_data(arm, aurora, x_range, y_range, z_range, N):
     aurora_data = {
         'x': [], 'y': [], 'z': [], 
         'quat_x': [], 'quat_y': [], 'quat_z': [], 'quat_w': [],
-        'quality': []
+        'quality': [],
+        'pos_spread': [], 'rot_spread': []
     }
     
-    print(f"データ収集開始: 合計 {total_points} ポイント")
+    # 逐次キャリブレーション
+    accumulator = WorldCalibrationAccumulator()
+    # ロボット位置の広がり (直線上・平面上の点だけで収束と判定しないため)
+    spread = PointSpread()
+    if convergence is None:
+        convergence = ConvergenceMonitor(min_spread=10.0)
+    if settling is None:
+        settling = FixedSettling()
+
+    # 再開した場合は前回までのデータで逐次推定をやり直す
+    if checkpoint is not None and checkpoint.completed:
+        for row in checkpoint.completed_rows():
+            accumulator.add(row[6:9], row[0:3])
+            spread.add(row[0:3])
+        convergence.update(accumulator.transform(), spread.spread)
     
-    # 各位置での計測
-    for point in range(total_points):
-        # インデックスから3次元座標を計算
-        i = point // ((N+1)**2)
-        j = (point // (N+1)) % (N+1)
-        k = point % (N+1)
-        
-        # 現在のポイント位置を計算
-        current_x = x_start + x_step * i
-        current_y = y_start + y_step * j
-        current_z = z_start + z_step * k
-        
-        # 進捗表示
-        if point % 10 == 0:
-            progress = (point / total_points) * 100
-            print(f"進捗: {progress:.1f}% ({point}/{total_points})")
+    log.info("データ収集開始: 合計 %d ポイント", total_points)
+    
+    # ロボットとAuroraを同時に読み取る (例外・Ctrl+C で中断した場合もワーカースレッドを止める)
+    sampler = make_robot_aurora_sampler(arm, aurora, frames_per_point)
+    try:
+        # 各位置での計測
+        for point, (current_x, current_y, current_z) in enumerate(poses):
+            if checkpoint is not None and checkpoint.is_done(point):
+                continue
+
+            # 進捗表示
+            if point % 10 == 0:
+                progress = (point / total_points) * 100
+                log.info("進捗: %.1f%% (%d/%d)", progress, point, total_points)
         
-        # ロボットアームを移動
-        arm.set_position(x=current_x, y=current_y, z=current_z, speed=50, wait=True)
-        time.sleep(2)
+            # ロボットアームを移動
+            arm.set_position(x=current_x, y=current_y, z=current_z, speed=50, wait=True)
+            settling.wait_after_move(aurora)
         
-        # データ取得
-        robot = generateRobotArmAxisAngle(arm.get_position_aa())
-        probes = generateProbe(aurora.get_frame())
+            # データ取得 (ロボットとAuroraを同時に読み取る)
+            sample = sampler.sample()
+            robot = generateRobotArmAxisAngle(sample["robot"])
+            probes = sample["aurora"]
         
-        # ロボットデータを保存
-        robot_data['x'].append(robot.pos.x)
-        robot_data['y'].append(robot.pos.y)
-        robot_data['z'].append(robot.pos.z)
-        robot_data['rx'].append(robot.rot.rx)
-        robot_data['ry'].append(robot.rot.ry)
-        robot_data['rz'].append(robot.rot.rz)
-
-        # オーロラデータを保存
-        aurora_data['x'].append(probes[0].pos.x)
-        aurora_data['y'].append(probes[0].pos.y)
-        aurora_data['z'].append(probes[0].pos.z)
-        aurora_data['quat_x'].append(probes[0].quat.x)
-        aurora_data['quat_y'].append(probes[0].quat.y)
-        aurora_data['quat_z'].append(probes[0].quat.z)
-        aurora_data['quat_w'].append(probes[0].quat.w)
-        aurora_data['quality'].append(probes[0].quality)
-
-        time.sleep(1)
-    
-    print("データ収集完了")
+            if writer is not None:
+                # ファイルに追記し、メモリには残さない
+                writer.write_row(calibration_row(robot, probes[0]))
+                if checkpoint is not None:
+                    checkpoint.mark_done(point)
+            else:
+                # ロボットデータを保存
+                robot_data['x'].append(robot.pos.x)
+                robot_data['y'].append(robot.pos.y)
+                robot_data['z'].append(robot.pos.z)
+                robot_data['rx'].append(robot.rot.rx)
+                robot_data['ry'].append(robot.rot.ry)
+                robot_data['rz'].append(robot.rot.rz)
+
+                # オーロラデータを保存
+                aurora_data['x'].append(probes[0].pos.x)
+                aurora_data['y'].append(probes[0].pos.y)
+                aurora_data['z'].append(probes[0].pos.z)
+                aurora_data['quat_x'].append(probes[0].quat.x)
+                aurora_data['quat_y'].append(probes[0].quat.y)
+                aurora_data['quat_z'].append(probes[0].quat.z)
+                aurora_data['quat_w'].append(probes[0].quat.w)
+                aurora_data['quality'].append(probes[0].quality)
+                aurora_data['pos_spread'].append(probes[0].pos_spread)
+                aurora_data['rot_spread'].append(probes[0].rot_spread)
+
+            # 暫定のキャリブレーション結果を更新
+            accumulator.add(
+                [probes[0].pos.x, probes[0].pos.y, probes[0].pos.z],
+                [robot.pos.x, robot.pos.y, robot.pos.z]
+            )
+            spread.add([robot.pos.x, robot.pos.y, robot.pos.z])
+            T_aurora_from_robot = accumulator.transform()
+            convergence.update(T_aurora_from_robot, spread.spread)
+            if T_aurora_from_robot is not None and point % 10 == 0:
+                t = T_aurora_from_robot[:3, 3]
+                log.info("  暫定推定 t: x: %.2f, y: %.2f, z: %.2f (変化量: %.3f mm, %.3f 度)",
+                      t[0], t[1], t[2], convergence.delta_t, convergence.delta_angle_deg)
+
+            if stop_on_convergence and convergence.converged:
+                log.info("推定値が収束したため収集を終了します (%d/%d ポイント)", point + 1, total_points)
+                break
+
+            settling.wait_after_sample()
+    finally:
+        sampler.close()
+
+    if checkpoint is not None:
+        checkpoint.finish()
+    log.info("データ収集完了")
+    settling.print_summary()
     return robot_data, aurora_data
 
+def collect_data_continuous(arm, aurora, x_range, y_range, z_range, N, speed=10.0, optimize_order=False,
+                            **kwargs):
+    """
+    格子点を止まらずに順に通過しながらデータを収集する (連続収集モード)
+    speed: 移動速度 [mm/s]
+    optimize_order: 格子点を蛇行順に訪れる
+    kwargs: collect_continuous に渡す引数 (blend_radius, tracker_latency, max_sync_error など)
+    戻り値: collect_data と同じ形式の (robot_data, aurora_data)
+    """
+    poses = grid_poses(x_range, y_range, z_range, N, serpentine=optimize_order)
+    rows, _ = collect_continuous(arm, aurora, poses, speed=speed, **kwargs)
+    return rows_to_collected_data(rows)
+
 def save_to_csv_extended(robot_data, aurora_data, filename, decimal_places=3):
     """拡張データをCSVファイルに保存"""
     # 出力用の2次元リスト作成
@@ -109,7 +209,11 @@ def save_to_csv_extended(robot_data, aurora_data, filename, decimal_places=3):
             np.round(aurora_data['quat_w'][i], decimal_places),
             
             # オーロラの品質データ
-            np.round(aurora_data['quality'][i], decimal_places)
+            np.round(aurora_data['quality'][i], decimal_places),
+
+            # オーロラの複数フレームのばらつき (位置 [mm], 姿勢 [度])
+            np.round(aurora_data['pos_spread'][i], decimal_places),
+            np.round(aurora_data['rot_spread'][i], decimal_places)
         ]
         data.append(row)
     
@@ -122,13 +226,13 @@ def save_to_csv_extended(robot_data, aurora_data, filename, decimal_places=3):
             "robot_rx", "robot_ry", "robot_rz",
             "aurora_x", "aurora_y", "aurora_z",
             "aurora_quat_x", "aurora_quat_y", "aurora_quat_z", "aurora_quat_w",
-            "aurora_quality"
+            "aurora_quality", "aurora_pos_spread", "aurora_rot_spread"
         ]
         writer.writerow(header)
         # データ行を書き込み
         writer.writerows(data)
     
-    print(f"拡張データを {filename} に保存しました。合計 {total_points} 行。")
+    log.info("拡張データを %s に保存しました。合計 %d 行。", filename, total_points)
 
 def cleanup(arm, aurora):
     """デバイスをクリーンアップして接続を終了"""
@@ -136,7 +240,9 @@ def cleanup(arm, aurora):
     arm.disconnect()
     print("デバイスの接続を終了しました")
 
-def main(x_range, y_range, z_range, N, output_file):
+def main(x_range, y_range, z_range, N, output_file, stop_on_convergence=False, settling_mode="real",
+         frames_per_point=1, background_reader=False, collection_mode="stop_and_go", continuous_speed=10.0,
+         optimize_order=False, dry_run=False, filter_probes=False, max_quality=None, quiet=False, resume=True):
     """
     メイン関数：データ収集からCSV保存までの全体の流れを制御
     
@@ -146,12 +252,32 @@ def main(x_range, y_range, z_range, N, output_file):
         z_range (tuple): Z座標の範囲 (開始値, 終了値)
         N (int): 各次元のサンプル数（N+1ポイント取得）
         output_file (str): 出力ファイルのパス
+        stop_on_convergence (bool): キャリブレーション推定値が収束したら収集を途中で終了する
+        settling_mode (str): 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+        frames_per_point (int): 1点あたりに取得して平均するAuroraのフレーム数
+        background_reader (bool): バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+        collection_mode (str): "stop_and_go" (各点で停止して取得), "continuous" (止まらずに移動しながら取得)
+        continuous_speed (float): 連続収集モードの移動速度 [mm/s]
+        optimize_order (bool): 格子点を蛇行順に訪れて移動時間を短くする
+        dry_run (bool): ロボットに接続せず、訪れる順番の推定移動時間だけを表示して終了する
+        filter_probes (bool): 連続収集モードで、測定範囲外・品質値の悪いフレームと外れ値を除く (平滑化はしない)
+        max_quality (float): filter_probes のとき、品質値がこれより大きいフレームを除く (None: NaN のみ除く)
+        quiet (bool): 静音モード: 進捗・計算結果の表示を行わず、警告以上のみ表示する
+        resume (bool): 停止して取得する場合に、前回中断した収集が残っていれば完了済みの点を飛ばして続きから収集する
     """
+    configure_logging(quiet=quiet)
+    # 訪れる順番の推定移動時間 (停止して取得する場合の速度 50 mm/s で見積もる)
+    speed = continuous_speed if collection_mode == "continuous" else 50.0
+    print_plan_report(grid_poses(x_range, y_range, z_range, N),
+                      grid_poses(x_range, y_range, z_range, N, serpentine=optimize_order), speed=speed)
+    if dry_run:
+        return
+
     try:
         # 初期化
         arm = initialize_robot()
         
-        aurora = initialize_aurora()
+        aurora = initialize_aurora(background=background_reader)
         
         # データ収集
         print(f"設定情報:")
@@ -160,11 +286,33 @@ def main(x_range, y_range, z_range, N, output_file):
         print(f"  Z範囲: {z_range}")
         print(f"  サンプル数: {N} (各辺 {N+1} ポイント)")
         print(f"  合計測定ポイント: {(N+1)**3}")
+        print(f"  収集方法: {collection_mode}")
 
-        robot_data, aurora_data = collect_data(arm, aurora, x_range, y_range, z_range, N)
-
-        # CSV保存
-        save_to_csv_extended(robot_data, aurora_data, output_file)
+        if collection_mode == "continuous":
+            print(f"  移動速度: {continuous_speed} mm/s")
+            probe_filter = make_probe_filter(max_quality, smoothing=False) if filter_probes else None
+            robot_data, aurora_data = collect_data_continuous(arm, aurora, x_range, y_range, z_range, N,
+                                                              speed=continuous_speed,
+                                                              optimize_order=optimize_order,
+                                                              probe_filter=probe_filter)
+            # CSV保存
+            if output_file.endswith(POSE_LOG_EXTENSION):
+                save_to_pose_log(robot_data, aurora_data, output_file)
+            else:
+                save_to_csv_extended(robot_data, aurora_data, output_file)
+        elif collection_mode == "stop_and_go":
+            print(f"  待機方法: {settling_mode}")
+            print(f"  1点あたりのフレーム数: {frames_per_point}")
+            # 各点のデータを取得後すぐに出力ファイルへ追記し、進捗を記録する (中断しても続きから再開できる)
+            poses = grid_poses(x_range, y_range, z_range, N, serpentine=optimize_order)
+            with SweepCheckpoint(output_file, CALIBRATION_LOG_COLUMNS, poses, resume=resume) as checkpoint:
+                collect_data(arm, aurora, x_range, y_range, z_range, N,
+                             stop_on_convergence=stop_on_convergence,
+                             settling=make_settling_policy(settling_mode),
+                             frames_per_point=frames_per_point,
+                             optimize_order=optimize_order, checkpoint=checkpoint)
+        else:
+            raise ValueError(f"不明な収集方法です: {collection_mode} (選択肢: {', '.join(COLLECTION_MODES)})")
         
         # 正常終了
         print("処理が正常に完了しました")
@@ -185,5 +333,16 @@ if __name__ == "__main__":
         y_range=(-75, 75),                     # Y座標の範囲 (開始値, 終了値)
         z_range=(-175, -325),                     # Z座標の範囲 (開始値, 終了値)
         N=4,                                   # サンプル数（各辺N+1ポイント）
+        settling_mode="real",                  # 移動後の待機方法 ("real", "virtual", "adaptive", "stability")
+        frames_per_point=5,                    # 1点あたりに取得して平均するAuroraのフレーム数
+        background_reader=True,                # バックグラウンドのスレッドでAuroraを読み続け、最新のフレームを使う
+        collection_mode="stop_and_go",         # 収集方法 ("stop_and_go", "continuous")
+        continuous_speed=10.0,                 # 連続収集モードの移動速度 [mm/s]
+        optimize_order=True,                   # 格子点を蛇行順に訪れて移動時間を短くする
+        dry_run=False,                         # True: ロボットに接続せず推定移動時間だけを表示する
+        filter_probes=False,                   # True: 連続収集モードで外れ値のフレームを除く
+        max_quality=None,                      # filter_probes のとき、品質値がこれより大きいフレームを除く
+        quiet=False,                           # True: 進捗・暫定推定の表示を行わず、警告以上のみ表示する
+        resume=True,                           # True: 前回中断した収集が残っていれば続きから収集する
         output_file="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20260205.csv",
     )
\ No newline at end of file
@@ -1,46 +1,45 @@
-from calibration.world_calibration import WorldCalibration
-from calibration.handeye_calibration import HandEyeCalibration
-from calibration.transformation_utils import compute_T_arm_from_robot
+import logging
+from calibration.calibration_store import load_or_run_calibration
+from calibration.logger import get_logger, configure_logging
+from calibration.pose_transformer import PoseTransformer
 from scipy.spatial.transform import Rotation as R
 
-def main(goal_aurora_point, goal_aurora_quaternion, world_calib_csv, hand_eye_calib_csv):
-
-    # ワールドキャリブレーションを実行して T_aurora_from_robot を取得
-    world_calib = WorldCalibration(world_calib_csv)
-    T_aurora_from_robot = world_calib.run()
-    print("T_aurora_from_robot:")
-    print(T_aurora_from_robot)
-    euler_aurora_from_robot = R.from_matrix(T_aurora_from_robot[:3, :3]).as_euler('zyx', degrees=True)
-    t_aurora_from_robot = T_aurora_from_robot[:3, 3]
-    print(f"Euler angles (degrees): Roll: {euler_aurora_from_robot[2]:.2f}, Pitch: {euler_aurora_from_robot[1]:.2f}, Yaw: {euler_aurora_from_robot[0]:.2f}")
-    print(f"Translation vector: x: {t_aurora_from_robot[0]:.2f}, y: {t_aurora_from_robot[1]:.2f}, z: {t_aurora_from_robot[2]:.2f}")
-
-    # ハンドアイキャリブレーションを実行して T_arm_from_sensor を取得
-    hand_eye_calib = HandEyeCalibration(hand_eye_calib_csv, T_aurora_from_robot)
-    T_arm_from_sensor = hand_eye_calib.run()
-    print("T_arm_from_sensor:")
-    print(T_arm_from_sensor)
-    euler_arm_from_sensor = R.from_matrix(T_arm_from_sensor[:3, :3]).as_euler('zyx', degrees=True)
-    t_arm_from_sensor = T_arm_from_sensor[:3, 3]
-    print(f"Euler angles (degrees): Roll: {euler_arm_from_sensor[2]:.2f}, Pitch: {euler_arm_from_sensor[1]:.2f}, Yaw: {euler_arm_from_sensor[0]:.2f}")
-    print(f"Translation vector: x: {t_arm_from_sensor[0]:.2f}, y: {t_arm_from_sensor[1]:.2f}, z: {t_arm_from_sensor[2]:.2f}")
-
-    T_arm_from_robot = compute_T_arm_from_robot(
-        t_sensor_from_aurora=goal_aurora_point,
-        quaternion_sensor_from_aurora=goal_aurora_quaternion,
-        T_aurora_from_robot=T_aurora_from_robot,
-        T_arm_from_sensor=T_arm_from_sensor
-    )
+log = get_logger(__name__)
+
+
+def log_transform(name, T, rotvec=False):
+    """4x4同次変換行列をオイラー角・並進ベクトルとともに表示する (静音モードでは何も計算しない)"""
+    if not log.isEnabledFor(logging.INFO):
+        return
+    log.info(f"{name}:\n{T}")
+    euler = R.from_matrix(T[:3, :3]).as_euler('zyx', degrees=True)
+    log.info(f"Euler angles (degrees): Roll: {euler[2]:.2f}, Pitch: {euler[1]:.2f}, Yaw: {euler[0]:.2f}")
+    if rotvec:
+        v = R.from_matrix(T[:3, :3]).as_rotvec(degrees=True)
+        log.info(f"Rotation vector (degrees): RX: {v[0]:.2f}, RY: {v[1]:.2f}, RZ: {v[2]:.2f}")
+    t = T[:3, 3]
+    log.info(f"Translation vector: x: {t[0]:.2f}, y: {t[1]:.2f}, z: {t[2]:.2f}")
+
+
+def main(goal_aurora_point, goal_aurora_quaternion, world_calib_csv, hand_eye_calib_csv, use_cache=True):
 
+    # キャリブレーション結果を取得（csvが変わっていなければキャッシュから読み込み、SVD等の再計算を省略）
+    calibration = load_or_run_calibration(world_calib_csv, hand_eye_calib_csv, use_cache=use_cache)
+    if calibration is None:
+        raise RuntimeError("キャリブレーションに失敗しました。")
 
-    print("Computed T_arm_from_robot:")
-    print(T_arm_from_robot)
-    euler_arm_from_robot = R.from_matrix(T_arm_from_robot[:3, :3]).as_euler('zyx', degrees=True)
-    t_arm_from_robot = T_arm_from_robot[:3, 3]
-    print(f"Euler angles (degrees): Roll: {euler_arm_from_robot[2]:.2f}, Pitch: {euler_arm_from_robot[1]:.2f}, Yaw: {euler_arm_from_robot[0]:.2f}")
-    rotvec_arm_from_robot = R.from_matrix(T_arm_from_robot[:3, :3]).as_rotvec(degrees=True)
-    print(f"Rotation vector (degrees): RX: {rotvec_arm_from_robot[0]:.2f}, RY: {rotvec_arm_from_robot[1]:.2f}, RZ: {rotvec_arm_from_robot[2]:.2f}")
-    print(f"Translation vector: x: {t_arm_from_robot[0]:.2f}, y: {t_arm_from_robot[1]:.2f}, z: {t_arm_from_robot[2]:.2f}")
+    # ワールドキャリブレーションの結果 T_aurora_from_robot
+    T_aurora_from_robot = calibration.T_aurora_from_robot
+    log_transform("T_aurora_from_robot", T_aurora_from_robot)
+
+    # ハンドアイキャリブレーションの結果 T_arm_from_sensor
+    T_arm_from_sensor = calibration.T_arm_from_sensor
+    log_transform("T_arm_from_sensor", T_arm_from_sensor)
+
+    transformer = PoseTransformer(T_aurora_from_robot, T_arm_from_sensor)
+    T_arm_from_robot = transformer.transform(goal_aurora_point, goal_aurora_quaternion)
+
+    log_transform("Computed T_arm_from_robot", T_arm_from_robot, rotvec=True)
 
     return T_arm_from_robot
 
@@ -50,6 +49,8 @@ if __name__ == "__main__":
     csv_row = [-120.13629,20.44596,-178.25329,-0.27743,-0.52842,-0.03808,0.80147]
     csv_file_name = "AUFRO_R10--40-60_T20-10--150_ARFSE-R-40-170-90_T0-0-0_n0_qn0"
 
+    configure_logging(quiet=False)  # True: 警告以上のみ表示し、表示用の計算を行わない
+
     result = main(
         goal_aurora_point=[csv_row[0], csv_row[1], csv_row[2]],                   # 変換前のsensor_from_aurora [x, y, z]
         goal_aurora_quaternion=[csv_row[3], csv_row[4], csv_row[5], csv_row[6]],               # 変換前のsensor_from_aurora [x, y, z, w]
@@ -9,12 +9,18 @@ try:
     # Auroraトラッカーのライブラリをインポート
     from utils.pose_formatter import generateRobotArm, generateRobotArmAxisAngle, generateProbe
     from utils.initialization import initialize_robot, initialize_aurora
+    from utils.acquisition import ConcurrentSampler
+    from utils.probe_filter import PortFilters, make_probe_filter
 except ImportError as e:
     print(f"エラー: 必要なライブラリがインポートできません。{e}")
     print("utils.probe モジュールと sksurgerynditracker がインストールされていることを確認してください。")
     sys.exit(1)
 
-def main():
+def main(filter_probes=False, max_quality=None):
+    """
+    filter_probes: 測定範囲外・品質値の悪いフレームと外れ値を除いて表示する (1秒ごとの表示のため平滑化はしない)
+    max_quality: filter_probes のとき、品質値がこれより大きいフレームを除く (None: NaN のみ除く)
+    """
     # ポート設定
     port = "COM3"  # 環境に合わせて変更してください
     
@@ -27,14 +33,24 @@ def main():
     try:
         # ロボットアームを初期化
         arm = initialize_robot()
-        # オーロラトラッカーを初期化
-        aurora = initialize_aurora(port=port)
+        # オーロラトラッカーを初期化（バックグラウンドで読み続け、常に最新のフレームを使う）
+        aurora = initialize_aurora(port=port, background=True)
 
         print("トラッキング開始しました")
         print("-" * 50)
         
         arm.set_position(x=145, y=0, z=-210, roll=0, pitch=0, yaw=180)
 
+        # Auroraとロボットアームを同時に読み取る
+        sampler = ConcurrentSampler({
+            "aurora": aurora.get_frame,
+            "robot": arm.get_position,
+            "robot_aa": arm.get_position_aa,
+        })
+
+        # プローブごとのフィルタ (状態は固定長で、履歴は持たない)
+        probe_filters = PortFilters(make_probe_filter, max_quality=max_quality, smoothing=False) if filter_probes else None
+
         # メインループ
         try:
             while True:
@@ -42,8 +58,9 @@ def main():
                 now = datetime.now()
                 timestamp = now.strftime("%H:%M:%S.%f")[:-3]
 
-                # Auroraのプローブからデータ取得
-                probes = generateProbe(aurora.get_frame())
+                # Auroraのプローブとロボットアームからデータ取得
+                sample = sampler.sample()
+                probes = generateProbe(sample["aurora"])
                 
                 if not probes:
                     print("プローブが検出されません。センサーの接続を確認してください。")
@@ -52,6 +69,13 @@ def main():
                 
                 # 最初のプローブデータを使用
                 probe = probes[0]
+                if probe_filters is not None:
+                    probe = probe_filters.filter(probes, sample.timestamps["aurora"])[0]
+                    if probe is None:
+                        print(f"[{timestamp}] フレームを除外しました (測定範囲外・品質値・外れ値)")
+                        print("-" * 50)
+                        time.sleep(1)
+                        continue
     
                 pos_x, pos_y, pos_z = probe.pos.x, probe.pos.y, probe.pos.z
                 quat_w, quat_x, quat_y, quat_z = probe.quat.w, probe.quat.x, probe.quat.y, probe.quat.z
@@ -70,12 +94,12 @@ def main():
                     euler_str = "Roll=nan, Pitch=nan, Yaw=nan"
 
                 # ロボットアームの位置と姿勢を取得（オイラー角）
-                robot = generateRobotArm(arm.get_position())
+                robot = generateRobotArm(sample["robot"])
                 robot_pos_x, robot_pos_y, robot_pos_z = robot.pos.x, robot.pos.y, robot.pos.z
                 robot_roll, robot_pitch, robot_yaw = robot.rot.roll, robot.rot.pitch, robot.rot.yaw
 
                 # ロボットアームの位置と姿勢を取得（AxisAngle）
-                robot_axis_angle = generateRobotArmAxisAngle(arm.get_position_aa())
+                robot_axis_angle = generateRobotArmAxisAngle(sample["robot_aa"])
                 robot_rx, robot_ry, robot_rz = robot_axis_angle.rot.rx, robot_axis_angle.rot.ry, robot_axis_angle.rot.rz
 
                 try:
@@ -98,6 +122,7 @@ def main():
                 print(f"ロボットアーム位置: X={robot_pos_x:.2f}, Y={robot_pos_y:.2f}, Z={robot_pos_z:.2f}")
                 print(f"ロボットアーム姿勢 (オイラー角): Roll={robot_roll:.2f}°, Pitch={robot_pitch:.2f}°, Yaw={robot_yaw:.2f}°")
                 print(f"ロボットアーム姿勢 (AxisAngle): RX={robot_rx:.2f}, RY={robot_ry:.2f}, RZ={robot_rz:.2f}")
+                print(f"取得時刻の差 (Aurora - ロボット): {sample.time_skew('aurora', 'robot') * 1000:.1f} ms")
                 print("-" * 50)
                 
                 # 1秒待機
@@ -107,6 +132,7 @@ def main():
             print("\nプログラムを終了します...")
         finally:
             # トラッキング停止
+            sampler.close()
             aurora.stop_tracking()
             print("トラッキングを停止しました")
     
@@ -116,4 +142,7 @@ def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(
+        filter_probes=False,     # True: 測定範囲外・品質値の悪いフレームと外れ値を除いて表示する
+        max_quality=None,        # filter_probes のとき、品質値がこれより大きいフレームを除く (None: NaN のみ除く)
+    )
\ No newline at end of file
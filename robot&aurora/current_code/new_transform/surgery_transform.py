@@ -3,20 +3,36 @@ import numpy as np
 import time
 from scipy.spatial.transform import Rotation as R
 from calibration.transformation_utils import Transform, compute_transform_difference
-from main import main as run_pose_transoformation
+from calibration.pose_transformer import PoseTransformer
+from calibration.logger import get_logger, configure_logging, flush_logging
+
+# キャリブレーション用CSVファイルのパス
+WORLD_CALIB_CSV = "robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20260205.csv"
+HAND_EYE_CALIB_CSV = "robot&aurora/current_code/new_transform/data/aurora_robot_orientation_log_20260205.csv"
+
+# 連続追従モードの指令方法
+# "servo": サーボモード (mode 1) で set_servo_cartesian_aa を毎周期送る
+# "follow": オンライン軌道計画モード (mode 7) で set_position_aa(wait=False) を送る (前の指令を置き換える)
+COMMAND_MODES = ("servo", "follow")
 
 try:
     # Auroraトラッカーのライブラリをインポート
     from utils.pose_formatter import generateRobotArm, generateRobotArmAxisAngle, generateProbe
-    from utils.initialization import initialize_robot, initialize_aurora
+    from utils.initialization import initialize_robot, initialize_aurora, get_clock
+    from utils.latency import get_profiler, enable_profiling
+    from utils.pose_predictor import ConstantVelocityPosePredictor, feed_frames
+    from utils.motion_planner import estimate_motion_time
+    from utils.probe_filter import make_probe_filter
 except ImportError as e:
     print(f"エラー: 必要なライブラリがインポートできません。{e}")
     print("utils.probe モジュールと sksurgerynditracker がインストールされていることを確認してください。")
     sys.exit(1)
 
+log = get_logger(__name__)
+
 def record_relative_transform(aurora):
     """2つのプローブ間の相対的な剛体変換行列を記録する関数"""
-    print("相対的な変換行列を記録中...")
+    log.info("相対的な変換行列を記録中...")
     
     # upper_probeとlower_probeのAurora座標を取得
     probes = generateProbe(aurora.get_frame())
@@ -38,19 +54,15 @@ def record_relative_transform(aurora):
     # T_lower_from_aurora = T_upper_from_aurora @ T_lower_from_upper  =>  T_lower_from_upper = inv(T_upper_from_aurora) @ T_lower_from_aurora
     T_lower_from_upper_transform = T_upper_from_aurora_transform.inv() @ T_lower_from_aurora_transform
 
-    print("相対的な変換行列の記録が完了しました。")
+    log.info("相対的な変換行列の記録が完了しました。")
     return T_lower_from_upper_transform.matrix
 
-def move_robot_to_goal(arm, aurora, T_lower_from_upper):
+def compute_goal(upper_probe, T_lower_from_upper, transformer):
     """
-    ロボットをゴール位置（Lowerセンサーの相対位置 + Z軸3mmオフセット）に移動する関数
+    upper_probe（頭蓋骨）の現在の姿勢から、Lowerセンサーのゴール姿勢とロボットへの指令値を計算する関数
+    transformer: キャリブレーション済みの PoseTransformer
+    戻り値: (Auroraから見たLowerセンサーのゴール姿勢 Transform, ロボットへの指令値 [x, y, z, rx, ry, rz])
     """
-    print("ゴール位置を計算中...")
-    
-    # 1. 現在のupper_probe（頭蓋骨）のAurora座標を取得
-    probes = generateProbe(aurora.get_frame())
-    upper_probe = probes[1]
-
     # 現在のupper_probeの位置と姿勢から、変換行列を作成
     t_upper_from_aurora = np.array([upper_probe.pos.x, upper_probe.pos.y, upper_probe.pos.z])
     quat_upper_from_aurora = np.array([upper_probe.quat.x, upper_probe.quat.y, upper_probe.quat.z, upper_probe.quat.w])
@@ -71,18 +83,8 @@ def move_robot_to_goal(arm, aurora, T_lower_from_upper):
     # これにより「頭蓋骨が動いても、顎の向きを基準に3mm前方」が維持されます
     T_lower_from_aurora_transform_goal = T_upper_from_aurora_transform @ T_lower_from_upper_transform @ T_offset
 
-    # 5. ゴール変換行列から位置とクォータニオンを抽出
-    t_lower_from_aurora_goal = T_lower_from_aurora_transform_goal.t
-    R_lower_from_aurora_goal = T_lower_from_aurora_transform_goal.R
-    quat_lower_from_aurora_goal = R.from_matrix(R_lower_from_aurora_goal).as_quat()
-
-    # 6. 外部関数(main.py)を使用して、ロボット座標系(Robot)から見たアーム(Arm)の姿勢に変換
-    T_arm_from_robot = run_pose_transoformation(
-        goal_aurora_point=t_lower_from_aurora_goal,
-        goal_aurora_quaternion=quat_lower_from_aurora_goal,
-        world_calib_csv="robot&aurora/current_code/new_transform/data/aurora_robot_pose_log_20260205.csv",
-        hand_eye_calib_csv="robot&aurora/current_code/new_transform/data/aurora_robot_orientation_log_20260205.csv"
-    )
+    # 5-6. キャリブレーション済みの変換器で、ロボット座標系(Robot)から見たアーム(Arm)の姿勢に変換
+    T_arm_from_robot = transformer.transform_matrix(T_lower_from_aurora_transform_goal.matrix)
 
     # 7. ロボット制御用に位置(t)と回転ベクトル(axis-angle)を抽出
     T_arm_from_robot_transform = Transform.from_matrix(T_arm_from_robot)
@@ -90,22 +92,75 @@ def move_robot_to_goal(arm, aurora, T_lower_from_upper):
     R_arm_from_robot = T_arm_from_robot_transform.R
     arm_rotvec_from_robot = R.from_matrix(R_arm_from_robot).as_rotvec(degrees=True)
 
-    print(f"ゴール位置 (Robot座標): {t_arm_from_robot}")
-
-    # 8. ロボットアームへ移動指令
     angle_pose = [
         t_arm_from_robot[0], t_arm_from_robot[1], t_arm_from_robot[2], 
         arm_rotvec_from_robot[0], arm_rotvec_from_robot[1], arm_rotvec_from_robot[2]
     ]
-    print("ロボットアームの姿勢を調整中...")
-    arm.set_position_aa(axis_angle_pose=angle_pose, wait=True, speed=20)
+    return T_lower_from_aurora_transform_goal, angle_pose
+
+def estimate_arrival_time(arm, angle_pose, speed=20.0, command_latency=0.05):
+    """
+    現在から指令した姿勢 angle_pose に到着するまでの時間 [秒] を見積もる
+    (計測したゴール計算までの処理時間 (p50) + 指令の遅延 + 推定移動時間)
+    """
+    profiler = get_profiler()
+    pipeline = sum(profiler.histograms[name].percentile(50)
+                   for name in ("frame", "generate_probe", "compute_goal") if name in profiler.histograms)
+    current = arm.get_position()[1]
+    goal_rpy = R.from_rotvec(angle_pose[3:6], degrees=True).as_euler('xyz', degrees=True)
+    motion = estimate_motion_time([list(current), list(angle_pose[:3]) + list(goal_rpy)], speed=speed)
+    return pipeline + command_latency + motion
+
+def move_robot_to_goal(arm, aurora, T_lower_from_upper, transformer, predictor=None, lead_time=None):
+    """
+    ロボットをゴール位置（Lowerセンサーの相対位置 + Z軸3mmオフセット）に移動する関数
+    transformer: キャリブレーション済みの PoseTransformer
+    predictor: ConstantVelocityPosePredictor を与えた場合、頭蓋骨の動きを到着予定時刻まで外挿したゴールに移動する
+    lead_time: 外挿する時間 [秒] (省略時は estimate_arrival_time で見積もる)
+    """
+    profiler = get_profiler()
+    log.info("ゴール位置を計算中...")
+    
+    # 1. 現在のupper_probe（頭蓋骨）のAurora座標を取得
+    with profiler.stage("frame"):
+        frame = aurora.get_frame()
+    with profiler.stage("generate_probe"):
+        probes = generateProbe(frame)
+    upper_probe = probes[1]
+
+    # 2-7. ゴール姿勢とロボットへの指令値を計算
+    with profiler.stage("compute_goal"):
+        T_lower_from_aurora_transform_goal, angle_pose = compute_goal(upper_probe, T_lower_from_upper, transformer)
+
+    # 頭蓋骨の動きの予測: 到着予定時刻の upper_probe の姿勢でゴールを計算し直す
+    if predictor is not None:
+        clock = get_clock()
+        now = clock.now()
+        feed_frames(predictor, aurora, clock_time=now)
+        if lead_time is None:
+            lead_time = estimate_arrival_time(arm, angle_pose)
+        # 到着予定時刻までは外挿するが、最後の計測が max_horizon より古い場合 (測定範囲外が続いた場合) は予測しない
+        predicted_probe = predictor.predict_probe(now + lead_time, upper_probe.port_number,
+                                                  max_horizon=lead_time + predictor.max_horizon)
+        if predicted_probe is not None:
+            T_lower_from_aurora_transform_goal, angle_pose = compute_goal(predicted_probe, T_lower_from_upper,
+                                                                          transformer)
+            log.info("頭蓋骨の動きを %.2f 秒先まで予測したゴールを使用します", lead_time)
 
-    print("ロボットアームの移動が完了しました。")
+    log.info("ゴール位置 (Robot座標): %s", np.array(angle_pose[:3]))
+
+    # 8. ロボットアームへ移動指令
+    log.info("ロボットアームの姿勢を調整中...")
+    with profiler.stage("move"):
+        arm.set_position_aa(axis_angle_pose=angle_pose, wait=True, speed=20)
+
+    log.info("ロボットアームの移動が完了しました。")
 
     # 9. 精度確認のための差分計算
-    print("目標とした位置・姿勢と現在の位置・姿勢の差分を計算中...")
+    log.info("目標とした位置・姿勢と現在の位置・姿勢の差分を計算中...")
     T_lower_from_aurora_goal_mat = T_lower_from_aurora_transform_goal.matrix
-    probes_after = generateProbe(aurora.get_frame())
+    with profiler.stage("accuracy_read"):
+        probes_after = generateProbe(aurora.get_frame())
     lower_probe_after = probes_after[0]
     t_lower_from_aurora_after = np.array([lower_probe_after.pos.x, lower_probe_after.pos.y, lower_probe_after.pos.z])
     quat_lower_from_aurora_after = np.array([lower_probe_after.quat.x, lower_probe_after.quat.y, lower_probe_after.quat.z, lower_probe_after.quat.w])
@@ -114,7 +169,171 @@ def move_robot_to_goal(arm, aurora, T_lower_from_upper):
 
     compute_transform_difference(T_lower_from_aurora_goal_mat, T_lower_from_aurora_after_mat)
 
-def main():
+def _limit_step(last_pose, goal_pose, max_step, max_step_deg):
+    """前回の指令値からゴールへ、1周期あたりの移動量 (max_step [mm], max_step_deg [度]) までだけ進めた指令値"""
+    p_last = np.asarray(last_pose[:3], dtype=np.float64)
+    p_goal = np.asarray(goal_pose[:3], dtype=np.float64)
+    distance = np.linalg.norm(p_goal - p_last)
+    if distance > max_step:
+        p_goal = p_last + (p_goal - p_last) * (max_step / distance)
+
+    r_last = R.from_rotvec(last_pose[3:6], degrees=True)
+    delta = (r_last.inv() * R.from_rotvec(goal_pose[3:6], degrees=True)).as_rotvec(degrees=True)
+    angle = np.linalg.norm(delta)
+    if angle > max_step_deg:
+        delta *= max_step_deg / angle
+    r_goal = r_last * R.from_rotvec(delta, degrees=True)
+    return list(p_goal) + list(r_goal.as_rotvec(degrees=True))
+
+def track_goal_continuously(arm, aurora, T_lower_from_upper, transformer, control_rate=50.0, command_mode="servo",
+                            deadband=0.2, deadband_deg=0.2, max_speed=50.0, max_angular_speed=30.0,
+                            duration=None, clock=None, predictor=None, arm_latency=0.05, probe_filter=None):
+    """
+    一定周期の制御ループで、頭蓋骨 (upper_probe) の動きにロボットを追従させ続ける関数
+    毎周期、最新のupper_probeの姿勢からゴールを計算し、待たずにロボットへ指令する
+    control_rate: 制御周期 [Hz] (20〜100 Hz 程度)
+    command_mode: "servo" (set_servo_cartesian_aa) または "follow" (mode 7 の set_position_aa(wait=False))
+    deadband: 前回の指令値からのゴールの変化がこれ以下 [mm] かつ deadband_deg 以下 [度] なら指令しない
+    max_speed, max_angular_speed: servo の1周期あたりの移動量の上限 [mm/s], [度/s] (follow では移動速度)
+    duration: 追従を続ける時間 [秒] (省略時は Ctrl+C まで)
+    clock: 周期の計測・待機に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+    predictor: ConstantVelocityPosePredictor を与えた場合、頭蓋骨の姿勢をロボットが動き終わる時刻まで外挿する
+               (外挿する時間 = 計測した1周期の処理時間の平均 + arm_latency)
+               最後の計測から predictor.max_horizon より先は外挿せず、測定範囲外と同様に前回の指令値を保持する
+    arm_latency: 指令してからアームが目標姿勢に達するまでの遅延 [秒]
+    probe_filter: ProbeFilterChain を与えた場合、upper_probe の新しいフレームごとに外れ値の除去と平滑化を行う
+                  (除かれたフレームは測定範囲外と同様に前回の指令値を保持する)
+    """
+    if command_mode not in COMMAND_MODES:
+        raise ValueError(f"不明な指令方法です: {command_mode} (選択肢: {', '.join(COMMAND_MODES)})")
+    if clock is None:
+        clock = get_clock()
+    period = 1.0 / control_rate
+    # 約1秒ごとに状況を表示する (1 Hz 未満の場合は毎周期)
+    log_every = max(1, int(round(control_rate)))
+
+    arm.set_mode(1 if command_mode == "servo" else 7)
+    arm.set_state(0)
+    clock.sleep(0.1)  # モード切り替えを待つ
+
+    profiler = get_profiler()
+    last_command = list(arm.get_position_aa()[1])
+    cycles = 0
+    commands = 0
+    deadline_misses = 0
+    skipped_cycles = 0
+    lost_frames = 0
+    last_frame_number = None
+    filtered_probe = None
+    # 1周期の処理時間の平均と最大 (リストに溜めると長時間の追従で平均の計算が遅くなるため逐次更新する)
+    cycle_time_mean = 0.0
+    cycle_time_max = 0.0
+    delta_t = np.nan
+
+    log.info("連続追従を開始します (%.0f Hz, %s, 不感帯 %s mm / %s 度)", control_rate, command_mode, deadband, deadband_deg)
+    start = clock.now()
+    next_deadline = start + period
+    try:
+        while duration is None or clock.now() - start < duration:
+            cycle_start = clock.now()
+            cycles += 1
+
+            # 1. 最新のupper_probe（頭蓋骨）の姿勢
+            if predictor is not None:
+                # 新しいフレームで予測器を更新し、指令が反映される時刻まで外挿する
+                with profiler.stage("frame"):
+                    feed_frames(predictor, aurora, clock_time=cycle_start, probe_filter=probe_filter)
+                lead_time = (cycle_time_mean if cycles > 1 else period) + arm_latency
+                upper_probe = predictor.predict_probe(cycle_start + lead_time, 1)
+            else:
+                with profiler.stage("frame"):
+                    frame = aurora.get_frame()
+                with profiler.stage("generate_probe"):
+                    upper_probe = generateProbe(frame)[1]
+                if probe_filter is not None:
+                    # 同じフレームを2回フィルタに通さない
+                    if frame[2][0] != last_frame_number:
+                        last_frame_number = frame[2][0]
+                        with profiler.stage("filter"):
+                            filtered_probe = probe_filter.filter(upper_probe, cycle_start)
+                    upper_probe = filtered_probe
+            if upper_probe is None or not np.isfinite(upper_probe.pos.x):
+                # 測定範囲外 (またはフィルタで除かれた): 前回の指令値を保持する
+                lost_frames += 1
+            else:
+                # 2. ゴールの計算 (キャリブレーション結果は読み込み済み)
+                with profiler.stage("compute_goal"):
+                    _, goal_pose = compute_goal(upper_probe, T_lower_from_upper, transformer)
+
+                # 3. 不感帯: ゴールの変化が小さい場合は指令しない
+                delta_t = np.linalg.norm(np.subtract(goal_pose[:3], last_command[:3]))
+                r_last = R.from_rotvec(last_command[3:6], degrees=True)
+                delta_angle = np.degrees((r_last.inv() * R.from_rotvec(goal_pose[3:6], degrees=True)).magnitude())
+                if delta_t > deadband or delta_angle > deadband_deg:
+                    # 4. 待たずにロボットへ指令
+                    with profiler.stage("command"):
+                        if command_mode == "servo":
+                            command = _limit_step(last_command, goal_pose, max_speed * period,
+                                                  max_angular_speed * period)
+                            code = arm.set_servo_cartesian_aa(command, speed=max_speed, is_radian=False)
+                        else:
+                            command = goal_pose
+                            code = arm.set_position_aa(axis_angle_pose=command, speed=max_speed, wait=False)
+                    if code != 0:
+                        raise RuntimeError(f"ロボットへの指令に失敗しました (code: {code})")
+                    last_command = command
+                    commands += 1
+
+            # 周期の管理 (締め切りに間に合わなかった周期は数えて飛ばす)
+            now = clock.now()
+            cycle_time = now - cycle_start
+            cycle_time_mean += (cycle_time - cycle_time_mean) / cycles
+            cycle_time_max = max(cycle_time_max, cycle_time)
+            profiler.record("cycle", cycle_time)
+            if now > next_deadline:
+                deadline_misses += 1
+                missed = int((now - next_deadline) // period)
+                skipped_cycles += missed
+                next_deadline += (missed + 1) * period
+            else:
+                clock.sleep(next_deadline - now)
+                next_deadline += period
+
+            if cycles % log_every == 0:
+                log.info("  %.1f 秒: 指令 %d 回, 締め切り超過 %d 回, ゴールとの差 %.2f mm",
+                         clock.now() - start, commands, deadline_misses, delta_t)
+    finally:
+        # 追従を止めて通常の位置制御モードに戻す
+        arm.set_state(4)
+        arm.set_mode(0)
+        arm.set_state(0)
+
+        elapsed = clock.now() - start
+        log.info("連続追従を終了しました")
+        log.info("  周期: %d 回 (%.1f Hz), 指令: %d 回", cycles, cycles / max(elapsed, 1e-9), commands)
+        log.info("  処理時間: 平均 %.2f ms, 最大 %.2f ms (周期 %.1f ms)",
+                 cycle_time_mean * 1000, cycle_time_max * 1000, period * 1000)
+        log.info("  締め切り超過: %d 回 (飛ばした周期: %d), 測定範囲外: %d 回", deadline_misses, skipped_cycles, lost_frames)
+        if probe_filter is not None:
+            log.info("  フィルタ: 採用 %d フレーム, 除外 %d フレーム", probe_filter.accepted, probe_filter.rejected)
+
+def main(continuous=False, control_rate=50.0, command_mode="servo", deadband=0.2, deadband_deg=0.2,
+         profile_output=None, predict_motion=False, filter_probes=False, max_quality=None, quiet=False):
+    """
+    continuous: True の場合は Enter を待たずに一定周期で頭蓋骨の動きに追従し続ける
+    control_rate: 連続追従の制御周期 [Hz]
+    command_mode: 連続追従の指令方法 ("servo", "follow")
+    deadband, deadband_deg: 連続追従でゴールの変化がこれ以下なら指令しない [mm], [度]
+    profile_output: 段階ごとの処理時間を計測し、終了時 (またはシグナル受信時) に保存するファイル (.json / .csv)
+    predict_motion: 頭蓋骨の動きを等速度モデルで予測し、ロボットの到着予定時刻のゴールに移動する
+    filter_probes: 連続追従で upper_probe の外れ値の除去と平滑化 (utils.probe_filter) を行う
+    max_quality: filter_probes のとき、品質値がこれより大きいフレームを除く (None: NaN のみ除く)
+    quiet: 静音モード: 制御ループ中の表示 (ゴール位置・差分・追従の状況) を行わず、警告以上のみ表示する
+    """
+    configure_logging(quiet=quiet)
+    if profile_output is not None:
+        enable_profiling(profile_output)
+
     # ポート設定
     port = "COM3"  # 環境に合わせて変更してください
     
@@ -128,8 +347,11 @@ def main():
         # ロボットアームを初期化
         arm = initialize_robot()
 
-        # オーロラトラッカーを初期化
-        aurora = initialize_aurora(port=port)
+        # オーロラトラッカーを初期化（バックグラウンドで読み続け、常に最新のフレームを使う）
+        aurora = initialize_aurora(port=port, background=True)
+
+        # キャリブレーション結果を読み込み、座標変換器を作成（ループ内では再計算しない）
+        transformer = PoseTransformer.from_calibration(WORLD_CALIB_CSV, HAND_EYE_CALIB_CSV)
 
         print("トラッキング開始しました")
         print("=" * 50)
@@ -137,7 +359,21 @@ def main():
         # 初回のみ相対変換行列を記録
         print("\n--- 初期設定: 相対的な変換行列の記録 ---")
         relative_transform = record_relative_transform(aurora)
+        flush_logging()
         print("相対的な変換行列が記録されました。この関係を維持してロボット制御を行います。")
+
+        # 頭蓋骨の動きの予測器
+        predictor = ConstantVelocityPosePredictor() if predict_motion else None
+
+        if continuous:
+            print("\n--- 連続追従モード ---")
+            print("(終了する場合は Ctrl+C を押してください)")
+            input(">>> 追従を開始するにはEnterキーを押してください: ")
+            track_goal_continuously(arm, aurora, relative_transform, transformer, control_rate=control_rate,
+                                    command_mode=command_mode, deadband=deadband, deadband_deg=deadband_deg,
+                                    predictor=predictor,
+                                    probe_filter=make_probe_filter(max_quality) if filter_probes else None)
+            return
         
         cycle_count = 1
         
@@ -151,7 +387,9 @@ def main():
                 input(">>> Enterキーを押してください: ")
                 
                 # ステップ2: ロボットをゴール位置に移動（記録済みの相対変換行列を使用）
-                move_robot_to_goal(arm, aurora, relative_transform)
+                with get_profiler().stage("total"):
+                    move_robot_to_goal(arm, aurora, relative_transform, transformer, predictor=predictor)
+                flush_logging()
                 
                 print(f"\nサイクル {cycle_count} が完了しました。")
                 print("次のサイクルを開始します...")
@@ -174,7 +412,20 @@ def main():
         
     finally:
         # クリーンアップ処理があれば、ここに記述
+        flush_logging()
+        get_profiler().print_summary()
         print("プログラムを終了しました。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(
+        continuous=False,        # True: Enterを待たずに一定周期で頭蓋骨の動きに追従し続ける
+        control_rate=50.0,       # 連続追従の制御周期 [Hz]
+        command_mode="servo",    # 連続追従の指令方法 ("servo", "follow")
+        deadband=0.2,            # ゴールの位置の変化がこれ以下 [mm] なら指令しない
+        deadband_deg=0.2,        # ゴールの回転の変化がこれ以下 [度] なら指令しない
+        profile_output=None,     # 段階ごとの処理時間の保存先 (例: "surgery_latency.json")。None で計測しない
+        predict_motion=False,    # True: 頭蓋骨の動きを予測し、ロボットの到着予定時刻のゴールに移動する
+        filter_probes=False,     # True: 連続追従で頭蓋骨のプローブの外れ値を除き、平滑化する
+        max_quality=None,        # filter_probes のとき、品質値がこれより大きいフレームを除く (None: NaN のみ除く)
+        quiet=False,             # True: 制御ループ中の表示を行わず、警告以上のみ表示する
+    )
\ No newline at end of file
@@ -0,0 +1,230 @@
+# 合成データでキャリブレーションの精度を調べるパラメータスイープ
+#
+# 真値の変換 (Aurora → ロボット、センサー → アーム)、ノイズの大きさ、サンプル数の全ての組み合わせ (セル) について
+#   1. 合成データを生成する (SyntheticPoseGenerator、範囲内の一様ランダムなアームの姿勢)
+#   2. ワールドキャリブレーション → ハンドアイキャリブレーションを実行する
+#   3. 推定結果を真値と比較する
+# をプロセスプールで並列に実行し、結果を1つのCSVにまとめる (終わったセルから順に追記する)
+#
+# 合成データは hand_eye_model=True で生成する (ハンドアイの推定結果を真値と比較できるように)
+# ワールドキャリブレーションはアームの位置とセンサーの位置が一致する (センサー → アームの並進が0の) モデルのため、
+# ワールド用のデータは create_sample_csv_world_calibration.py と同じくセンサー → アームの並進を0にして別に生成する
+# (並進を含むデータをワールドキャリブレーションに使うと、推定精度ではなくモデルの不一致を測ることになる)
+# ハンドアイ用のデータはセルのセンサー → アームの並進で生成し、推定した T_aurora_from_robot と組み合わせる
+
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from calibration.handeye_calibration import HandEyeCalibration
+from calibration.logger import configure_logging, get_logger
+from calibration.row_log import RowLogWriter
+from calibration.transformation_utils import compute_transform_difference
+from calibration.world_calibration import WorldCalibration
+from utils.synthetic_data import SyntheticPoseGenerator, uniform_poses
+
+log = get_logger(__name__)
+
+# 結果のCSVの列 (1行が1セル)
+SWEEP_COLUMNS = [
+    "cell", "seed",
+    "aur2rob_roll", "aur2rob_pitch", "aur2rob_yaw", "aur2rob_tx", "aur2rob_ty", "aur2rob_tz",
+    "sen2arm_roll", "sen2arm_pitch", "sen2arm_yaw", "sen2arm_tx", "sen2arm_ty", "sen2arm_tz",
+    "add_noise", "add_quaternion_noise", "rotation_noise_deg", "n_samples",
+    "world_t_error_mm", "world_rot_error_deg", "world_rms_mm",
+    "handeye_t_error_mm", "handeye_rot_error_deg", "handeye_t_rms_mm", "handeye_rot_mean_deg",
+    "elapsed_s",
+]
+# 整数で書く列
+SWEEP_INTEGER_COLUMNS = ["cell", "seed", "n_samples"]
+# 推定結果の列の数 (SWEEP_COLUMNS の world_t_error_mm 以降)
+N_RESULT_COLUMNS = len(SWEEP_COLUMNS) - SWEEP_COLUMNS.index("world_t_error_mm")
+
+
+def sweep_cells(rotations_aur2rob, translations_aur2rob, rotations_sen2arm, translations_sen2arm,
+                add_noises, add_quaternion_noises, rotation_noises_deg, sample_counts, trials=1, seed=0):
+    """
+    スイープする全てのセル (パラメータの組み合わせ) のリスト
+    各セルの乱数のシードは seed + セル番号 (同じ設定で実行すれば同じ結果になる)
+    trials: 同じパラメータを異なるシードで繰り返す回数
+    """
+    combinations = itertools.product(rotations_aur2rob, translations_aur2rob, rotations_sen2arm, translations_sen2arm,
+                                     add_noises, add_quaternion_noises, rotation_noises_deg, sample_counts,
+                                     range(trials))
+    cells = []
+    for index, (rot_a, trans_a, rot_s, trans_s, noise, quat_noise, rot_noise, n_samples, _) in enumerate(combinations):
+        cells.append({
+            "cell": index,
+            "seed": seed + index,
+            "rotation_euler_deg_aur2rob": list(rot_a),
+            "translation_vector_aur2rob": list(trans_a),
+            "rotation_euler_deg_sen2arm": list(rot_s),
+            "translation_vector_sen2arm": list(trans_s),
+            "add_noise": noise,
+            "add_quaternion_noise": quat_noise,
+            "rotation_noise_deg": rot_noise,
+            "n_samples": n_samples,
+        })
+    return cells
+
+
+def transform_error(T_estimated, T_true):
+    """推定結果と真値の差 (並進 [mm], 回転 [度])。推定に失敗した場合は NaN"""
+    if T_estimated is None:
+        return np.nan, np.nan
+    _, _, t_error, rot_error_deg = compute_transform_difference(T_true, T_estimated)
+    return float(t_error), float(rot_error_deg)
+
+
+def cell_row(cell, results):
+    """セルのパラメータと推定結果 (N_RESULT_COLUMNS 個) から結果の行 (SWEEP_COLUMNS の並び) を作る"""
+    return ([cell["cell"], cell["seed"]]
+            + cell["rotation_euler_deg_aur2rob"] + cell["translation_vector_aur2rob"]
+            + cell["rotation_euler_deg_sen2arm"] + cell["translation_vector_sen2arm"]
+            + [cell["add_noise"], cell["add_quaternion_noise"], cell["rotation_noise_deg"], cell["n_samples"]]
+            + list(results))
+
+
+def run_cell(cell, position_ranges, rotation_ranges, work_dir):
+    """
+    1セル分の 生成 → キャリブレーション → 真値との比較 を行い、結果の行 (SWEEP_COLUMNS の並び) を返す
+    """
+    start = time.perf_counter()
+    # ワールド用 (センサー → アームの並進は0) とハンドアイ用 (セルの並進) を同じシードで生成する
+    # (並進が0のセルでは2つのファイルは同じ内容になる)
+    generators = {}
+    data_files = {}
+    for kind, translation_sen2arm in (("world", [0, 0, 0]), ("handeye", cell["translation_vector_sen2arm"])):
+        generators[kind] = SyntheticPoseGenerator(
+            cell["rotation_euler_deg_aur2rob"], cell["translation_vector_aur2rob"],
+            cell["rotation_euler_deg_sen2arm"], translation_sen2arm,
+            add_noise=cell["add_noise"], add_quaternion_noise=cell["add_quaternion_noise"],
+            rotation_noise_deg=cell["rotation_noise_deg"], seed=cell["seed"], hand_eye_model=True
+        )
+        data_files[kind] = os.path.join(work_dir, f"cell{cell['cell']}_{kind}.poselog")
+    try:
+        for kind, generator in generators.items():
+            poses = uniform_poses(position_ranges, rotation_ranges, cell["n_samples"], generator.rng)
+            generator.write(data_files[kind], [poses], fsync_every=cell["n_samples"] + 1)
+
+        world = WorldCalibration(data_files["world"])
+        T_aurora_from_robot = world.run()
+        hand_eye_residuals = {}
+        T_arm_from_sensor = None
+        if T_aurora_from_robot is not None:
+            hand_eye = HandEyeCalibration(data_files["handeye"], T_aurora_from_robot)
+            T_arm_from_sensor = hand_eye.run()
+            hand_eye_residuals = hand_eye.residuals or {}
+        world_residuals = world.residuals or {}
+    finally:
+        for data_file in data_files.values():
+            if os.path.exists(data_file):
+                os.remove(data_file)
+
+    world_t_error, world_rot_error = transform_error(T_aurora_from_robot,
+                                                     generators["world"].true_T_aurora_from_robot())
+    handeye_t_error, handeye_rot_error = transform_error(T_arm_from_sensor,
+                                                         generators["handeye"].true_T_arm_from_sensor())
+
+    return cell_row(cell, [world_t_error, world_rot_error, world_residuals.get("rms_mm", np.nan),
+                           handeye_t_error, handeye_rot_error,
+                           hand_eye_residuals.get("t_rms_mm", np.nan), hand_eye_residuals.get("rot_mean_deg", np.nan),
+                           time.perf_counter() - start])
+
+
+def _init_worker():
+    # ワーカーではキャリブレーションの途中経過を表示しない (警告以上のみ)
+    configure_logging(quiet=True)
+
+
+def main(
+    rotations_aur2rob,
+    translations_aur2rob,
+    rotations_sen2arm,
+    translations_sen2arm,
+    add_noises=(0,),
+    add_quaternion_noises=(0,),
+    rotation_noises_deg=(0,),
+    sample_counts=(100,),
+    position_ranges=((75, 175), (-50, 50), (-350, -250)),
+    rotation_ranges=((-30, 30), (-30, 30), (-30, 30)),
+    trials=1,
+    seed=0,
+    output_file="robot&aurora/current_code/new_transform/data/sweep_synthetic_calibration.csv",
+    max_workers=None
+):
+    """
+    パラメータスイープを実行する関数
+
+    :param rotations_aur2rob: Aurora→Robotのオイラー角 [roll, pitch, yaw] (度) のリスト
+    :param translations_aur2rob: Aurora→Robotの並進ベクトル [tx, ty, tz] (mm) のリスト
+    :param rotations_sen2arm: Sensor→Armのオイラー角 [roll, pitch, yaw] (度) のリスト
+    :param translations_sen2arm: Sensor→Armの並進ベクトル [tx, ty, tz] (mm) のリスト
+    :param add_noises: 位置ノイズの標準偏差 (mm) のリスト
+    :param add_quaternion_noises: クォータニオンノイズの標準偏差のリスト
+    :param rotation_noises_deg: 回転ノイズ (SO(3)上) の標準偏差 (度) のリスト
+    :param sample_counts: 1回のキャリブレーションに使う点数のリスト
+    :param position_ranges: アームの位置 x, y, z の範囲 (mm)
+    :param rotation_ranges: アームの回転ベクトル rx, ry, rz の範囲 (度)
+    :param trials: 同じパラメータを異なるシードで繰り返す回数
+    :param seed: 乱数のシード (セルごとに seed + セル番号)
+    :param output_file: 結果のCSVファイル名
+    :param max_workers: プロセス数 (None の場合はCPUのコア数)
+    :return: 実行したセルの数
+    例外で失敗したセルは警告を表示し、推定結果を NaN にした行を書く (スイープ全体は止めない)
+    """
+    cells = sweep_cells(rotations_aur2rob, translations_aur2rob, rotations_sen2arm, translations_sen2arm,
+                        add_noises, add_quaternion_noises, rotation_noises_deg, sample_counts, trials, seed)
+    log.info("%d セルを %s プロセスで実行します。", len(cells), max_workers or os.cpu_count())
+
+    start = time.perf_counter()
+    failed = 0
+    work_dir = tempfile.mkdtemp(prefix="sweep_synthetic_")
+    try:
+        with RowLogWriter(output_file, SWEEP_COLUMNS, decimal_places=6,
+                          integer_columns=SWEEP_INTEGER_COLUMNS) as writer, \
+                ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            futures = {executor.submit(run_cell, cell, position_ranges, rotation_ranges, work_dir): cell
+                       for cell in cells}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    cell = futures[future]
+                    log.warning("セル %d (シード %d) でエラーが発生しました: %r", cell["cell"], cell["seed"], e)
+                    row = cell_row(cell, [np.nan] * N_RESULT_COLUMNS)
+                    failed += 1
+                writer.write_row(row)
+                if done % 100 == 0 or done == len(cells):
+                    log.info("  %d/%d セル完了 (%.1f 秒)", done, len(cells), time.perf_counter() - start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failed:
+        log.warning("%d/%d セルが失敗しました (結果は NaN)", failed, len(cells))
+
+    return len(cells)
+
+
+if __name__ == "__main__":
+    configure_logging(quiet=False)
+
+    result = main(
+        rotations_aur2rob=[[10, -40, 60], [50, -120, 0]],           # Aurora→Robotのオイラー角（度）[roll, pitch, yaw] のリスト
+        translations_aur2rob=[[20, 10, -150]],                     # Aurora→Robotの並進ベクトル（mm）[tx, ty, tz] のリスト
+        rotations_sen2arm=[[-40, 170, 90]],                        # Sensor→Armのオイラー角（度）[roll, pitch, yaw] のリスト
+        translations_sen2arm=[[0, 0, 0], [80, -5, 20]],            # Sensor→Armの並進ベクトル（mm）[tx, ty, tz] のリスト
+        add_noises=[0, 0.1, 0.5, 1.0],                             # 位置ノイズの標準偏差（mm）のリスト
+        add_quaternion_noises=[0],                                 # クォータニオンノイズの標準偏差のリスト
+        rotation_noises_deg=[0, 0.1, 0.5],                         # 回転ノイズ（SO(3)上）の標準偏差（度）のリスト
+        sample_counts=[10, 30, 100, 300],                          # 1回のキャリブレーションに使う点数のリスト
+        position_ranges=((75, 175), (-50, 50), (-350, -250)),      # アームの位置の範囲（mm）[x, y, z]
+        rotation_ranges=((-30, 30), (-30, 30), (-30, 30)),         # アームの回転ベクトルの範囲（度）[rx, ry, rz]
+        trials=5,                                                  # 同じパラメータを異なるシードで繰り返す回数
+        seed=0,                                                    # 乱数のシード
+        output_file="robot&aurora/current_code/new_transform/data/sweep_synthetic_calibration.csv",  # 結果のCSVファイル
+        max_workers=None                                           # プロセス数（None: CPUのコア数）
+    )
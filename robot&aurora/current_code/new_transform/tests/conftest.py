@@ -0,0 +1,5 @@
+# テストから calibration, utils を import できるように new_transform をパスに追加する
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
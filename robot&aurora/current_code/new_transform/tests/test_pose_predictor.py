@@ -0,0 +1,50 @@
+import math
+
+from utils.pose_predictor import ConstantVelocityPosePredictor
+
+QUAT = (0.0, 0.0, 0.0, 1.0)
+NAN_POSITION = (math.nan, math.nan, math.nan)
+
+
+def _feed_motion(predictor, speed=10.0, rate=40.0, duration=2.0):
+    """x 方向に speed [mm/s] で動くフレームを与え、最後の時刻を返す"""
+    n = int(duration * rate)
+    for i in range(n + 1):
+        t = i / rate
+        predictor.update(t, (speed * t, 0.0, 0.0), QUAT)
+    return n / rate
+
+
+def test_predict_extrapolates_motion():
+    predictor = ConstantVelocityPosePredictor()
+    last = _feed_motion(predictor)
+    position, _ = predictor.predict(last + 0.1)
+    assert abs(position[0] - 10.0 * (last + 0.1)) < 0.5
+
+
+def test_prediction_stops_after_nan_frames():
+    predictor = ConstantVelocityPosePredictor(max_horizon=0.25)
+    last = _feed_motion(predictor)
+
+    # 測定範囲外 (NaN) のフレームが続く
+    t = last
+    for _ in range(100):
+        t += 1 / 40.0
+        predictor.update(t, NAN_POSITION, QUAT)
+    assert predictor.time == last
+
+    assert predictor.predict(last + 0.2) is not None
+    assert predictor.predict(last + 0.3) is None
+    assert predictor.predict(t) is None
+    assert predictor.predict_probe(t, 1) is None
+    # 呼び出し側が明示した上限までは外挿する
+    assert predictor.predict(last + 1.0, max_horizon=1.5) is not None
+
+
+def test_measurement_after_gap_restarts_prediction():
+    predictor = ConstantVelocityPosePredictor(max_dt=0.5, max_horizon=0.25)
+    last = _feed_motion(predictor)
+    predictor.update(last + 2.0, (0.0, 0.0, 0.0), QUAT)
+    position, _ = predictor.predict(last + 2.1)
+    # 推定をやり直すため、古い速度で外挿しない
+    assert abs(position[0]) < 1e-9
@@ -0,0 +1,24 @@
+from utils.clock import VirtualClock
+from utils.settling import AdaptiveSettling
+from utils.simulator import SimulatedRig
+
+
+def _stationary_rig(seed=0):
+    # Auroraの通常の計測ノイズ程度 (位置 0.05 mm, 回転 0.03 度)
+    return SimulatedRig(clock=VirtualClock(), position_noise=0.05, rotation_noise_deg=0.03, seed=seed)
+
+
+def test_adaptive_settling_with_noisy_stationary_frames():
+    for seed in range(5):
+        rig = _stationary_rig(seed)
+        settling = AdaptiveSettling(clock=rig.clock)
+        settle_time = settling.wait_after_move(rig.aurora)
+        assert settle_time < 0.5 * settling.timeout
+
+
+def test_adaptive_settling_times_out_while_moving():
+    rig = _stationary_rig()
+    rig.arm.set_position(x=400, wait=False)
+    settling = AdaptiveSettling(clock=rig.clock, timeout=0.5)
+    settle_time = settling.wait_after_move(rig.aurora)
+    assert settle_time >= settling.timeout
@@ -0,0 +1,79 @@
+# ロボットの姿勢取得とAuroraのフレーム取得を同時に行うためのヘルパー
+#
+# arm.get_position_aa() と aurora.get_frame() を順に呼ぶと通信の待ち時間が足し合わされ、
+# 2つの値も異なる時刻に取得される
+# ConcurrentSampler は小さなスレッドプールで全ての読み取りを同時に開始し、
+# それぞれの値を取得時刻 (ホスト側の時刻, 呼び出し開始と終了の中点) とともに返す
+
+from concurrent.futures import ThreadPoolExecutor
+from .capture import capture_probes
+from .initialization import get_clock
+
+
+class Sample:
+    def __init__(self, values, timestamps):
+        """
+        同時に取得した値
+        values: 名前 -> 取得した値
+        timestamps: 名前 -> 取得時刻 [秒] (ホスト側の時刻)
+        """
+        self.values = values
+        self.timestamps = timestamps
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def time_skew(self, name_a, name_b):
+        """2つの値の取得時刻の差 [秒]"""
+        return self.timestamps[name_a] - self.timestamps[name_b]
+
+
+class ConcurrentSampler:
+    def __init__(self, readers, clock=None):
+        """
+        複数の読み取りを同時に行うクラス
+        readers: 名前 -> 引数なしで値を返す関数 (例: {"robot": arm.get_position_aa, "aurora": aurora.get_frame})
+        clock: 取得時刻に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+        """
+        self.readers = dict(readers)
+        self.clock = clock if clock is not None else get_clock()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.readers), thread_name_prefix="sampler")
+
+    def _timed_read(self, reader):
+        start = self.clock.now()
+        value = reader()
+        end = self.clock.now()
+        return value, (start + end) / 2
+
+    def sample(self):
+        """
+        全ての読み取りを同時に実行し、全て終わるまで待つ
+        戻り値: Sample
+        """
+        futures = {name: self._executor.submit(self._timed_read, reader) for name, reader in self.readers.items()}
+        values = {}
+        timestamps = {}
+        for name, future in futures.items():
+            values[name], timestamps[name] = future.result()
+        return Sample(values, timestamps)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def make_robot_aurora_sampler(arm, aurora, frames_per_point=1, clock=None):
+    """
+    ロボットの姿勢 (回転ベクトル) とAuroraのプローブを同時に取得する ConcurrentSampler を作成する
+    sample["robot"]: arm.get_position_aa() の戻り値
+    sample["aurora"]: capture_probes(aurora, frames_per_point) の戻り値 (ポートごとのプローブのリスト)
+    """
+    return ConcurrentSampler({
+        "robot": arm.get_position_aa,
+        "aurora": lambda: capture_probes(aurora, frames_per_point, clock=clock),
+    }, clock=clock)
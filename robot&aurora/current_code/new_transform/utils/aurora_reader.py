@@ -0,0 +1,217 @@
+# Auroraのフレームをバックグラウンドのスレッドで読み続けるクラス
+#
+# aurora.get_frame() はシリアル通信の往復を待つため、呼び出すたびに処理が止まる
+# AuroraReader は別スレッドでトラッカーのフレームレートで get_frame() を呼び続け、
+# 取得したフレームを固定長のリングバッファ (事前に確保した numpy 配列) に保存する
+#
+# - latest(): 最新のフレーム (get_frame() と同じ形式)。待たずに返る
+# - since(frame_number): 指定したフレーム番号より新しいフレーム (FrameBlock)
+# - window(duration): 直近 duration 秒のフレーム (FrameBlock)
+# - get_frame(): latest() と同じ。NDITracker の代わりにそのまま渡せる
+#
+# 注意: VirtualClock のシミュレータと組み合わせると読み取りスレッドが仮想時刻を進めてしまうため、
+#       実時間のクロックで使う
+
+import threading
+import time
+import numpy as np
+from calibration.logger import get_logger
+from .initialization import get_clock
+
+log = get_logger(__name__)
+
+
+class FrameBlock:
+    def __init__(self, port_handles, host_times, time_stamps, frame_numbers, tracking, quality):
+        """
+        複数フレームをまとめた配列
+        host_times: (K,) フレームを受信したホスト側の時刻 [秒]
+        time_stamps: (K, ポート数) トラッカーのタイムスタンプ
+        frame_numbers: (K, ポート数) フレーム番号
+        tracking: (K, ポート数, 7) [qw, qx, qy, qz, x, y, z]
+        quality: (K, ポート数) 品質値
+        """
+        self.port_handles = port_handles
+        self.host_times = host_times
+        self.time_stamps = time_stamps
+        self.frame_numbers = frame_numbers
+        self.tracking = tracking
+        self.quality = quality
+
+    def __len__(self):
+        return len(self.host_times)
+
+    def positions(self, port_index=0):
+        """(K, 3) の位置"""
+        return self.tracking[:, port_index, 4:7]
+
+    def quats(self, port_index=0):
+        """(K, 4) のクォータニオン [x, y, z, w]"""
+        return self.tracking[:, port_index][:, [1, 2, 3, 0]]
+
+    def frame(self, i):
+        """i番目のフレームを get_frame() と同じ形式で返す"""
+        n_ports = len(self.port_handles)
+        return (
+            list(self.port_handles),
+            list(self.time_stamps[i]),
+            list(self.frame_numbers[i]),
+            [self.tracking[i, p].reshape(1, 7).copy() for p in range(n_ports)],
+            list(self.quality[i]),
+        )
+
+
+class AuroraReader:
+    def __init__(self, aurora, capacity=512, poll_interval=0.002, clock=None):
+        """
+        aurora: NDITracker (または SimulatedAurora)
+        capacity: リングバッファに保存するフレーム数
+        poll_interval: 新しいフレームがなかった場合に次に読むまでの間隔 [秒]
+        clock: 受信時刻に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+        """
+        self.aurora = aurora
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.clock = clock if clock is not None else get_clock()
+
+        self.port_handles = None
+        self.frames_read = 0
+        self.last_error = None
+
+        self._count = 0
+        self._last_frame_number = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _allocate(self, frame):
+        n_ports = len(frame[0])
+        self.port_handles = list(frame[0])
+        self._host_times = np.full(self.capacity, np.nan)
+        self._time_stamps = np.full((self.capacity, n_ports), np.nan)
+        self._frame_numbers = np.full((self.capacity, n_ports), -1, dtype=np.int64)
+        self._tracking = np.full((self.capacity, n_ports, 7), np.nan)
+        self._quality = np.full((self.capacity, n_ports), np.nan)
+
+    def _store(self, frame, host_time):
+        with self._condition:
+            if self.port_handles is None:
+                self._allocate(frame)
+            i = self._count % self.capacity
+            self._host_times[i] = host_time
+            self._time_stamps[i] = frame[1]
+            self._frame_numbers[i] = frame[2]
+            for p, tracking in enumerate(frame[3]):
+                self._tracking[i, p] = np.asarray(tracking, dtype=np.float64).reshape(7)
+            self._quality[i] = frame[4]
+            self._count += 1
+            self._condition.notify_all()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self.aurora.get_frame()
+            except Exception as e:
+                if str(e) != str(self.last_error):
+                    log.warning("警告: Auroraのフレームを読み込めません: %s", e)
+                self.last_error = e
+                time.sleep(0.1)
+                continue
+
+            host_time = self.clock.now()
+            self.frames_read += 1
+            frame_number = frame[2][0] if len(frame[2]) else None
+            if frame_number is not None and frame_number == self._last_frame_number:
+                # 同じフレームは保存しない
+                time.sleep(self.poll_interval)
+                continue
+            self._last_frame_number = frame_number
+            self._store(frame, host_time)
+
+    def start(self):
+        """読み取りスレッドを開始する"""
+        if self._thread is not None:
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="aurora-reader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """読み取りスレッドを停止する"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait_for_frame(self, timeout=1.0):
+        """最初のフレームが届くまで待つ。戻り値: フレームがあるかどうか"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._count > 0, timeout=timeout)
+
+    def _ordered_indices(self):
+        n = min(self._count, self.capacity)
+        return np.arange(self._count - n, self._count) % self.capacity
+
+    def _block(self, indices):
+        return FrameBlock(list(self.port_handles), self._host_times[indices].copy(),
+                          self._time_stamps[indices].copy(), self._frame_numbers[indices].copy(),
+                          self._tracking[indices].copy(), self._quality[indices].copy())
+
+    def latest(self):
+        """最新のフレーム (get_frame() と同じ形式)。まだフレームがない場合は None"""
+        with self._condition:
+            if self._count == 0:
+                return None
+            return self._block([(self._count - 1) % self.capacity]).frame(0)
+
+    def latest_host_time(self):
+        """最新のフレームを受信した時刻 (まだフレームがない場合は None)"""
+        with self._condition:
+            if self._count == 0:
+                return None
+            return float(self._host_times[(self._count - 1) % self.capacity])
+
+    def since(self, frame_number):
+        """指定したフレーム番号 (ポート0) より新しいフレームを古い順に返す (FrameBlock)"""
+        with self._condition:
+            if self._count == 0:
+                return None
+            indices = self._ordered_indices()
+            indices = indices[self._frame_numbers[indices, 0] > frame_number]
+            return self._block(indices)
+
+    def window(self, duration):
+        """直近 duration 秒に受信したフレームを古い順に返す (FrameBlock)"""
+        with self._condition:
+            if self._count == 0:
+                return None
+            indices = self._ordered_indices()
+            latest_time = self._host_times[indices[-1]]
+            indices = indices[self._host_times[indices] >= latest_time - duration]
+            return self._block(indices)
+
+    # --- NDITracker と同じ呼び出し方 ---
+    def get_frame(self):
+        """最新のフレームを返す (最初のフレームが届くまでは待つ)"""
+        if self._count == 0 and not self.wait_for_frame(timeout=1.0):
+            raise RuntimeError("Auroraからフレームを受信できません")
+        return self.latest()
+
+    def start_tracking(self):
+        self.aurora.start_tracking()
+        self.start()
+
+    def stop_tracking(self):
+        self.stop()
+        self.aurora.stop_tracking()
+
+    def close(self):
+        self.stop()
+        self.aurora.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,103 @@
+# 1つの計測点でAuroraのフレームを複数取得し、ロバストな平均値を求める
+#
+# 位置: K個のフレームの中央値 (外れ値の影響を受けにくい)
+# 姿勢: 符号をそろえたクォータニオンの固有ベクトル法による平均 (average_quaternions)
+# ばらつき: 位置は中央値からの二乗平均平方根距離 [mm]、姿勢は平均姿勢からの二乗平均平方根角度 [度]
+#
+# frames_per_point=1 の場合は generateProbe(aurora.get_frame()) と同じ値になる (ばらつきは0)
+
+import numpy as np
+from calibration.transformation_utils import average_quaternions
+from .initialization import get_clock
+from .pose_formatter import Probe, Vector, Quaternion
+
+
+class AveragedProbe(Probe):
+    def __init__(self, port_number, time_stamp, frame_numbers, pos, quat, quality,
+                 pos_spread, rot_spread, n_frames):
+        """
+        複数フレームを平均したプローブ (Probe と同じ属性に加えてばらつきを持つ)
+        pos_spread: 位置のばらつき [mm]
+        rot_spread: 姿勢のばらつき [度]
+        n_frames: 平均に使ったフレーム数
+        """
+        super().__init__(port_number, time_stamp, frame_numbers, pos, quat, quality)
+        self.pos_spread = pos_spread
+        self.rot_spread = rot_spread
+        self.n_frames = n_frames
+
+
+def capture_frames(aurora, frames_per_point, frame_rate=40.0, timeout=1.0, clock=None):
+    """
+    異なるフレーム番号のフレームを frames_per_point 個取得する
+    frame_rate: Auroraのフレームレート [Hz] (この周期でフレームを取得する)
+    timeout: 最大待機時間 [秒] (超えた場合はそれまでに取得したフレームを返す)
+    戻り値: get_frame() の戻り値のリスト
+    """
+    frames = [aurora.get_frame()]
+    if frames_per_point <= 1:
+        return frames
+
+    if clock is None:
+        clock = get_clock()
+    start = clock.now()
+    period = 1.0 / frame_rate
+    previous_frame_number = frames[0][2][0]
+    while len(frames) < frames_per_point and clock.now() - start < timeout:
+        clock.sleep(period)
+        frame = aurora.get_frame()
+        # 同じフレームを2回読んだ場合は使わない
+        if frame[2][0] != previous_frame_number:
+            previous_frame_number = frame[2][0]
+            frames.append(frame)
+    return frames
+
+
+def average_frames(frames):
+    """
+    複数のフレームをポートごとに平均する
+    frames: get_frame() の戻り値のリスト
+    戻り値: ポートごとの AveragedProbe のリスト
+    """
+    port_handles, time_stamps, frame_numbers = frames[-1][0], frames[-1][1], frames[-1][2]
+    # (フレーム数, ポート数, 7) [qw, qx, qy, qz, x, y, z]
+    tracking = np.array([[np.asarray(t, dtype=np.float64).reshape(7) for t in frame[3]] for frame in frames])
+    quality = np.array([frame[4] for frame in frames], dtype=np.float64)
+
+    probes = []
+    for i in range(len(port_handles)):
+        valid = np.all(np.isfinite(tracking[:, i]), axis=1)
+        if not valid.any():
+            # 全フレームで測定範囲外
+            probes.append(AveragedProbe(port_handles[i], time_stamps[i], frame_numbers[i],
+                                        Vector(np.nan, np.nan, np.nan), Quaternion(np.nan, np.nan, np.nan, np.nan),
+                                        np.nan, np.nan, np.nan, 0))
+            continue
+
+        positions = tracking[valid, i, 4:7]
+        quats = tracking[valid, i][:, [1, 2, 3, 0]]  # [x, y, z, w]
+        quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+
+        position = np.median(positions, axis=0)
+        mean_quat = average_quaternions(quats)
+
+        pos_spread = np.sqrt(np.mean(np.sum((positions - position) ** 2, axis=1)))
+        angles = 2 * np.arccos(np.clip(np.abs(quats @ mean_quat), 0.0, 1.0))
+        rot_spread = np.degrees(np.sqrt(np.mean(angles ** 2)))
+
+        x, y, z, w = mean_quat
+        probes.append(AveragedProbe(port_handles[i], time_stamps[i], frame_numbers[i],
+                                    Vector(*position), Quaternion(w, x, y, z),
+                                    float(np.median(quality[valid, i])),
+                                    float(pos_spread), float(rot_spread), int(valid.sum())))
+    return probes
+
+
+def capture_probes(aurora, frames_per_point=1, frame_rate=40.0, timeout=1.0, clock=None):
+    """
+    frames_per_point 個のフレームを取得し、ポートごとに平均したプローブを返す
+    generateProbe(aurora.get_frame()) の代わりに使える
+    戻り値: ポートごとの AveragedProbe のリスト
+    """
+    frames = capture_frames(aurora, frames_per_point, frame_rate=frame_rate, timeout=timeout, clock=clock)
+    return average_frames(frames)
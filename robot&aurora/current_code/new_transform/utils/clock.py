@@ -0,0 +1,47 @@
+# 時刻の取得と待機を差し替え可能にするためのクロック
+# 実機では RealClock、シミュレーションでは VirtualClock を使う
+# VirtualClock の sleep() は実際には待たずに仮想時刻を進めるだけなので、
+# 待機を多く含む収集ループも一瞬で実行できる
+
+import threading
+import time
+
+
+class RealClock:
+    """
+    実時間のクロック (time.monotonic / time.sleep)
+    時刻合わせ (NTP など) でシステム時刻が飛んでも戻らないため、周期の管理や経過時間の計測に使える
+    (値は起動からの時間などで、日時としての意味はない)
+    """
+
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        """
+        仮想時刻のクロック
+        start: 開始時刻 [秒]
+        """
+        self._time = float(start)
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            return self._time
+
+    def sleep(self, seconds):
+        """実際には待たずに仮想時刻を進める"""
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        if seconds <= 0:
+            return
+        with self._lock:
+            self._time += seconds
+
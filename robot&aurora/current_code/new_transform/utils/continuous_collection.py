@@ -0,0 +1,206 @@
+# 停止せずに動き続けながらキャリブレーション用のデータを収集する (連続収集モード)
+#
+# 従来の収集は各点で wait=True で移動し、停止・待機してから1組を取得する (1分あたり十数組)
+# 連続収集では目標姿勢を wait=False・ブレンド半径付きで先行してキューに積み、
+# アームが動いている間もロボット姿勢とAuroraのフレームを最大レートで取得し続ける
+# 取得後に StreamSynchronizer でAuroraの各フレームの時刻にロボット姿勢を補間して組にし、
+# 速度 × 時刻の不確かさ (同期ずれによる誤差の見積もり) が許容値以下の組だけを残す
+#
+# 回転の許容値は角速度 angular_speed から決める (省略時)
+# 角速度を上げると1分あたりの組は増えるが、各組の回転の同期ずれ (角速度 × timing_uncertainty) も大きくなる
+# 例: timing_uncertainty=5 ms では 20 度/s で約 0.1 度、90 度/s で約 0.45 度
+#
+# Auroraは AuroraReader (background=True) の場合は受信した全フレームを、
+# それ以外の場合はループごとに get_frame() で読んだフレームを使う
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from calibration.logger import get_logger
+from .acquisition import ConcurrentSampler
+from .aurora_reader import AuroraReader
+from .initialization import get_clock
+from .pose_formatter import generateProbe
+from .probe_filter import filter_frame_block
+from .synchronization import StreamSynchronizer
+
+log = get_logger(__name__)
+
+# 回転の許容値を角速度から決めるときの余裕 (ブレンド中に指令より少し速く回る組も残す)
+ANGULAR_SPEED_MARGIN = 1.2
+
+
+def _reached(arm_pose, target, position_tolerance, rotation_tolerance_deg):
+    """ロボット姿勢 (get_position_aa の値) が目標姿勢 [x, y, z, roll, pitch, yaw] (None は判定しない) に達したか"""
+    for value, goal in zip(arm_pose[:3], target[:3]):
+        if goal is not None and abs(value - goal) > position_tolerance:
+            return False
+    if any(v is None for v in target[3:6]):
+        return True
+    r_current = R.from_rotvec(arm_pose[3:6], degrees=True)
+    r_target = R.from_euler('xyz', target[3:6], degrees=True)
+    return np.degrees((r_current.inv() * r_target).magnitude()) <= rotation_tolerance_deg
+
+
+def _command_speed(previous, target, speed, angular_speed):
+    """
+    previous から target [x, y, z, roll, pitch, yaw] へ移動する指令の speed
+    回転が angular_speed [度/s] を超えないように並進速度を下げる
+    位置が変わらない場合は xArm が speed を回転速度 [度/s] として扱うため angular_speed をそのまま使う
+    """
+    distance = np.linalg.norm(np.subtract(target[:3], previous[:3]))
+    angle = np.degrees((R.from_euler('xyz', previous[3:6], degrees=True).inv()
+                        * R.from_euler('xyz', target[3:6], degrees=True)).magnitude())
+    if distance < 1e-3:
+        return angular_speed
+    if angle > 0:
+        return min(speed, distance * angular_speed / angle)
+    return speed
+
+
+def collect_continuous(arm, aurora, poses, speed=10.0, angular_speed=20.0, blend_radius=2.0, lookahead=5,
+                       sample_rate=100.0, tracker_latency=0.0, max_gap=0.1, timing_uncertainty=0.005,
+                       max_sync_error=0.1, max_sync_error_deg=None, reach_tolerance=None,
+                       reach_tolerance_deg=1.0, stop_time=0.5, port_index=0, clock=None, probe_filter=None):
+    """
+    目標姿勢の列を止まらずに移動しながら、ロボット姿勢とAuroraのフレームを取得して組にする
+    poses: 目標姿勢 [x, y, z, roll, pitch, yaw] のリスト (None の成分は現在の値のまま)
+    speed: 移動速度 [mm/s]
+    angular_speed: 回転速度 [度/s] (姿勢だけを変える経由点ではこの速度で回り、並進を伴う経由点でも回転はこれを超えない)
+    blend_radius: 経由点でのブレンド半径 [mm] (set_position の radius)
+    lookahead: 先行してキューに積む目標姿勢の数
+    sample_rate: ロボット姿勢を取得する周期 [Hz]
+    tracker_latency: Auroraの計測から記録時刻までの遅延 [秒] (StreamSynchronizer を参照)
+    max_gap: ロボット姿勢の補間に使う2点の時間間隔の上限 [秒]
+    timing_uncertainty: 遅延補正後に残る時刻のずれの見積もり [秒]
+    max_sync_error: 速度 × timing_uncertainty (同期ずれによる位置の誤差) の許容値 [mm]
+    max_sync_error_deg: 角速度 × timing_uncertainty (同期ずれによる回転の誤差) の許容値 [度]
+                        (省略時は angular_speed × timing_uncertainty × ANGULAR_SPEED_MARGIN。
+                         指令した角速度で動いている組は残るため、精度が必要な場合は angular_speed を下げる。
+                         angular_speed を下げずにこの値だけを小さくすると、動いている間の組はほとんど残らない)
+    reach_tolerance: 経由点に達したとみなす距離 [mm] (省略時は blend_radius + 1)
+    reach_tolerance_deg: 経由点に達したとみなす角度 [度]
+    stop_time: アームがこの時間 [秒] 止まっていたら、積んだ目標姿勢を全て通過したとみなす
+    port_index: 使用するプローブの番号 (0: アームのセンサー)
+    clock: 時刻・待機に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+    probe_filter: ProbeFilterChain を与えた場合、フィルタに残ったフレームだけを使う
+                  (平滑化は遅れが出るため、make_probe_filter(smoothing=False) を使う)
+    戻り値: (rows, pairs)
+        rows: (N, 14) キャリブレーション用CSVと同じ列の配列 (StreamSynchronizer.aligned_rows)
+        pairs: 残した組の StreamSynchronizer.aligned_pairs() の値
+    """
+    if clock is None:
+        clock = get_clock()
+    if reach_tolerance is None:
+        reach_tolerance = blend_radius + 1.0
+    if max_sync_error_deg is None:
+        max_sync_error_deg = angular_speed * timing_uncertainty * ANGULAR_SPEED_MARGIN
+    poses = [list(pose) + [None] * (6 - len(pose)) for pose in poses]
+    # 各経由点の指令の速度を決めるための直前の目標姿勢 (None の成分はその値のまま)
+    previous_target = list(arm.get_position(is_radian=False)[1])
+
+    use_reader = isinstance(aurora, AuroraReader)
+    readers = {"robot": arm.get_position_aa}
+    if not use_reader:
+        readers["aurora"] = aurora.get_frame
+    sampler = ConcurrentSampler(readers, clock=clock)
+    sync = StreamSynchronizer(tracker_latency=tracker_latency, max_gap=max_gap)
+
+    period = 1.0 / sample_rate
+    issued = 0
+    reached = 0
+    last_frame_number = -1
+    stopped_since = None
+
+    log.info("連続収集開始: 合計 %d 経由点 (速度 %s mm/s, %s 度/s, 回転の許容値 %.3f 度)",
+             len(poses), speed, angular_speed, max_sync_error_deg)
+    start = clock.now()
+    try:
+        while True:
+            # 先行して目標姿勢をキューに積む
+            while issued < len(poses) and issued < reached + lookahead:
+                x, y, z, roll, pitch, yaw = poses[issued]
+                target = [p if v is None else v for p, v in zip(previous_target, poses[issued])]
+                code = arm.set_position(x=x, y=y, z=z, roll=roll, pitch=pitch, yaw=yaw, radius=blend_radius,
+                                        speed=_command_speed(previous_target, target, speed, angular_speed),
+                                        wait=False)
+                if code != 0:
+                    raise RuntimeError(f"移動指令に失敗しました (code: {code}, 経由点 {issued})")
+                previous_target = target
+                issued += 1
+
+            loop_start = clock.now()
+            sample = sampler.sample()
+            sync.add_robot_pose(sample.timestamps["robot"], sample["robot"])
+            if use_reader:
+                block = aurora.since(last_frame_number)
+                if block is not None and len(block):
+                    if probe_filter is None:
+                        sync.add_frame_block(block, port_index)
+                    else:
+                        for time, probe in filter_frame_block(probe_filter, block, port_index):
+                            sync.add_probe(probe, time=time)
+                    last_frame_number = block.frame_numbers[-1, 0]
+            else:
+                frame = sample["aurora"]
+                # 同じフレームを2回読んだ場合は使わない
+                if frame[2][0] != last_frame_number:
+                    last_frame_number = frame[2][0]
+                    probe = generateProbe(frame)[port_index]
+                    if probe_filter is not None:
+                        probe = probe_filter.filter(probe, sample.timestamps["aurora"])
+                    if probe is not None:
+                        sync.add_probe(probe, time=sample.timestamps["aurora"])
+
+            # 経由点の通過を判定する (止まっている場合は積んだ目標姿勢を全て通過した)
+            arm_pose = sample["robot"][1]
+            previous_reached = reached
+            while reached < issued and _reached(arm_pose, poses[reached], reach_tolerance, reach_tolerance_deg):
+                reached += 1
+            # 指令直後は動き出す前のため、しばらく止まっていた場合だけ判定する
+            if arm.get_is_moving():
+                stopped_since = None
+            elif stopped_since is None:
+                stopped_since = clock.now()
+            elif clock.now() - stopped_since >= stop_time:
+                reached = issued
+                stopped_since = None
+            if reached >= len(poses):
+                break
+
+            # 進捗表示
+            if reached // 10 > previous_reached // 10:
+                log.info("進捗: %.1f%% (%d/%d), Auroraのフレーム: %d 個",
+                         reached / len(poses) * 100, reached, len(poses), len(sync.tracker))
+            clock.sleep(max(0.0, period - (clock.now() - loop_start)))
+    finally:
+        sampler.close()
+
+    duration = clock.now() - start
+    pairs = sync.aligned_pairs()
+    position_error = pairs["robot_speed"] * timing_uncertainty
+    rotation_error = pairs["robot_angular_speed"] * timing_uncertainty
+    keep = (position_error <= max_sync_error) & (rotation_error <= max_sync_error_deg)
+    pairs = {name: values[keep] for name, values in pairs.items()}
+    rows = sync.aligned_rows(pairs)
+
+    log.info("連続収集完了")
+    log.info("  所要時間: %.1f 秒, ロボット姿勢: %d 個, Auroraのフレーム: %d 個",
+             duration, len(sync.robot), len(sync.tracker))
+    log.info("  同期した組: %d 組, 採用: %d 組 (%.0f 組/分)", len(keep), len(rows), len(rows) / max(duration, 1e-9) * 60)
+    if probe_filter is not None:
+        log.info("  フィルタで除いたフレーム: %d 個", probe_filter.rejected)
+    return rows, pairs
+
+
+def rows_to_collected_data(rows):
+    """
+    collect_continuous の rows を collect_data と同じ形式の (robot_data, aurora_data) に変換する
+    (1フレームずつなので複数フレームのばらつきは0)
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 14)
+    robot_data = {name: rows[:, i].tolist() for i, name in enumerate(['x', 'y', 'z', 'rx', 'ry', 'rz'])}
+    aurora_names = ['x', 'y', 'z', 'quat_x', 'quat_y', 'quat_z', 'quat_w', 'quality']
+    aurora_data = {name: rows[:, 6 + i].tolist() for i, name in enumerate(aurora_names)}
+    aurora_data['pos_spread'] = [0.0] * len(rows)
+    aurora_data['rot_spread'] = [0.0] * len(rows)
+    return robot_data, aurora_data
@@ -1,10 +1,41 @@
 import time
-from xarm.wrapper import XArmAPI
-from sksurgerynditracker.nditracker import NDITracker
 
-def initialize_robot(ip='192.168.1.155'):
-    """ロボットアームの初期化"""
-    arm = XArmAPI(ip)
+# シミュレーション用のデバイス一式 (SimulatedRig)
+# use_simulated_rig() で設定すると、initialize_robot / initialize_aurora が実機の代わりにシミュレータを返す
+_simulated_rig = None
+
+
+def use_simulated_rig(rig):
+    """
+    実機の代わりに使うシミュレータを設定する
+    rig: utils.simulator.SimulatedRig (None で実機に戻す)
+    """
+    global _simulated_rig
+    _simulated_rig = rig
+
+
+def get_simulated_rig():
+    """設定されているシミュレータを返す (実機の場合は None)"""
+    return _simulated_rig
+
+
+def get_clock():
+    """待機に使うクロック (シミュレータを使っている場合はそのクロック、実機の場合は実時間のクロック)"""
+    if _simulated_rig is not None:
+        return _simulated_rig.clock
+    from .clock import RealClock
+    return RealClock()
+
+
+def initialize_robot(ip='192.168.1.155', rig=None):
+    """ロボットアームの初期化 (rig またはuse_simulated_rig() で設定したシミュレータがあればそれを使う)"""
+    rig = rig if rig is not None else _simulated_rig
+    if rig is not None:
+        arm = rig.arm
+    else:
+        # 実機用のSDKは実機を使う場合のみ読み込む
+        from xarm.wrapper import XArmAPI
+        arm = XArmAPI(ip)
     arm.connect()
     arm.clean_warn()
     arm.clean_error()
@@ -13,8 +44,24 @@ def initialize_robot(ip='192.168.1.155'):
     arm.set_state(state=0)
     return arm
 
-def initialize_aurora(port='COM3'):
-    """オーロラトラッカーの初期化"""
+def initialize_aurora(port='COM3', rig=None, background=False):
+    """
+    オーロラトラッカーの初期化 (rig またはuse_simulated_rig() で設定したシミュレータがあればそれを使う)
+    background: True の場合はバックグラウンドのスレッドでフレームを読み続ける AuroraReader を返す
+    """
+    rig = rig if rig is not None else _simulated_rig
+    if rig is not None:
+        aurora = rig.aurora
+        aurora.start_tracking()
+        rig.clock.sleep(3)  # トラッキング開始を待つ
+        from .clock import VirtualClock
+        if background and isinstance(rig.clock, VirtualClock):
+            # 読み取りスレッドが仮想時刻を進めてしまうため使わない
+            print("仮想時刻のシミュレータではバックグラウンド読み取りを使用しません")
+            background = False
+        return _start_reader(aurora) if background else aurora
+
+    from sksurgerynditracker.nditracker import NDITracker
     aurora = NDITracker(
         {
             "tracker type": "aurora",
@@ -24,4 +71,11 @@ def initialize_aurora(port='COM3'):
     )
     aurora.start_tracking()
     time.sleep(3)  # トラッキング開始を待つ
-    return aurora
\ No newline at end of file
+    return _start_reader(aurora) if background else aurora
+
+
+def _start_reader(aurora):
+    from .aurora_reader import AuroraReader
+    reader = AuroraReader(aurora).start()
+    reader.wait_for_frame()
+    return reader
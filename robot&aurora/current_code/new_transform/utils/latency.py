@@ -0,0 +1,212 @@
+# 処理の段階ごとの所要時間を計測し、ヒストグラムとして集計する
+#
+# LatencyHistogram: HDRヒストグラムと同じ考え方で、値を対数間隔のビンに数える
+#   (相対誤差 precision 以内で p50 / p95 / p99 を求められ、記録は O(1)、メモリは固定)
+# LatencyProfiler: 段階 (stage) ごとのヒストグラム
+#   with profiler.stage("frame"):
+#       frame = aurora.get_frame()
+#   無効 (enabled=False) の場合は何もしないコンテキストを返すため、計測のオーバーヘッドはほぼない
+#
+# 集計結果は JSON / CSV に保存できる (終了時、またはシグナル (SIGUSR1 / Windows では SIGBREAK) を受けたとき)
+
+import atexit
+import csv
+import json
+import math
+import signal
+import time
+import numpy as np
+
+# install_dump_handlers() で集計結果を保存するプロファイラ (終了時・シグナルのハンドラは1回だけ登録する)
+_dump_profiler = None
+_dump_handlers_installed = False
+
+
+class LatencyHistogram:
+    def __init__(self, lowest=1e-7, highest=100.0, precision=0.01):
+        """
+        lowest, highest: 記録する値の範囲 [秒] (範囲外の値は端のビンに数える)
+        precision: ビンの相対的な幅 (0.01 なら1%の誤差でパーセンタイルを求める)
+        """
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        n_bins = int(math.ceil(math.log(highest / lowest) / self._log_base)) + 1
+        self._counts = np.zeros(n_bins, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        """値 [秒] を1つ記録する"""
+        if value > self.lowest:
+            index = min(int(math.log(value / self.lowest) / self._log_base), len(self._counts) - 1)
+        else:
+            index = 0
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """p パーセンタイル [秒] (0〜100)。記録がない場合は NaN"""
+        if self.count == 0:
+            return math.nan
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        index = int(np.searchsorted(np.cumsum(self._counts), rank))
+        # ビンの上端 (最大値は超えない)
+        return min(self.lowest * math.exp((index + 1) * self._log_base), self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def reset(self):
+        self._counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+
+class _Timer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.profiler.timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.profiler.timer() - self.start)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class LatencyProfiler:
+    def __init__(self, enabled=True, timer=time.perf_counter, **histogram_kwargs):
+        """
+        段階ごとの所要時間を集計するクラス
+        enabled: False の場合は計測しない
+        timer: 時刻を返す関数 (高分解能の time.perf_counter)
+        histogram_kwargs: LatencyHistogram に渡す引数
+        """
+        self.enabled = enabled
+        self.timer = timer
+        self.histogram_kwargs = histogram_kwargs
+        self.histograms = {}
+        self._dump_path = None
+
+    def stage(self, name):
+        """段階 name の所要時間を計測するコンテキスト"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        """段階 name の所要時間 [秒] を記録する"""
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram(**self.histogram_kwargs)
+        histogram.record(seconds)
+
+    def summary(self):
+        """段階ごとの統計 [ミリ秒]: {name: {"count", "mean", "p50", "p95", "p99", "max"}}"""
+        return {
+            name: {
+                "count": histogram.count,
+                "mean": histogram.mean * 1000,
+                "p50": histogram.percentile(50) * 1000,
+                "p95": histogram.percentile(95) * 1000,
+                "p99": histogram.percentile(99) * 1000,
+                "max": histogram.max * 1000,
+            }
+            for name, histogram in self.histograms.items()
+        }
+
+    def print_summary(self):
+        """段階ごとの統計を表示する"""
+        if not self.histograms:
+            return
+        print(f"{'段階':<16}{'回数':>8}{'平均':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>10}  [ms]")
+        for name, stats in self.summary().items():
+            print(f"{name:<16}{stats['count']:>8}{stats['mean']:>10.3f}{stats['p50']:>10.3f}"
+                  f"{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}")
+
+    def dump(self, path):
+        """集計結果を保存する (拡張子が .csv の場合は CSV、それ以外は JSON)"""
+        summary = self.summary()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+                for name, stats in summary.items():
+                    writer.writerow([name, stats["count"]] + [round(stats[key], 6) for key in
+                                                              ("mean", "p50", "p95", "p99", "max")])
+        else:
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"処理時間の集計を {path} に保存しました")
+
+    def install_dump_handlers(self, path):
+        """
+        終了時とシグナル (SIGUSR1 / SIGBREAK) を受けたときに集計結果を path に保存する
+        何度呼んでもハンドラは1回だけ登録し、最後に呼んだプロファイラの集計結果を1回だけ保存する
+        """
+        global _dump_profiler, _dump_handlers_installed
+        self._dump_path = path
+        _dump_profiler = self
+        if _dump_handlers_installed:
+            return
+        _dump_handlers_installed = True
+        atexit.register(_dump_at_exit)
+        signum = getattr(signal, "SIGUSR1", None) or getattr(signal, "SIGBREAK", None)
+        if signum is not None:
+            try:
+                signal.signal(signum, lambda signum, frame: _dump_profiler.dump(_dump_profiler._dump_path))
+            except ValueError:
+                # メインスレッド以外からは登録できない
+                pass
+
+
+def _dump_at_exit():
+    if _dump_profiler is not None and _dump_profiler.histograms:
+        _dump_profiler.dump(_dump_profiler._dump_path)
+
+
+# 計測に使う共通のプロファイラ (既定では無効)
+_profiler = LatencyProfiler(enabled=False)
+
+
+def get_profiler():
+    """共通のプロファイラを返す"""
+    return _profiler
+
+
+def enable_profiling(dump_path=None):
+    """
+    共通のプロファイラを有効にする
+    dump_path: 終了時・シグナル受信時に集計結果を保存するファイル (.json または .csv)
+    """
+    _profiler.enabled = True
+    if dump_path is not None:
+        _profiler.install_dump_handlers(dump_path)
+    return _profiler
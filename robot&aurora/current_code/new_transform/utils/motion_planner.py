@@ -0,0 +1,140 @@
+# キャリブレーション用の目標姿勢を訪れる順番を、推定移動時間が短くなるように並べ替える
+#
+# 2つの姿勢の間の移動時間は max(距離 / speed, 回転角 / angular_speed) で見積もる
+# (並進と回転は同時に行われるため、遅い方で決まる。SimulatedXArm と同じモデル)
+#
+# - serpentine_order: 格子点を蛇行順 (往復) に並べる。戻りの長い移動がなくなる
+# - plan_tour: 任意の姿勢のリストを貪欲法 (最も近い姿勢へ移動) で並べ、2-opt で改善する
+#   姿勢のスイープのように格子にならない場合に使う
+# - print_plan_report: 並べ替え前後の推定移動時間を表示する (ロボットに接続せずに確認できる)
+#
+# 姿勢は [x, y, z, roll, pitch, yaw] (mm, 度)。[x, y, z] のみ、または回転が None の場合は回転を考慮しない
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+
+def _split_poses(poses):
+    """姿勢のリストを位置 (N, 3) とクォータニオン (N, 4) (回転を考慮しない場合は None) に分ける"""
+    positions = np.array([pose[:3] for pose in poses], dtype=np.float64).reshape(-1, 3)
+    if any(len(pose) < 6 or any(v is None for v in pose[3:6]) for pose in poses):
+        return positions, None
+    rpy = np.array([pose[3:6] for pose in poses], dtype=np.float64)
+    return positions, R.from_euler('xyz', rpy, degrees=True).as_quat()
+
+
+def motion_time_matrix(poses, speed=50.0, angular_speed=90.0):
+    """
+    全ての姿勢の組の推定移動時間 [秒] (N, N)
+    speed: 並進速度 [mm/s], angular_speed: 回転速度 [度/s]
+    """
+    positions, quats = _split_poses(poses)
+    distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=2)
+    times = distances / speed
+    if quats is not None:
+        dots = np.clip(np.abs(quats @ quats.T), 0.0, 1.0)
+        angles = np.degrees(2 * np.arccos(dots))
+        times = np.maximum(times, angles / angular_speed)
+    return times
+
+
+def estimate_motion_time(poses, speed=50.0, angular_speed=90.0, start_pose=None):
+    """
+    姿勢のリストを順に移動したときの推定移動時間の合計 [秒]
+    start_pose: 移動を始める姿勢 (省略時は最初の姿勢から)
+    """
+    if start_pose is not None:
+        poses = [start_pose] + list(poses)
+    if len(poses) < 2:
+        return 0.0
+    positions, quats = _split_poses(poses)
+    times = np.linalg.norm(np.diff(positions, axis=0), axis=1) / speed
+    if quats is not None:
+        dots = np.clip(np.abs(np.sum(quats[:-1] * quats[1:], axis=1)), 0.0, 1.0)
+        times = np.maximum(times, np.degrees(2 * np.arccos(dots)) / angular_speed)
+    return float(times.sum())
+
+
+def serpentine_order(shape):
+    """
+    格子の蛇行順のインデックス
+    shape: 各軸の点数 (例: (N+1, N+1, N+1))。最後の軸が最も速く変わる (np.ndindex と同じ順)
+    戻り値: 平坦化したインデックス (C順) のリスト。隣り合う点は必ず1つの軸で隣接する
+    """
+    order = [()]
+    for n in shape:
+        next_order = []
+        for index, prefix in enumerate(order):
+            values = range(n) if index % 2 == 0 else range(n - 1, -1, -1)
+            next_order.extend(prefix + (v,) for v in values)
+        order = next_order
+    return [int(np.ravel_multi_index(index, shape)) for index in order]
+
+
+def _two_opt(path, cost, max_passes):
+    """開いた経路 (始点は固定) を 2-opt で改善する"""
+    path = np.array(path)
+    n = len(path)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            # 区間 path[i..j] を反転したときの変化量を j についてまとめて計算する
+            a = path[i - 1]
+            b = path[i]
+            j = np.arange(i + 1, n)
+            c = path[j]
+            d = np.append(path[j[:-1] + 1], -1)
+            has_next = d >= 0
+            d_safe = np.where(has_next, d, 0)
+            before = cost[a, b] + np.where(has_next, cost[c, d_safe], 0.0)
+            after = cost[a, c] + np.where(has_next, cost[b, d_safe], 0.0)
+            gain = before - after
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                path[i:j[best] + 1] = path[i:j[best] + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return path.tolist()
+
+
+def plan_tour(poses, speed=50.0, angular_speed=90.0, start_pose=None, max_passes=50):
+    """
+    推定移動時間が短くなるように姿勢のリストを並べ替える (貪欲法 + 2-opt)
+    start_pose: 移動を始める姿勢 (省略時は最初の姿勢から始める)
+    max_passes: 2-opt の最大反復回数
+    戻り値: 並べ替えた順のインデックスのリスト
+    """
+    n = len(poses)
+    if n < 3:
+        return list(range(n))
+    if start_pose is not None:
+        # 始点をインデックス n として加える
+        cost = motion_time_matrix(list(poses) + [start_pose], speed, angular_speed)
+        start = n
+    else:
+        cost = motion_time_matrix(poses, speed, angular_speed)
+        start = 0
+
+    # 貪欲法: 最も移動時間の短い未訪問の姿勢へ進む
+    visited = np.zeros(len(cost), dtype=bool)
+    path = [start]
+    visited[start] = True
+    for _ in range(n - (start == 0)):
+        candidates = np.where(visited, np.inf, cost[path[-1]])
+        nearest = int(np.argmin(candidates))
+        path.append(nearest)
+        visited[nearest] = True
+
+    path = _two_opt(path, cost, max_passes)
+    return path[1:] if start_pose is not None else path
+
+
+def print_plan_report(original, planned, speed=50.0, angular_speed=90.0, start_pose=None):
+    """並べ替え前後の推定移動時間を表示する"""
+    before = estimate_motion_time(original, speed, angular_speed, start_pose)
+    after = estimate_motion_time(planned, speed, angular_speed, start_pose)
+    ratio = after / before * 100 if before > 0 else 100.0
+    print(f"推定移動時間 ({len(original)} 姿勢, {speed} mm/s, {angular_speed} 度/s): "
+          f"並べ替え前 {before:.1f} 秒 → 並べ替え後 {after:.1f} 秒 ({ratio:.0f}%)")
+    return before, after
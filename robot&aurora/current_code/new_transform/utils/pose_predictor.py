@@ -0,0 +1,242 @@
+# 等速度モデルのカルマンフィルタで、上側プローブ (頭蓋骨) の姿勢を未来の時刻に外挿する
+#
+# 位置: 状態 [位置, 速度] の線形カルマンフィルタ
+# 姿勢: 誤差状態カルマンフィルタ (ESKF)
+#   公称姿勢 q (クォータニオン) と、状態 [誤差回転ベクトル δθ, 角速度 ω] (機体座標系) を持つ
+#   予測: q ← q ⊗ exp(ω dt)、更新: 残差 log(q⁻¹ ⊗ z) から δθ と ω を推定し q ← q ⊗ exp(δθ) として δθ を0に戻す
+#
+# ノイズは3軸で等方的とするため、共分散は位置・姿勢とも3軸で共通の 2x2 行列になる
+# 1回の更新は Python のスカラー演算だけで行い、トラッカーのフレームレートで十分に動く (十数マイクロ秒)
+
+import math
+from .pose_formatter import Probe, Vector, Quaternion, generateProbe
+from .probe_filter import filter_frame_block
+
+
+def _quat_multiply(a, b):
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+            aw * bw - ax * bx - ay * by - az * bz)
+
+
+def _quat_exp(v):
+    """回転ベクトル [rad] からクォータニオン [x, y, z, w]"""
+    angle = math.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+    if angle < 1e-12:
+        return (0.5 * v[0], 0.5 * v[1], 0.5 * v[2], 1.0)
+    s = math.sin(0.5 * angle) / angle
+    return (v[0] * s, v[1] * s, v[2] * s, math.cos(0.5 * angle))
+
+
+def _quat_log(q):
+    """クォータニオン [x, y, z, w] から回転ベクトル [rad] (最短の回転)"""
+    x, y, z, w = q
+    if w < 0:
+        x, y, z, w = -x, -y, -z, -w
+    norm = math.sqrt(x * x + y * y + z * z)
+    if norm < 1e-12:
+        return (2 * x, 2 * y, 2 * z)
+    scale = 2 * math.atan2(norm, w) / norm
+    return (x * scale, y * scale, z * scale)
+
+
+def _normalize(q):
+    n = math.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+    return (q[0] / n, q[1] / n, q[2] / n, q[3] / n)
+
+
+class _ConstantVelocityCovariance:
+    def __init__(self, process_noise, measurement_noise, initial_velocity_std):
+        """
+        等速度モデルの 2x2 共分散 (3軸で共通)
+        process_noise: 加速度のパワースペクトル密度 q (単位/s^2)^2·s
+        measurement_noise: 観測ノイズの標準偏差
+        """
+        self.q = process_noise
+        self.r = measurement_noise ** 2
+        self.reset(initial_velocity_std)
+
+    def reset(self, initial_velocity_std):
+        self.p00 = self.r
+        self.p01 = 0.0
+        self.p11 = initial_velocity_std ** 2
+
+    def predict(self, dt):
+        q = self.q
+        p00, p01, p11 = self.p00, self.p01, self.p11
+        self.p00 = p00 + 2 * dt * p01 + dt * dt * p11 + q * dt ** 3 / 3
+        self.p01 = p01 + dt * p11 + q * dt * dt / 2
+        self.p11 = p11 + q * dt
+
+    def update(self):
+        """観測で更新し、カルマンゲイン (位置, 速度) を返す"""
+        s = self.p00 + self.r
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        p00, p01, p11 = self.p00, self.p01, self.p11
+        self.p00 = (1 - k0) * p00
+        self.p01 = (1 - k0) * p01
+        self.p11 = p11 - k1 * p01
+        return k0, k1
+
+
+class ConstantVelocityPosePredictor:
+    def __init__(self, position_process_noise=100.0, rotation_process_noise_deg=50.0,
+                 position_measurement_noise=0.1, rotation_measurement_noise_deg=0.1,
+                 initial_velocity_std=50.0, initial_angular_velocity_std_deg=30.0, max_dt=0.5, max_horizon=0.25):
+        """
+        等速度モデルで姿勢を推定し、未来の時刻に外挿するクラス
+        position_process_noise: 加速度のパワースペクトル密度 [(mm/s^2)^2·s] (大きいほど速度の変化に素早く追従する)
+        rotation_process_noise_deg: 角加速度のパワースペクトル密度 [(度/s^2)^2·s]
+        position_measurement_noise: Auroraの位置の計測ノイズ [mm]
+        rotation_measurement_noise_deg: Auroraの回転の計測ノイズ [度]
+        initial_velocity_std, initial_angular_velocity_std_deg: 初期の速度・角速度の不確かさ [mm/s], [度/s]
+        max_dt: 前回の計測からこれより時間が空いた場合 [秒] は推定をやり直す
+        max_horizon: 最後の計測から外挿する時間の上限 [秒] (これより先は予測せず None を返す)
+                     測定範囲外が続くと最後の速度のまま外挿し続けて誤差が際限なく大きくなるため
+        """
+        self.initial_velocity_std = initial_velocity_std
+        self.initial_angular_velocity_std = math.radians(initial_angular_velocity_std_deg)
+        self.max_dt = max_dt
+        self.max_horizon = max_horizon
+        self._position_cov = _ConstantVelocityCovariance(position_process_noise, position_measurement_noise,
+                                                         initial_velocity_std)
+        self._rotation_cov = _ConstantVelocityCovariance(math.radians(math.sqrt(rotation_process_noise_deg)) ** 2,
+                                                         math.radians(rotation_measurement_noise_deg),
+                                                         self.initial_angular_velocity_std)
+        # feed_frames() が最後に取り込んだフレーム番号
+        self.last_frame_number = None
+        self.reset()
+
+    def reset(self):
+        self.time = None
+        self.position = None
+        self.velocity = (0.0, 0.0, 0.0)
+        self.quat = None
+        self.angular_velocity = (0.0, 0.0, 0.0)  # 機体座標系 [rad/s]
+
+    @property
+    def initialized(self):
+        return self.time is not None
+
+    def update(self, time, position, quat):
+        """
+        計測値で状態を更新する
+        time: 計測時刻 [秒] (単調増加)
+        position: [x, y, z] [mm], quat: [x, y, z, w]
+        """
+        # numpy の配列は Python の float にしてから計算する (要素ごとの numpy の演算は遅い)
+        if hasattr(position, "tolist"):
+            position = position.tolist()
+        if hasattr(quat, "tolist"):
+            quat = quat.tolist()
+        z_p = (float(position[0]), float(position[1]), float(position[2]))
+        z_q = _normalize((float(quat[0]), float(quat[1]), float(quat[2]), float(quat[3])))
+        if not all(math.isfinite(v) for v in z_p + z_q):
+            return
+
+        if self.time is None or time - self.time > self.max_dt:
+            self.reset()
+            self.time = time
+            self.position = z_p
+            self.quat = z_q
+            self._position_cov.reset(self.initial_velocity_std)
+            self._rotation_cov.reset(self.initial_angular_velocity_std)
+            return
+
+        dt = time - self.time
+        if dt > 0:
+            # 予測
+            p, v = self.position, self.velocity
+            self.position = (p[0] + v[0] * dt, p[1] + v[1] * dt, p[2] + v[2] * dt)
+            w = self.angular_velocity
+            self.quat = _normalize(_quat_multiply(self.quat, _quat_exp((w[0] * dt, w[1] * dt, w[2] * dt))))
+            self._position_cov.predict(dt)
+            self._rotation_cov.predict(dt)
+            self.time = time
+
+        # 位置の更新
+        k0, k1 = self._position_cov.update()
+        p, v = self.position, self.velocity
+        e = (z_p[0] - p[0], z_p[1] - p[1], z_p[2] - p[2])
+        self.position = (p[0] + k0 * e[0], p[1] + k0 * e[1], p[2] + k0 * e[2])
+        self.velocity = (v[0] + k1 * e[0], v[1] + k1 * e[1], v[2] + k1 * e[2])
+
+        # 姿勢の更新 (誤差状態): 残差は機体座標系の回転ベクトル
+        k0, k1 = self._rotation_cov.update()
+        q_inv = (-self.quat[0], -self.quat[1], -self.quat[2], self.quat[3])
+        e = _quat_log(_quat_multiply(q_inv, z_q))
+        w = self.angular_velocity
+        self.quat = _normalize(_quat_multiply(self.quat, _quat_exp((k0 * e[0], k0 * e[1], k0 * e[2]))))
+        self.angular_velocity = (w[0] + k1 * e[0], w[1] + k1 * e[1], w[2] + k1 * e[2])
+
+    def update_probe(self, probe, time):
+        """generateProbe のプローブで更新する"""
+        self.update(time, (probe.pos.x, probe.pos.y, probe.pos.z),
+                    (probe.quat.x, probe.quat.y, probe.quat.z, probe.quat.w))
+
+    def predict(self, time, max_horizon=None):
+        """
+        時刻 time の姿勢を外挿する (状態は変更しない)
+        max_horizon: 最後の計測から外挿する時間の上限 [秒] (省略時は self.max_horizon)
+        戻り値: (位置 (x, y, z), クォータニオン (x, y, z, w))。
+                まだ計測がない場合、または最後の計測から max_horizon より先の時刻の場合は None
+        """
+        if self.time is None:
+            return None
+        dt = time - self.time
+        if dt > (self.max_horizon if max_horizon is None else max_horizon):
+            return None
+        p, v, w = self.position, self.velocity, self.angular_velocity
+        position = (p[0] + v[0] * dt, p[1] + v[1] * dt, p[2] + v[2] * dt)
+        quat = _normalize(_quat_multiply(self.quat, _quat_exp((w[0] * dt, w[1] * dt, w[2] * dt))))
+        return position, quat
+
+    def predict_probe(self, time, port_number=None, max_horizon=None):
+        """時刻 time に外挿した姿勢を generateProbe と同じ Probe として返す (予測できない場合は None)"""
+        predicted = self.predict(time, max_horizon)
+        if predicted is None:
+            return None
+        (x, y, z), (qx, qy, qz, qw) = predicted
+        return Probe(port_number, time, self.last_frame_number, Vector(x, y, z), Quaternion(qw, qx, qy, qz), 0.0)
+
+
+def feed_frames(predictor, aurora, port_index=1, clock_time=None, probe_filter=None):
+    """
+    まだ取り込んでいないAuroraのフレームで predictor を更新する
+    aurora が AuroraReader の場合は前回以降に受信した全てのフレームを受信時刻とともに使い、
+    それ以外の場合は get_frame() の1フレームを clock_time の時刻で使う
+    port_index: 使用するプローブの番号 (1: 上側プローブ)
+    probe_filter: ProbeFilterChain を与えた場合、フィルタに残ったフレームだけで更新する
+    戻り値: 最新のフレームの時刻 (新しいフレームがない場合は None)
+    """
+    if hasattr(aurora, "since"):
+        block = aurora.since(-1 if predictor.last_frame_number is None else predictor.last_frame_number)
+        if block is None or len(block) == 0:
+            return None
+        predictor.last_frame_number = int(block.frame_numbers[-1, 0])
+        if probe_filter is not None:
+            for time, probe in filter_frame_block(probe_filter, block, port_index):
+                predictor.update_probe(probe, time)
+            return float(block.host_times[-1])
+        positions = block.positions(port_index)
+        quats = block.quats(port_index)
+        for i in range(len(block)):
+            predictor.update(float(block.host_times[i]), positions[i], quats[i])
+        return float(block.host_times[-1])
+
+    frame = aurora.get_frame()
+    if frame[2][0] == predictor.last_frame_number:
+        return None
+    predictor.last_frame_number = frame[2][0]
+    if probe_filter is not None:
+        probe = probe_filter.filter(generateProbe(frame)[port_index], clock_time)
+        if probe is not None:
+            predictor.update_probe(probe, clock_time)
+        return clock_time
+    tracking = frame[3][port_index].reshape(7)
+    predictor.update(clock_time, tracking[4:7], (tracking[1], tracking[2], tracking[3], tracking[0]))
+    return clock_time
@@ -0,0 +1,260 @@
+# Auroraのプローブ (generateProbe の要素) を1サンプルずつ処理するストリーミングフィルタ
+#
+# - QualityGate: 測定範囲外 (NaN) のフレームと、品質値 (エラー指標) が大きいフレームを除く
+# - HemisphereContinuity: クォータニオンの符号を直前の値にそろえる (q と -q は同じ回転)
+# - HampelFilter: 直近 window サンプルの中央値から n_sigmas × MAD 以上離れたサンプルを外れ値として除く
+# - OneEuroFilter: 速度に応じてカットオフ周波数を変える1次ローパスフィルタ (静止時は強く、動作時は弱く平滑化)
+# - ProbeFilterChain: 上のフィルタを順に適用する (途中で除かれたら None を返す)
+#
+# 各フィルタは固定長の状態しか持たないため、1サンプルあたりの計算量は一定
+# filter(probe, time) は新しい Probe を返し、除いた場合は None を返す
+
+import math
+import numpy as np
+from .pose_formatter import Probe, Vector, Quaternion, generateProbe
+
+
+def _probe_values(probe):
+    """[x, y, z, qx, qy, qz, qw]"""
+    return [probe.pos.x, probe.pos.y, probe.pos.z, probe.quat.x, probe.quat.y, probe.quat.z, probe.quat.w]
+
+
+def _make_probe(probe, values):
+    x, y, z, qx, qy, qz, qw = values
+    return Probe(probe.port_number, probe.time_stamp, probe.frame_numbers,
+                 Vector(x, y, z), Quaternion(qw, qx, qy, qz), probe.quality)
+
+
+class QualityGate:
+    def __init__(self, max_quality=None):
+        """
+        測定範囲外 (NaN) のフレームと品質値の悪いフレームを除くフィルタ
+        max_quality: 品質値 (エラー指標) の上限 (省略時は NaN のみを除く)
+        """
+        self.max_quality = max_quality
+        self.rejected = 0
+
+    def reset(self):
+        self.rejected = 0
+
+    def filter(self, probe, time=None):
+        if not all(math.isfinite(v) for v in _probe_values(probe)):
+            self.rejected += 1
+            return None
+        if self.max_quality is not None and not (probe.quality <= self.max_quality):
+            self.rejected += 1
+            return None
+        return probe
+
+
+class HemisphereContinuity:
+    def __init__(self):
+        """クォータニオンの符号を直前のサンプルにそろえるフィルタ"""
+        self._previous = None
+
+    def reset(self):
+        self._previous = None
+
+    def filter(self, probe, time=None):
+        q = (probe.quat.x, probe.quat.y, probe.quat.z, probe.quat.w)
+        if self._previous is not None and sum(a * b for a, b in zip(q, self._previous)) < 0:
+            values = _probe_values(probe)
+            values[3:] = [-v for v in values[3:]]
+            probe = _make_probe(probe, values)
+            q = tuple(values[3:])
+        self._previous = q
+        return probe
+
+
+def _median(values, axis):
+    """np.median と同じ値 (小さな配列では np.sort の方が速い)"""
+    values = np.sort(values, axis=axis)
+    n = values.shape[axis]
+    upper = np.take(values, n // 2, axis=axis)
+    if n % 2:
+        return upper
+    return 0.5 * (upper + np.take(values, n // 2 - 1, axis=axis))
+
+
+class HampelFilter:
+    def __init__(self, window=7, n_sigmas=3.0, min_deviation=0.05, replace=False):
+        """
+        直近 window サンプルの中央値と MAD (中央絶対偏差) から外れ値を判定するフィルタ
+        位置と回転のそれぞれで、成分ごとの中央値からの距離を判定する (HemisphereContinuity の後に使う)
+        n_sigmas: 中央値からの距離が n_sigmas × 1.4826 × (距離の中央値) を超えたら外れ値とする
+        min_deviation: 判定に使う距離の下限 (静止時に MAD がほぼ0になり、ノイズを外れ値としないため)
+                       位置は [mm]、クォータニオンはこの値の 1/100 (0.05 なら約 0.06 度)
+        replace: True の場合は外れ値を除かずに中央値で置き換える
+        外れ値もバッファには入れるため、動き出した直後に続けて除かれても数サンプルで追従する
+        """
+        self.window = window
+        self.n_sigmas = n_sigmas
+        self.min_deviation = min_deviation
+        self.replace = replace
+        self._buffer = np.zeros((window, 7))
+        self._floor = np.array([min_deviation, min_deviation / 100])
+        self.reset()
+
+    def reset(self):
+        self._count = 0
+        self._next = 0
+        self.rejected = 0
+
+    def filter(self, probe, time=None):
+        values = np.array(_probe_values(probe))
+        self._buffer[self._next] = values
+        self._next = (self._next + 1) % self.window
+        self._count = min(self._count + 1, self.window)
+        if self._count < self.window:
+            return probe
+        median = _median(self._buffer, axis=0)
+        residuals = self._buffer - median
+        distances = np.stack([np.linalg.norm(residuals[:, :3], axis=1), np.linalg.norm(residuals[:, 3:], axis=1)])
+        threshold = self.n_sigmas * np.maximum(1.4826 * _median(distances, axis=1), self._floor)
+        residual = values - median
+        if (np.linalg.norm(residual[:3]) > threshold[0]) or (np.linalg.norm(residual[3:]) > threshold[1]):
+            self.rejected += 1
+            if not self.replace:
+                return None
+            probe = _make_probe(probe, median.tolist())
+        return probe
+
+
+class _LowPass:
+    def __init__(self):
+        self.value = None
+
+    def __call__(self, x, alpha):
+        self.value = x if self.value is None else alpha * x + (1 - alpha) * self.value
+        return self.value
+
+
+def _alpha(cutoff, dt):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuroFilter:
+    def __init__(self, min_cutoff=1.0, beta=0.5, d_cutoff=1.0, frame_rate=40.0):
+        """
+        One-Euro フィルタ (位置とクォータニオンの各成分に適用し、クォータニオンは正規化する)
+        min_cutoff: 静止時のカットオフ周波数 [Hz] (小さいほど強く平滑化する)
+        beta: 速度に応じてカットオフ周波数を上げる係数 (大きいほど動作時の遅れが小さい)
+        d_cutoff: 速度の推定に使うカットオフ周波数 [Hz]
+        frame_rate: 時刻が与えられない場合のサンプル周期の逆数 [Hz]
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.frame_rate = frame_rate
+        self.reset()
+
+    def reset(self):
+        self._x = _LowPass()
+        self._dx = _LowPass()
+        self._time = None
+
+    def filter(self, probe, time=None):
+        values = np.array(_probe_values(probe))
+        if time is None:
+            dt = 1.0 / self.frame_rate
+        elif self._time is None or time <= self._time:
+            dt = 1.0 / self.frame_rate
+        else:
+            dt = time - self._time
+        self._time = time
+
+        if self._x.value is None:
+            self._x(values, 1.0)
+            self._dx(np.zeros(7), 1.0)
+            return probe
+
+        dx = self._dx((values - self._x.value) / dt, _alpha(self.d_cutoff, dt))
+        # 位置は速さ [mm/s]、クォータニオンは成分の変化率の大きさでカットオフ周波数を決める
+        speed = np.array([np.linalg.norm(dx[:3])] * 3 + [np.linalg.norm(dx[3:]) * 100] * 4)
+        cutoff = self.min_cutoff + self.beta * speed
+        tau = 1.0 / (2 * np.pi * cutoff)
+        filtered = self._x(values, 1.0 / (1.0 + tau / dt))
+        filtered = filtered.copy()
+        filtered[3:] /= np.linalg.norm(filtered[3:])
+        return _make_probe(probe, filtered.tolist())
+
+
+class ProbeFilterChain:
+    def __init__(self, filters):
+        """
+        複数のフィルタを順に適用する
+        filters: filter(probe, time) と reset() を持つフィルタのリスト
+        """
+        self.filters = list(filters)
+        self.accepted = 0
+        self.rejected = 0
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+        self.accepted = 0
+        self.rejected = 0
+
+    def filter(self, probe, time=None):
+        """
+        1サンプルを処理する
+        time: 計測時刻 [秒] (省略時は probe.time_stamp)
+        戻り値: フィルタ後の Probe (除いた場合は None)
+        """
+        if time is None:
+            time = probe.time_stamp
+        for f in self.filters:
+            probe = f.filter(probe, time)
+            if probe is None:
+                self.rejected += 1
+                return None
+        self.accepted += 1
+        return probe
+
+
+def make_probe_filter(max_quality=None, hampel_window=7, smoothing=True, min_cutoff=1.0, beta=0.5):
+    """
+    標準的なフィルタの組み合わせ (QualityGate → HemisphereContinuity → HampelFilter → OneEuroFilter)
+    smoothing: False の場合は One-Euro による平滑化を行わない (キャリブレーション用の収集では遅れが出るため使わない)
+    """
+    filters = [QualityGate(max_quality), HemisphereContinuity(), HampelFilter(window=hampel_window)]
+    if smoothing:
+        filters.append(OneEuroFilter(min_cutoff=min_cutoff, beta=beta))
+    return ProbeFilterChain(filters)
+
+
+class PortFilters:
+    def __init__(self, factory=make_probe_filter, **kwargs):
+        """
+        ポートごとに別のフィルタを持つ
+        factory: ポートごとのフィルタ (ProbeFilterChain) を作る関数
+        kwargs: factory に渡す引数
+        """
+        self.factory = factory
+        self.kwargs = kwargs
+        self.chains = {}
+
+    def filter(self, probes, time=None):
+        """generateProbe の戻り値 (全ポート) を処理する。戻り値: ポートごとの Probe または None のリスト"""
+        results = []
+        for probe in probes:
+            chain = self.chains.get(probe.port_number)
+            if chain is None:
+                chain = self.chains[probe.port_number] = self.factory(**self.kwargs)
+            results.append(chain.filter(probe, time))
+        return results
+
+
+def filter_frame_block(probe_filter, block, port_index=0):
+    """
+    AuroraReader の FrameBlock の各フレームを順にフィルタに通す
+    戻り値: 残ったフレームの (受信時刻, Probe) のリスト
+    """
+    results = []
+    for i in range(len(block)):
+        time = float(block.host_times[i])
+        probe = probe_filter.filter(generateProbe(block.frame(i))[port_index], time)
+        if probe is not None:
+            results.append((time, probe))
+    return results
@@ -0,0 +1,286 @@
+# ロボットの移動後・データ取得後の待機方法 (セトリングポリシー)
+#
+# - FixedSettling: 移動後・取得後に決まった時間だけ待つ (従来の time.sleep(2), time.sleep(1) と同じ)
+# - AdaptiveSettling: 移動後、Auroraの連続するフレームの位置・姿勢が許容範囲内で一致するまで待つ
+# - StabilitySettling: 移動後、直近のフレームのばらつき (標準偏差) が閾値以下になるまで待つ (StabilityDetector)
+#
+# 各ポリシーは移動後の待機時間を settle_times に記録する
+#
+# 待機には clock (RealClock / VirtualClock) を使う
+# VirtualClock を使うと待機せずに仮想時刻だけが進むため、シミュレーションが一瞬で終わる
+
+import numpy as np
+from calibration.logger import get_logger
+from .clock import VirtualClock
+from .initialization import get_clock
+from .pose_formatter import generateProbe
+
+SETTLING_MODES = ("real", "virtual", "adaptive", "stability")
+
+log = get_logger(__name__)
+
+
+class _SettlingPolicy:
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else get_clock()
+        # 各点の移動後の待機時間 [秒]
+        self.settle_times = []
+
+    def _record(self, settle_time):
+        self.settle_times.append(settle_time)
+        return settle_time
+
+    def print_summary(self):
+        """移動後の待機時間の統計を表示する"""
+        if not self.settle_times:
+            return
+        settle_times = np.array(self.settle_times)
+        log.info("移動後の待機時間: 平均 %.3f 秒, 最大 %.3f 秒, 合計 %.1f 秒 (%d 点)",
+                 settle_times.mean(), settle_times.max(), settle_times.sum(), len(settle_times))
+
+
+class FixedSettling(_SettlingPolicy):
+    def __init__(self, settle_time=2.0, sample_interval=1.0, clock=None):
+        """
+        決まった時間だけ待つセトリングポリシー
+        settle_time: 移動後の待機時間 [秒]
+        sample_interval: データ取得後の待機時間 [秒]
+        clock: 待機に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+        """
+        super().__init__(clock)
+        self.settle_time = settle_time
+        self.sample_interval = sample_interval
+
+    def wait_after_move(self, aurora):
+        """移動後に待機する。戻り値: 待機時間 [秒]"""
+        self.clock.sleep(self.settle_time)
+        return self._record(self.settle_time)
+
+    def wait_after_sample(self, duration=None):
+        """データ取得後に待機する (duration を指定した場合はその時間)"""
+        duration = self.sample_interval if duration is None else duration
+        self.clock.sleep(duration)
+        return duration
+
+
+class AdaptiveSettling(_SettlingPolicy):
+    def __init__(self, position_tolerance=0.2, rotation_tolerance_deg=0.2, consecutive_frames=3,
+                 timeout=3.0, poll_interval=0.025, port_index=0, clock=None):
+        """
+        Auroraの連続するフレームが一致するまで待つセトリングポリシー
+        position_tolerance: 連続するフレーム間の位置の差の許容値 [mm]
+        rotation_tolerance_deg: 連続するフレーム間の回転の差の許容値 [度]
+            (静止していてもフレーム間の差には計測ノイズの約2.5倍が現れるため、Auroraのノイズより十分大きくする)
+        consecutive_frames: 許容範囲内で一致する必要がある連続フレーム数
+        timeout: 最大待機時間 [秒] (超えた場合は警告を表示して続行する)
+        poll_interval: フレームを取得する間隔 [秒] (Auroraのフレーム周期程度)
+        port_index: 判定に使うプローブの番号 (0: アームのセンサー)
+        clock: 待機に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+        """
+        super().__init__(clock)
+        self.position_tolerance = position_tolerance
+        self.rotation_tolerance_deg = rotation_tolerance_deg
+        self.consecutive_frames = consecutive_frames
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.port_index = port_index
+
+    def wait_after_move(self, aurora):
+        """
+        連続する consecutive_frames 個のフレームが許容範囲内で一致するまで待つ
+        戻り値: 待機時間 [秒]
+        """
+        start = self.clock.now()
+        previous = None
+        previous_frame_number = None
+        agreed = 0
+
+        while True:
+            probe = generateProbe(aurora.get_frame())[self.port_index]
+            elapsed = self.clock.now() - start
+
+            # 同じフレームを2回読んだ場合は判定に使わない
+            if probe.frame_numbers != previous_frame_number:
+                previous_frame_number = probe.frame_numbers
+                position = np.array([probe.pos.x, probe.pos.y, probe.pos.z])
+                quat = np.array([probe.quat.w, probe.quat.x, probe.quat.y, probe.quat.z])
+
+                if previous is not None and np.all(np.isfinite(position)):
+                    delta_t = np.linalg.norm(position - previous[0])
+                    # 2つのクォータニオンのなす角
+                    delta_angle = np.degrees(2 * np.arccos(min(abs(np.dot(quat, previous[1])), 1.0)))
+                    if delta_t <= self.position_tolerance and delta_angle <= self.rotation_tolerance_deg:
+                        agreed += 1
+                    else:
+                        agreed = 0
+                previous = (position, quat)
+
+                if agreed >= self.consecutive_frames:
+                    return self._record(elapsed)
+
+            if elapsed >= self.timeout:
+                log.warning("警告: %.1f 秒以内にAuroraの計測値が安定しませんでした", self.timeout)
+                return self._record(elapsed)
+
+            self.clock.sleep(self.poll_interval)
+
+    def wait_after_sample(self, duration=None):
+        """取得後の待機は不要なため何もしない"""
+        return 0.0
+
+
+class StabilityDetector:
+    def __init__(self, window=8, position_tolerance=0.03, rotation_tolerance_deg=0.03, max_quality=None,
+                 timeout=3.0, frame_rate=40.0, port_index=0, clock=None):
+        """
+        直近 window フレームの位置・姿勢のばらつきから計測値が安定したかを判定する
+        window: 判定に使うフレーム数 (リングバッファの長さ)
+        position_tolerance: 位置の標準偏差 (平均位置からの二乗平均平方根距離) の閾値 [mm]
+        rotation_tolerance_deg: 回転の標準偏差 (平均姿勢からの二乗平均平方根角度) の閾値 [度]
+        max_quality: 品質値 (エラー指標) の上限 (省略時は判定しない)
+        timeout: 最大待機時間 [秒]
+        frame_rate: Auroraのフレームレート [Hz] (この周期でフレームを取得する)
+        port_index: 判定に使うプローブの番号 (0: アームのセンサー)
+        clock: 待機に使うクロック (省略時は実時間、シミュレータ使用時はそのクロック)
+        """
+        self.window = window
+        self.position_tolerance = position_tolerance
+        self.rotation_tolerance_deg = rotation_tolerance_deg
+        self.max_quality = max_quality
+        self.timeout = timeout
+        self.frame_rate = frame_rate
+        self.port_index = port_index
+        self.clock = clock if clock is not None else get_clock()
+
+        # リングバッファ (毎回確保し直さない)
+        self._positions = np.zeros((window, 3))
+        self._quats = np.zeros((window, 4))
+        self._qualities = np.zeros(window)
+        self._count = 0
+        self._next = 0
+
+        # 直近の判定値
+        self.position_std = np.inf
+        self.rotation_std_deg = np.inf
+
+    def reset(self):
+        self._count = 0
+        self._next = 0
+        self.position_std = np.inf
+        self.rotation_std_deg = np.inf
+
+    def add(self, position, quat, quality):
+        """
+        1フレーム分の計測値を追加する
+        position: [x, y, z], quat: [w, x, y, z], quality: 品質値
+        戻り値: 安定しているかどうか
+        """
+        self._positions[self._next] = position
+        self._quats[self._next] = quat
+        self._qualities[self._next] = quality
+        self._next = (self._next + 1) % self.window
+        self._count = min(self._count + 1, self.window)
+        return self.is_stable()
+
+    def is_stable(self):
+        if self._count < self.window:
+            return False
+        positions, quats, qualities = self._positions, self._quats, self._qualities
+        if not (np.all(np.isfinite(positions)) and np.all(np.isfinite(quats))):
+            return False
+        if self.max_quality is not None and np.any(~(qualities <= self.max_quality)):
+            return False
+
+        self.position_std = np.sqrt(np.mean(np.sum((positions - positions.mean(axis=0)) ** 2, axis=1)))
+
+        # q と -q は同じ回転なので符号をそろえてから平均をとる
+        signs = np.where(quats @ quats[0] < 0, -1.0, 1.0)
+        aligned = quats * signs[:, None]
+        mean_quat = aligned.mean(axis=0)
+        mean_quat /= np.linalg.norm(mean_quat)
+        angles = 2 * np.arccos(np.clip(np.abs(aligned @ mean_quat), 0.0, 1.0))
+        self.rotation_std_deg = np.degrees(np.sqrt(np.mean(angles ** 2)))
+
+        return self.position_std <= self.position_tolerance and self.rotation_std_deg <= self.rotation_tolerance_deg
+
+    def wait(self, aurora):
+        """
+        計測値が安定するまでフレームレートの周期でAuroraのフレームを取得する
+        戻り値: (待機時間 [秒], 安定したかどうか)
+        """
+        self.reset()
+        start = self.clock.now()
+        previous_frame_number = None
+        period = 1.0 / self.frame_rate
+
+        while True:
+            probe = generateProbe(aurora.get_frame())[self.port_index]
+            elapsed = self.clock.now() - start
+
+            # 同じフレームを2回読んだ場合はバッファに入れない
+            if probe.frame_numbers != previous_frame_number:
+                previous_frame_number = probe.frame_numbers
+                stable = self.add([probe.pos.x, probe.pos.y, probe.pos.z],
+                                  [probe.quat.w, probe.quat.x, probe.quat.y, probe.quat.z],
+                                  probe.quality)
+                if stable:
+                    return elapsed, True
+
+            if elapsed >= self.timeout:
+                return elapsed, False
+
+            self.clock.sleep(period)
+
+
+class StabilitySettling(_SettlingPolicy):
+    def __init__(self, clock=None, **kwargs):
+        """
+        StabilityDetector で計測値が安定するまで待つセトリングポリシー
+        kwargs: StabilityDetector に渡す引数 (window, position_tolerance, rotation_tolerance_deg, max_quality, timeout など)
+        """
+        super().__init__(clock)
+        self.detector = StabilityDetector(clock=self.clock, **kwargs)
+        self.timeouts = 0
+
+    def wait_after_move(self, aurora):
+        """計測値が安定するまで待つ。戻り値: 待機時間 [秒]"""
+        settle_time, stable = self.detector.wait(aurora)
+        if not stable:
+            self.timeouts += 1
+            log.warning("警告: %.1f 秒以内にAuroraの計測値が安定しませんでした "
+                        "(位置の標準偏差: %.3f mm, 回転の標準偏差: %.3f 度)",
+                        self.detector.timeout, self.detector.position_std, self.detector.rotation_std_deg)
+        return self._record(settle_time)
+
+    def wait_after_sample(self, duration=None):
+        """取得後の待機は不要なため何もしない"""
+        return 0.0
+
+    def print_summary(self):
+        super().print_summary()
+        if self.timeouts:
+            log.info("  タイムアウトした点: %d", self.timeouts)
+
+
+def make_settling_policy(mode="real", clock=None, **kwargs):
+    """
+    セトリングポリシーを作成する
+    mode: "real" (実時間で固定時間待つ), "virtual" (仮想時刻を進めるだけで待たない),
+          "adaptive" (Auroraの連続するフレームが一致するまで待つ),
+          "stability" (直近のフレームのばらつきが閾値以下になるまで待つ)
+    clock: 待機に使うクロック
+    kwargs: 各ポリシーのコンストラクタに渡す引数
+    """
+    if mode == "real":
+        return FixedSettling(clock=clock, **kwargs)
+    if mode == "virtual":
+        if clock is None:
+            clock = get_clock()
+        if not isinstance(clock, VirtualClock):
+            clock = VirtualClock(clock.now())
+        return FixedSettling(clock=clock, **kwargs)
+    if mode == "adaptive":
+        return AdaptiveSettling(clock=clock, **kwargs)
+    if mode == "stability":
+        return StabilitySettling(clock=clock, **kwargs)
+    raise ValueError(f"不明なセトリングモードです: {mode} (選択肢: {', '.join(SETTLING_MODES)})")
@@ -0,0 +1,411 @@
+# 実機なしで収集・評価・手術ループを動かすためのロボットアーム (xArm) と Aurora のシミュレータ
+#
+# SimulatedRig が真値の T_aurora_from_robot / T_arm_from_sensor を持ち、
+# アームの姿勢からセンサーの姿勢を計算して Aurora のフレームとして返す
+#   T_sensor_from_aurora = inv(T_aurora_from_robot) @ T_arm_from_robot @ inv(T_arm_from_sensor)
+#
+# - SimulatedXArm: get_position / get_position_aa / set_position / set_position_aa など
+#   xArm SDK (XArmAPI) と同じ呼び出し方・戻り値 (code, [値]) を持つ
+#   指令後 command_latency 秒で動き出し、speed [mm/s] と angular_speed [度/s] から決まる時間で目標に到達する
+#   (xArm と同じく、位置が変わらず姿勢だけが変わる指令では speed を回転速度 [度/s] として扱う)
+#   wait=False の指令はキューに積まれ、前の動作の後に順に実行される (mode 7 では前の指令を置き換える)
+#   mode 1 (サーボモード) の set_servo_cartesian_aa は command_latency 秒後に目標姿勢になる
+# - SimulatedAurora: NDITracker と同じ形式のフレーム
+#   (port_handles, time_stamps, frame_numbers, tracking, quality) を返す
+#   ポート0がアームのセンサー、ポート1が上側プローブ
+#   位置・回転のノイズ、フレームレート、通信遅延、停止直後の減衰振動を設定できる
+#
+# 時刻は clock (RealClock / VirtualClock) から取得する
+# VirtualClock を使うと待機が一瞬で終わるため、パイプライン全体を高速に実行できる
+
+import threading
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from .clock import RealClock
+
+# 実機のキャリブレーション結果 (20260205) に近い真値
+DEFAULT_T_AURORA_FROM_ROBOT = np.eye(4)
+DEFAULT_T_AURORA_FROM_ROBOT[:3, :3] = R.from_euler('zyx', [180, 2, 180], degrees=True).as_matrix()
+DEFAULT_T_AURORA_FROM_ROBOT[:3, 3] = [145.0, -9.0, -410.0]
+
+DEFAULT_T_ARM_FROM_SENSOR = np.eye(4)
+DEFAULT_T_ARM_FROM_SENSOR[:3, :3] = R.from_euler('zyx', [-140, -1, 180], degrees=True).as_matrix()
+DEFAULT_T_ARM_FROM_SENSOR[:3, 3] = [0.5, 0.4, 1.2]
+
+# 上側プローブ (頭蓋骨に固定) の Aurora 座標系での姿勢
+DEFAULT_T_UPPER_FROM_AURORA = np.eye(4)
+DEFAULT_T_UPPER_FROM_AURORA[:3, 3] = [0.0, 0.0, -250.0]
+
+# ロボットの初期姿勢 [x, y, z, roll, pitch, yaw]
+DEFAULT_INITIAL_POSE = [155.0, 0.0, -250.0, 0.0, 0.0, 180.0]
+
+
+class _MotionSegment:
+    def __init__(self, t_start, duration, p_start, r_start, p_end, r_end):
+        """t_start から duration 秒かけて (p_start, r_start) から (p_end, r_end) へ直線・SLERP補間で動く区間"""
+        self.t_start = t_start
+        self.duration = duration
+        self.t_end = t_start + duration
+        self.p_start = p_start
+        self.r_start = r_start
+        self.p_end = p_end
+        self.r_end = r_end
+        self._delta_rotvec = (r_start.inv() * r_end).as_rotvec()
+
+    def pose_at(self, t):
+        if self.duration <= 0:
+            alpha = 1.0 if t >= self.t_start else 0.0
+        else:
+            alpha = min(max((t - self.t_start) / self.duration, 0.0), 1.0)
+        p = self.p_start + alpha * (self.p_end - self.p_start)
+        r = self.r_start * R.from_rotvec(alpha * self._delta_rotvec)
+        return p, r
+
+
+class SimulatedXArm:
+    def __init__(self, rig, initial_pose=None):
+        """
+        xArm SDK (XArmAPI) の代わりに使うシミュレータ
+        rig: SimulatedRig
+        initial_pose: 初期姿勢 [x, y, z, roll, pitch, yaw] (mm, 度)
+        """
+        if initial_pose is None:
+            initial_pose = DEFAULT_INITIAL_POSE
+        self.rig = rig
+        self.connected = False
+        self.mode = 0
+        self.state = 0
+        self.motion_enabled = False
+
+        self._position = np.array(initial_pose[:3], dtype=np.float64)
+        self._rotation = R.from_euler('xyz', initial_pose[3:6], degrees=True)
+        self._segments = []
+        self._last_speed = rig.default_speed
+
+        # 最後に停止した時刻と動作方向 (停止直後の振動の計算に使う)
+        self._stop_time = None
+        self._stop_direction = np.zeros(3)
+
+    # --- 接続・状態 ---
+    def connect(self):
+        self.connected = True
+        return 0
+
+    def disconnect(self):
+        self.connected = False
+        return 0
+
+    def clean_warn(self):
+        return 0
+
+    def clean_error(self):
+        return 0
+
+    def motion_enable(self, enable=True):
+        self.motion_enabled = enable
+        return 0
+
+    def set_mode(self, mode=0):
+        self.mode = mode
+        return 0
+
+    def set_state(self, state=0):
+        self.state = state
+        if state == 4:
+            # 停止: キューに積まれた動作を破棄する
+            with self.rig.lock:
+                now = self.rig.clock.now()
+                self._position, self._rotation = self._commanded_pose(now)
+                self._segments = []
+        return 0
+
+    def get_is_moving(self):
+        with self.rig.lock:
+            now = self.rig.clock.now()
+            self._prune(now)
+            return any(segment.t_end > now for segment in self._segments)
+
+    # --- 姿勢の取得 ---
+    def get_position(self, is_radian=None):
+        """戻り値: (0, [x, y, z, roll, pitch, yaw])"""
+        with self.rig.lock:
+            p, r = self._commanded_pose(self.rig.clock.now())
+        return 0, list(p) + list(r.as_euler('xyz', degrees=not is_radian))
+
+    def get_position_aa(self, is_radian=None):
+        """戻り値: (0, [x, y, z, rx, ry, rz]) (回転ベクトル)"""
+        with self.rig.lock:
+            p, r = self._commanded_pose(self.rig.clock.now())
+        return 0, list(p) + list(r.as_rotvec(degrees=not is_radian))
+
+    # --- 移動指令 ---
+    def set_position(self, x=None, y=None, z=None, roll=None, pitch=None, yaw=None, radius=None,
+                     speed=None, mvacc=None, mvtime=None, relative=False, is_radian=None,
+                     wait=False, timeout=None, **kwargs):
+        """直交座標 + ロール・ピッチ・ヨーで目標姿勢を指令する (None の成分は現在の目標値のまま)"""
+        with self.rig.lock:
+            p_last, r_last = self._target_pose()
+            rpy_last = r_last.as_euler('xyz', degrees=not is_radian)
+            values = [x, y, z, roll, pitch, yaw]
+            current = list(p_last) + list(rpy_last)
+            if relative:
+                target = [c + (v or 0.0) for c, v in zip(current, values)]
+            else:
+                target = [c if v is None else v for c, v in zip(current, values)]
+            r_target = R.from_euler('xyz', target[3:], degrees=not is_radian)
+            t_end = self._enqueue(np.array(target[:3], dtype=np.float64), r_target, speed)
+        if wait:
+            self._wait_until(t_end)
+        return 0
+
+    def set_position_aa(self, axis_angle_pose, speed=None, mvacc=None, mvtime=None, is_radian=None,
+                        is_tool_coord=False, relative=False, wait=False, timeout=None, **kwargs):
+        """直交座標 + 回転ベクトルで目標姿勢を指令する"""
+        with self.rig.lock:
+            p_target, r_target = self._axis_angle_target(axis_angle_pose, is_radian, is_tool_coord, relative)
+            t_end = self._enqueue(p_target, r_target, speed)
+        if wait:
+            self._wait_until(t_end)
+        return 0
+
+    def set_servo_cartesian_aa(self, axis_angle_pose, speed=None, mvacc=None, is_radian=None,
+                               is_tool_coord=False, relative=False, **kwargs):
+        """
+        サーボモード (mode 1) で目標姿勢を指令する (補間せず、command_latency 秒後に目標姿勢になる)
+        """
+        if self.mode != 1:
+            return 1
+        with self.rig.lock:
+            now = self.rig.clock.now()
+            p_target, r_target = self._axis_angle_target(axis_angle_pose, is_radian, is_tool_coord, relative)
+            self._prune(now)
+            if self._segments:
+                # 遅延中の指令の後に反映される
+                p_start, r_start = self._segments[-1].p_end, self._segments[-1].r_end
+            else:
+                p_start, r_start = self._position.copy(), self._rotation
+            self._segments.append(_MotionSegment(now + self.rig.command_latency, 0.0, p_start, r_start,
+                                                 p_target, r_target))
+        return 0
+
+    # --- 内部処理 ---
+    def _axis_angle_target(self, axis_angle_pose, is_radian, is_tool_coord, relative):
+        p_last, r_last = self._target_pose()
+        p = np.array(axis_angle_pose[:3], dtype=np.float64)
+        r = R.from_rotvec(axis_angle_pose[3:6], degrees=not is_radian)
+        if is_tool_coord:
+            return p_last + r_last.apply(p), r_last * r
+        if relative:
+            return p_last + p, r * r_last
+        return p, r
+
+    def _prune(self, now):
+        """終了した動作区間を取り除き、停止姿勢を更新する"""
+        while self._segments and self._segments[0].t_end <= now:
+            segment = self._segments.pop(0)
+            self._position, self._rotation = segment.p_end, segment.r_end
+            direction = segment.p_end - segment.p_start
+            norm = np.linalg.norm(direction)
+            if norm > 0:
+                self._stop_direction = direction / norm
+            self._stop_time = segment.t_end
+
+    def _commanded_pose(self, t):
+        """時刻 t における指令姿勢 (エンコーダ上の姿勢)"""
+        self._prune(t)
+        for segment in self._segments:
+            if t < segment.t_end:
+                return segment.pose_at(t)
+        return self._position.copy(), self._rotation
+
+    def _target_pose(self):
+        """キューに積まれた最後の目標姿勢"""
+        self._prune(self.rig.clock.now())
+        if self._segments:
+            return self._segments[-1].p_end.copy(), self._segments[-1].r_end
+        return self._position.copy(), self._rotation
+
+    def _enqueue(self, p_target, r_target, speed):
+        now = self.rig.clock.now()
+        if speed is not None:
+            self._last_speed = speed
+
+        if self.mode == 7:
+            # オンライン軌道計画モード: 現在の動作を新しい指令で置き換える
+            self._position, self._rotation = self._commanded_pose(now)
+            self._segments = []
+
+        self._prune(now)
+        if self._segments:
+            t_start = self._segments[-1].t_end
+            p_start, r_start = self._segments[-1].p_end, self._segments[-1].r_end
+        else:
+            t_start = now + self.rig.command_latency
+            p_start, r_start = self._position.copy(), self._rotation
+
+        distance = np.linalg.norm(p_target - p_start)
+        angle = np.degrees((r_start.inv() * r_target).magnitude())
+        if distance < 1e-6:
+            # 姿勢だけが変わる指令: speed は回転速度 [度/s]
+            duration = angle / min(self._last_speed, self.rig.angular_speed)
+        else:
+            duration = max(distance / self._last_speed, angle / self.rig.angular_speed)
+        segment = _MotionSegment(t_start, duration, p_start, r_start, p_target, r_target)
+        self._segments.append(segment)
+        return segment.t_end
+
+    def _wait_until(self, t_end):
+        self.rig.clock.sleep(t_end - self.rig.clock.now())
+
+    def physical_pose(self, t):
+        """
+        時刻 t におけるアームの実際の姿勢 (停止直後の減衰振動を含む)
+        戻り値: (位置 (3,), scipy Rotation)
+        """
+        p, r = self._commanded_pose(t)
+        moving = any(segment.t_start <= t < segment.t_end for segment in self._segments)
+        if not moving and self._stop_time is not None and self.rig.settle_amplitude > 0:
+            elapsed = t - self._stop_time
+            if elapsed >= 0:
+                offset = (self.rig.settle_amplitude * np.exp(-elapsed / self.rig.settle_time_constant)
+                          * np.sin(2 * np.pi * self.rig.settle_frequency * elapsed))
+                p = p + offset * self._stop_direction
+        return p, r
+
+
+class SimulatedAurora:
+    PORT_HANDLES = [10, 11]
+
+    def __init__(self, rig):
+        """
+        NDITracker の代わりに使うシミュレータ
+        rig: SimulatedRig
+        """
+        self.rig = rig
+        self.tracking = False
+
+    def start_tracking(self):
+        self.tracking = True
+
+    def stop_tracking(self):
+        self.tracking = False
+
+    def close(self):
+        self.tracking = False
+
+    def get_frame(self):
+        """
+        最新のフレームを返す (NDITracker.get_frame と同じ形式)
+        tracking[i] は (1, 7) の配列 [qw, qx, qy, qz, x, y, z]
+        測定範囲外の場合は tracking, quality が NaN になる
+        """
+        rig = self.rig
+        clock = rig.clock
+        # 最後に計測されたフレーム
+        frame_number = int(np.floor(clock.now() * rig.frame_rate))
+        t_frame = frame_number / rig.frame_rate
+        with rig.lock:
+            T_sensor = rig.sensor_pose(t_frame)
+            T_upper = rig.upper_probe_pose(t_frame)
+            trackings = [rig.measure(T_sensor), rig.measure(T_upper)]
+
+        # シリアル通信の遅延
+        clock.sleep(rig.frame_latency)
+        time_stamp = clock.now()
+
+        n_ports = len(self.PORT_HANDLES)
+        tracking = [t for t, _ in trackings]
+        quality = [q for _, q in trackings]
+        return (list(self.PORT_HANDLES), [time_stamp] * n_ports, [frame_number] * n_ports, tracking, quality)
+
+
+class SimulatedRig:
+    def __init__(self, T_aurora_from_robot=None, T_arm_from_sensor=None, T_upper_from_aurora=None,
+                 clock=None, position_noise=0.0, rotation_noise_deg=0.0, quality=0.1,
+                 default_speed=100.0, angular_speed=90.0, command_latency=0.05,
+                 frame_rate=40.0, frame_latency=0.02,
+                 settle_amplitude=0.0, settle_time_constant=0.3, settle_frequency=4.0,
+                 measurement_radius=None, initial_pose=None, seed=None):
+        """
+        シミュレーション用のロボット・Aurora一式
+        T_aurora_from_robot: 真値の4x4同次変換行列 (省略時は DEFAULT_T_AURORA_FROM_ROBOT)
+        T_arm_from_sensor: 真値の4x4同次変換行列 (省略時は DEFAULT_T_ARM_FROM_SENSOR)
+        T_upper_from_aurora: 上側プローブの姿勢。4x4行列、または時刻を受け取り4x4行列を返す関数
+        clock: RealClock / VirtualClock (省略時は RealClock)
+        position_noise: Aurora位置のガウスノイズの標準偏差 [mm]
+        rotation_noise_deg: Aurora回転のガウスノイズの標準偏差 (回転ベクトル各成分) [度]
+        quality: Auroraの品質値 (エラー指標) の平均
+        default_speed: set_position で speed を省略した場合の速度 [mm/s]
+        angular_speed: 回転速度の上限 [度/s]
+        command_latency: 指令から動き出すまでの遅延 [秒]
+        frame_rate: Auroraのフレームレート [Hz]
+        frame_latency: get_frame() の通信遅延 [秒]
+        settle_amplitude: 停止直後の振動の振幅 [mm] (0 の場合は振動しない)
+        settle_time_constant: 振動の減衰時定数 [秒]
+        settle_frequency: 振動の周波数 [Hz]
+        measurement_radius: Aurora原点からの測定可能範囲の半径 [mm] (省略時は無制限)
+        initial_pose: ロボットの初期姿勢 [x, y, z, roll, pitch, yaw]
+        seed: 乱数のシード
+        """
+        self.T_aurora_from_robot = np.array(
+            DEFAULT_T_AURORA_FROM_ROBOT if T_aurora_from_robot is None else T_aurora_from_robot, dtype=np.float64)
+        self.T_arm_from_sensor = np.array(
+            DEFAULT_T_ARM_FROM_SENSOR if T_arm_from_sensor is None else T_arm_from_sensor, dtype=np.float64)
+        self.T_upper_from_aurora = DEFAULT_T_UPPER_FROM_AURORA if T_upper_from_aurora is None else T_upper_from_aurora
+        self.clock = clock if clock is not None else RealClock()
+
+        self.position_noise = position_noise
+        self.rotation_noise_deg = rotation_noise_deg
+        self.quality = quality
+        self.default_speed = default_speed
+        self.angular_speed = angular_speed
+        self.command_latency = command_latency
+        self.frame_rate = frame_rate
+        self.frame_latency = frame_latency
+        self.settle_amplitude = settle_amplitude
+        self.settle_time_constant = settle_time_constant
+        self.settle_frequency = settle_frequency
+        self.measurement_radius = measurement_radius
+
+        self.rng = np.random.default_rng(seed)
+        # アームとAuroraを別スレッドから同時に呼び出せるよう共有のロックを使う
+        self.lock = threading.RLock()
+
+        self._robot_from_aurora = np.linalg.inv(self.T_aurora_from_robot)
+        self._sensor_from_arm = np.linalg.inv(self.T_arm_from_sensor)
+
+        self.arm = SimulatedXArm(self, initial_pose)
+        self.aurora = SimulatedAurora(self)
+
+    def sensor_pose(self, t):
+        """時刻 t におけるセンサーの真の姿勢 T_sensor_from_aurora (4x4)"""
+        p, r = self.arm.physical_pose(t)
+        T_arm_from_robot = np.eye(4)
+        T_arm_from_robot[:3, :3] = r.as_matrix()
+        T_arm_from_robot[:3, 3] = p
+        return self._robot_from_aurora @ T_arm_from_robot @ self._sensor_from_arm
+
+    def upper_probe_pose(self, t):
+        """時刻 t における上側プローブの真の姿勢 (4x4)"""
+        if callable(self.T_upper_from_aurora):
+            return np.asarray(self.T_upper_from_aurora(t), dtype=np.float64)
+        return np.asarray(self.T_upper_from_aurora, dtype=np.float64)
+
+    def measure(self, T):
+        """
+        真の姿勢にノイズを加えて Aurora の計測値にする
+        戻り値: (tracking (1, 7) [qw, qx, qy, qz, x, y, z], quality)
+        """
+        position = T[:3, 3].copy()
+        if self.measurement_radius is not None and np.linalg.norm(position) > self.measurement_radius:
+            return np.full((1, 7), np.nan), np.nan
+
+        rotation = R.from_matrix(T[:3, :3])
+        if self.position_noise > 0:
+            position += self.rng.normal(0, self.position_noise, 3)
+        if self.rotation_noise_deg > 0:
+            rotation = R.from_rotvec(self.rng.normal(0, self.rotation_noise_deg, 3), degrees=True) * rotation
+
+        qx, qy, qz, qw = rotation.as_quat()
+        quality = abs(self.rng.normal(self.quality, 0.2 * self.quality))
+        return np.array([[qw, qx, qy, qz, position[0], position[1], position[2]]]), quality
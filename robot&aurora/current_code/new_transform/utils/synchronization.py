@@ -0,0 +1,225 @@
+# タイムスタンプ付きのロボット姿勢とAuroraのフレームから、同じ時刻の組を作る
+#
+# ロボットとAuroraは異なる時刻・周期で計測されるため、Auroraのフレームの時刻に合わせて
+# ロボット姿勢を補間する (位置は線形補間、回転はSLERP)
+# 補間はストリーム全体に対してまとめて (ベクトル化して) 計算する
+#
+# これにより、停止・待機せずに動きながら取得したデータからもキャリブレーション用の組を作れる
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from calibration.transformation_utils import slerp_quaternions
+
+
+def interpolate_poses(times, positions, quats, query_times, max_gap=None):
+    """
+    時系列の姿勢を指定した時刻で補間する
+    times: (N,) 単調増加の時刻 [秒]
+    positions: (N, 3) 位置
+    quats: (N, 4) クォータニオン [x, y, z, w]
+    query_times: (M,) 補間する時刻
+    max_gap: 補間に使う2点の時間間隔の上限 [秒] (これより離れている場合は無効とする)
+    戻り値: (位置 (M, 3), クォータニオン (M, 4), 有効かどうか (M,))
+            時系列の範囲外の時刻は無効 (値は端の姿勢)
+    """
+    times = np.asarray(times, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    quats = np.asarray(quats, dtype=np.float64)
+    query_times = np.asarray(query_times, dtype=np.float64)
+
+    if len(times) == 0:
+        return (np.full((len(query_times), 3), np.nan), np.full((len(query_times), 4), np.nan),
+                np.zeros(len(query_times), dtype=bool))
+    if len(times) == 1:
+        return (np.repeat(positions, len(query_times), axis=0), np.repeat(quats, len(query_times), axis=0),
+                query_times == times[0])
+
+    i0 = np.clip(np.searchsorted(times, query_times, side='right') - 1, 0, len(times) - 2)
+    i1 = i0 + 1
+    dt = times[i1] - times[i0]
+    alpha = np.clip((query_times - times[i0]) / np.where(dt > 0, dt, 1.0), 0.0, 1.0)
+
+    valid = (query_times >= times[0]) & (query_times <= times[-1]) & (dt > 0)
+    if max_gap is not None:
+        valid &= dt <= max_gap
+
+    interp_positions = positions[i0] + alpha[:, None] * (positions[i1] - positions[i0])
+    interp_quats = slerp_quaternions(quats[i0], quats[i1], alpha)
+    return interp_positions, interp_quats, valid
+
+
+def interval_velocities(times, positions, quats, query_times):
+    """
+    補間に使う2点の間の並進速度と角速度を求める (線形補間・SLERPと同じ区間ごとに一定の速度)
+    times, positions, quats, query_times: interpolate_poses と同じ
+    戻り値: (並進速度 [mm/s] (M,), 角速度 [度/s] (M,))
+    """
+    times = np.asarray(times, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    quats = np.asarray(quats, dtype=np.float64)
+    query_times = np.asarray(query_times, dtype=np.float64)
+    if len(times) < 2:
+        return np.zeros(len(query_times)), np.zeros(len(query_times))
+
+    i0 = np.clip(np.searchsorted(times, query_times, side='right') - 1, 0, len(times) - 2)
+    i1 = i0 + 1
+    dt = times[i1] - times[i0]
+    safe_dt = np.where(dt > 0, dt, np.inf)
+
+    speed = np.linalg.norm(positions[i1] - positions[i0], axis=1) / safe_dt
+    dot = np.abs(np.sum(quats[i0] * quats[i1], axis=1))
+    angle = np.degrees(2 * np.arccos(np.clip(dot, 0.0, 1.0)))
+    return speed, angle / safe_dt
+
+
+class PoseStream:
+    def __init__(self, capacity=1024):
+        """
+        タイムスタンプ付きの姿勢を保存するバッファ (容量が足りなくなったら2倍に拡張する)
+        capacity: 初期容量
+        """
+        self._times = np.empty(capacity)
+        self._positions = np.empty((capacity, 3))
+        self._quats = np.empty((capacity, 4))
+        self._quality = np.empty(capacity)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _reserve(self, n):
+        if self._count + n <= len(self._times):
+            return
+        capacity = max(2 * len(self._times), self._count + n)
+        for name in ("_times", "_positions", "_quats", "_quality"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:])
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+
+    def extend(self, times, positions, quats, quality=None):
+        """
+        複数の姿勢を追加する (時刻の順に追加すること)
+        times: (K,), positions: (K, 3), quats: (K, 4) [x, y, z, w], quality: (K,)
+        """
+        times = np.asarray(times, dtype=np.float64).reshape(-1)
+        n = len(times)
+        self._reserve(n)
+        s = slice(self._count, self._count + n)
+        self._times[s] = times
+        self._positions[s] = np.asarray(positions, dtype=np.float64).reshape(n, 3)
+        self._quats[s] = np.asarray(quats, dtype=np.float64).reshape(n, 4)
+        self._quality[s] = np.nan if quality is None else np.asarray(quality, dtype=np.float64).reshape(n)
+        self._count += n
+
+    def append(self, time, position, quat, quality=np.nan):
+        """1つの姿勢を追加する"""
+        self.extend([time], [position], [quat], [quality])
+
+    @property
+    def times(self):
+        return self._times[:self._count]
+
+    @property
+    def positions(self):
+        return self._positions[:self._count]
+
+    @property
+    def quats(self):
+        return self._quats[:self._count]
+
+    @property
+    def quality(self):
+        return self._quality[:self._count]
+
+    def interpolate(self, query_times, max_gap=None):
+        """指定した時刻の姿勢を補間する (interpolate_poses を参照)"""
+        return interpolate_poses(self.times, self.positions, self.quats, query_times, max_gap=max_gap)
+
+
+class StreamSynchronizer:
+    def __init__(self, tracker_latency=0.0, max_gap=0.2, capacity=1024):
+        """
+        ロボット姿勢とAuroraのフレームを時刻で対応付けるクラス
+        tracker_latency: Auroraの計測から受信までの遅延 [秒] (受信時刻からこの値を引いた時刻を計測時刻とする)
+        max_gap: ロボット姿勢の補間に使う2点の時間間隔の上限 [秒]
+        capacity: バッファの初期容量
+        """
+        self.tracker_latency = tracker_latency
+        self.max_gap = max_gap
+        self.robot = PoseStream(capacity)
+        self.tracker = PoseStream(capacity)
+
+    def add_robot_pose(self, time, arm_pose):
+        """
+        ロボット姿勢を追加する
+        time: 取得時刻 [秒]
+        arm_pose: arm.get_position_aa() の戻り値、または [x, y, z, rx, ry, rz] (回転ベクトル, 度)
+        """
+        if len(arm_pose) == 2:
+            arm_pose = arm_pose[1]
+        quat = R.from_rotvec(arm_pose[3:6], degrees=True).as_quat()
+        self.robot.append(time, arm_pose[:3], quat)
+
+    def add_probe(self, probe, time=None):
+        """
+        Auroraのプローブ (generateProbe の要素) を追加する
+        time: 受信時刻 [秒] (省略時は probe.time_stamp)
+        """
+        if time is None:
+            time = probe.time_stamp
+        self.tracker.append(time - self.tracker_latency,
+                            [probe.pos.x, probe.pos.y, probe.pos.z],
+                            [probe.quat.x, probe.quat.y, probe.quat.z, probe.quat.w],
+                            probe.quality)
+
+    def add_frame_block(self, block, port_index=0):
+        """AuroraReader の since() / window() で取得した FrameBlock をまとめて追加する"""
+        if block is None or len(block) == 0:
+            return
+        self.tracker.extend(block.host_times - self.tracker_latency, block.positions(port_index),
+                            block.quats(port_index), block.quality[:, port_index])
+
+    def aligned_pairs(self):
+        """
+        Auroraの各フレームの時刻にロボット姿勢を補間して組にする
+        ロボット姿勢の時系列の範囲外のフレームと、測定範囲外 (NaN) のフレームは除く
+        戻り値: dict
+            "time": (N,) 時刻
+            "robot_position": (N, 3), "robot_quat": (N, 4) [x, y, z, w]
+            "robot_speed": (N,) 並進速度 [mm/s], "robot_angular_speed": (N,) 角速度 [度/s]
+            "aurora_position": (N, 3), "aurora_quat": (N, 4) [x, y, z, w], "aurora_quality": (N,)
+        """
+        times = self.tracker.times
+        robot_positions, robot_quats, valid = self.robot.interpolate(times, max_gap=self.max_gap)
+        robot_speed, robot_angular_speed = interval_velocities(
+            self.robot.times, self.robot.positions, self.robot.quats, times)
+        valid &= np.all(np.isfinite(self.tracker.positions), axis=1)
+        valid &= np.all(np.isfinite(self.tracker.quats), axis=1)
+        return {
+            "time": times[valid],
+            "robot_position": robot_positions[valid],
+            "robot_quat": robot_quats[valid],
+            "robot_speed": robot_speed[valid],
+            "robot_angular_speed": robot_angular_speed[valid],
+            "aurora_position": self.tracker.positions[valid],
+            "aurora_quat": self.tracker.quats[valid],
+            "aurora_quality": self.tracker.quality[valid],
+        }
+
+    def aligned_rows(self, pairs=None):
+        """
+        aligned_pairs() をキャリブレーション用CSVと同じ14列の配列にする
+        [robot_x, robot_y, robot_z, robot_rx, robot_ry, robot_rz,
+         aurora_x, aurora_y, aurora_z, aurora_quat_x, aurora_quat_y, aurora_quat_z, aurora_quat_w, aurora_quality]
+        pairs: aligned_pairs() の戻り値 (一部を選んだもの) (省略時は全ての組)
+        """
+        if pairs is None:
+            pairs = self.aligned_pairs()
+        if len(pairs["time"]) == 0:
+            return np.empty((0, 14))
+        robot_rotvecs = R.from_quat(pairs["robot_quat"]).as_rotvec(degrees=True)
+        return np.column_stack([
+            pairs["robot_position"], robot_rotvecs,
+            pairs["aurora_position"], pairs["aurora_quat"], pairs["aurora_quality"],
+        ])
@@ -0,0 +1,156 @@
+# ワールド・ハンドアイキャリブレーション用の合成データをまとめて (ベクトル化して) 生成する
+#
+# 真値の変換 (Aurora → ロボット、センサー → アーム) から、ロボットアームの姿勢ごとに Aurora の計測値を計算する
+# 計算は create_sample_csv_*.py の1点ずつのループと同じ式を (N, 3, 3) の配列でまとめて行い、
+# 格子点は chunk_size 点ずつ作って出力ファイルに追記するため、メモリ使用量は点数によらず一定
+#
+# ノイズ (seed を与えると再現できる):
+# - add_noise: Aurora の位置に加えるガウスノイズの標準偏差 [mm]
+# - rotation_noise_deg: Aurora の姿勢に加える回転ノイズの標準偏差 [度]
+#   各軸 N(0, σ²) の回転ベクトルの回転をセンサー座標系で掛ける (SO(3) 上のノイズ、クォータニオンは単位のまま)
+# - add_quaternion_noise: 従来と同じく、クォータニオンの各成分にガウスノイズを加えて正規化する
+#
+# 出力は RowLogWriter で書き込む (.poselog はバイナリ形式で、数千万点でも数秒で書ける。CSV は小数点以下5桁)
+#
+# hand_eye_model=True の場合はセンサーの姿勢をアーム座標系で回転させる (R_sensor = R_arm @ R_sen2arm.T)
+# 従来の式 (R_sensor = R_sen2arm.T @ R_arm) はハンドアイキャリブレーションのモデル (T_arm = T_sensor @ X) と一致しないため、
+# 推定結果を真値 (true_T_arm_from_sensor) と比較する場合はこちらを使う
+
+import math
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from calibration.pose_log import POSE_LOG_COLUMNS
+from calibration.row_log import RowLogWriter
+from calibration.transformation_utils import Transform
+
+# 合成データの品質値 (固定)
+SYNTHETIC_QUALITY = 0.1
+
+
+def euler_rpy_to_matrix(rpy_deg):
+    """オイラー角 [roll, pitch, yaw] (度、固定軸回転zyx) から回転行列"""
+    return R.from_euler('zyx', [rpy_deg[2], rpy_deg[1], rpy_deg[0]], degrees=True).as_matrix()
+
+
+def grid_axis(value_range, step):
+    """範囲 (開始値, 終了値) を step 間隔でサンプリングした値 (終了値を含む)"""
+    return np.arange(value_range[0], value_range[1] + step / 2, step)
+
+
+def grid_size(axes):
+    """格子点の数"""
+    return math.prod(len(axis) for axis in axes)
+
+
+def uniform_poses(position_ranges, rotation_ranges, n_samples, rng):
+    """
+    範囲内で一様にランダムなアームの姿勢 (n_samples, 6) [x, y, z, rx, ry, rz]
+    position_ranges: x, y, z の範囲 [(開始値, 終了値)] * 3 (mm)
+    rotation_ranges: rx, ry, rz の範囲 [(開始値, 終了値)] * 3 (度、回転ベクトル)
+    rng: np.random.Generator
+    """
+    ranges = np.asarray(list(position_ranges) + list(rotation_ranges), dtype=np.float64)
+    return rng.uniform(ranges[:, 0], ranges[:, 1], (n_samples, 6))
+
+
+def iter_grid(axes, chunk_size=100000):
+    """
+    各軸の値の全ての組み合わせ (meshgrid(indexing='ij') と同じ順、最後の軸が最も速く変わる) を
+    (最大 chunk_size, 軸の数) の配列として順に返す
+    """
+    shape = tuple(len(axis) for axis in axes)
+    total = grid_size(axes)
+    for start in range(0, total, chunk_size):
+        indices = np.unravel_index(np.arange(start, min(start + chunk_size, total)), shape)
+        yield np.column_stack([np.asarray(axis, dtype=np.float64)[index] for axis, index in zip(axes, indices)])
+
+
+class SyntheticPoseGenerator:
+    def __init__(self, rotation_euler_deg_aur2rob, translation_vector_aur2rob, rotation_euler_deg_sen2arm=None,
+                 translation_vector_sen2arm=None, add_noise=0, add_quaternion_noise=0, rotation_noise_deg=0,
+                 seed=None, hand_eye_model=False):
+        """
+        rotation_euler_deg_aur2rob: Aurora座標系からロボット座標系へのオイラー角 [roll, pitch, yaw] (度)
+        translation_vector_aur2rob: Aurora座標系からロボット座標系への並進ベクトル [tx, ty, tz] (mm)
+        rotation_euler_deg_sen2arm: センサー座標系からアーム座標系へのオイラー角 [roll, pitch, yaw] (度)
+        translation_vector_sen2arm: センサー座標系からアーム座標系への並進ベクトル [tx, ty, tz] (mm)
+        add_noise: Aurora の位置に加えるガウスノイズの標準偏差 (mm)
+        add_quaternion_noise: クォータニオンの各成分に加えるガウスノイズの標準偏差 (従来の方法)
+        rotation_noise_deg: Aurora の姿勢に加える回転ノイズの標準偏差 (度、各軸)
+        seed: 乱数のシード (None の場合は毎回異なるノイズ)
+        hand_eye_model: True の場合はセンサーの姿勢をハンドアイキャリブレーションのモデルに合わせて計算する
+        """
+        self.R_aur2rob = euler_rpy_to_matrix(rotation_euler_deg_aur2rob)
+        self.t_aur2rob = np.asarray(translation_vector_aur2rob, dtype=np.float64)
+        self.R_sen2arm = euler_rpy_to_matrix(rotation_euler_deg_sen2arm if rotation_euler_deg_sen2arm is not None
+                                             else [0, 0, 0])
+        self.t_sen2arm = np.asarray(translation_vector_sen2arm if translation_vector_sen2arm is not None
+                                    else [0, 0, 0], dtype=np.float64)
+        self.add_noise = add_noise
+        self.add_quaternion_noise = add_quaternion_noise
+        self.rotation_noise_deg = rotation_noise_deg
+        self.hand_eye_model = hand_eye_model
+        self.rng = np.random.default_rng(seed)
+        # R_sensor_from_aurora = R_aur2rob.T @ R_sen2arm.T @ R_arm_from_robot の定数部分
+        self._R_fixed = self.R_aur2rob.T @ self.R_sen2arm.T
+
+    def true_T_aurora_from_robot(self):
+        """ワールドキャリブレーションの真値 (P_robot = T @ P_aurora)"""
+        return Transform(self.R_aur2rob, self.t_aur2rob).matrix
+
+    def true_T_arm_from_sensor(self):
+        """ハンドアイキャリブレーションの真値 (T_arm_from_robot = T_sensor_from_robot @ T、hand_eye_model=True の場合)"""
+        return Transform(self.R_sen2arm, -self.R_sen2arm @ self.t_sen2arm).matrix
+
+    def generate(self, robot_positions, robot_rotvecs_deg):
+        """
+        ロボットアームの姿勢から Aurora の計測値を計算する
+        robot_positions: (N, 3) アームの位置 [mm]
+        robot_rotvecs_deg: (N, 3) アームの回転ベクトル [度] (または全点で共通の (3,))
+        戻り値: (N, 14) の配列 (POSE_LOG_COLUMNS の並び)
+        """
+        positions = np.asarray(robot_positions, dtype=np.float64).reshape(-1, 3)
+        n = len(positions)
+        rotvecs = np.broadcast_to(np.asarray(robot_rotvecs_deg, dtype=np.float64).reshape(-1, 3), (n, 3))
+        R_arm_from_robot = R.from_rotvec(rotvecs, degrees=True).as_matrix()
+
+        # --- 姿勢の計算 ---
+        if self.hand_eye_model:
+            R_sensor_from_aurora = self.R_aur2rob.T @ R_arm_from_robot @ self.R_sen2arm.T
+        else:
+            R_sensor_from_aurora = self._R_fixed @ R_arm_from_robot
+        if self.rotation_noise_deg > 0:
+            noise = self.rng.normal(0, math.radians(self.rotation_noise_deg), (n, 3))
+            R_sensor_from_aurora = R_sensor_from_aurora @ R.from_rotvec(noise).as_matrix()
+        quats = R.from_matrix(R_sensor_from_aurora).as_quat()
+
+        # --- 位置の計算 ---
+        # sensor_pos_in_robot = arm_pos_in_robot + R_arm_from_robot @ T_sen2arm
+        sensor_positions = positions + R_arm_from_robot @ self.t_sen2arm
+        # Aurora = R_aur2rob.T @ (Robot - T_aur2rob) (行ベクトルでは (Robot - T_aur2rob) @ R_aur2rob)
+        aurora_positions = (sensor_positions - self.t_aur2rob) @ self.R_aur2rob
+
+        # ノイズの追加
+        if self.add_noise > 0:
+            aurora_positions += self.rng.normal(0, self.add_noise, (n, 3))
+        if self.add_quaternion_noise > 0:
+            noisy = quats + self.rng.normal(0, self.add_quaternion_noise, (n, 4))
+            norms = np.linalg.norm(noisy, axis=1, keepdims=True)
+            # ノルムが0になった場合は元のクォータニオンを使う
+            quats = np.where(norms > 0, noisy / np.where(norms > 0, norms, 1.0), quats)
+
+        return np.column_stack([positions, rotvecs, aurora_positions, quats, np.full(n, SYNTHETIC_QUALITY)])
+
+    def write(self, output_file, pose_chunks, decimal_places=5, fsync_every=1000000, integer_columns=()):
+        """
+        ロボットアームの姿勢のチャンクから計測値を計算し、出力ファイルに順に追記する
+        pose_chunks: (k, 6) [x, y, z, rx, ry, rz] の配列を返すイテラブル (iter_grid など)
+        decimal_places: CSV の値を丸める小数点以下の桁数
+        integer_columns: CSV で整数で書く列名のリスト
+        戻り値: 書き込んだ点数
+        """
+        with RowLogWriter(output_file, POSE_LOG_COLUMNS, decimal_places=decimal_places, fsync_every=fsync_every,
+                          handle_signals=False, integer_columns=integer_columns) as writer:
+            for poses in pose_chunks:
+                writer.write_rows(self.generate(poses[:, :3], poses[:, 3:6]))
+            return writer.n_rows